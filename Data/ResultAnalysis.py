@@ -155,6 +155,11 @@ class BenchResult:
         ori_check = patch_error['check']['ori']
         patched_check = patch_error['check']['patched']
 
+        # The exit codes of the patch commands, recorded by the lanes, results of older runs have none
+        exit_codes = (item_data.get('exit_code') or {}).get('patched') or {}
+        git_apply_code = exit_codes.get('git_apply')
+        patch_p1_code = exit_codes.get('patch_p1')
+
         patch_valid = False
         p1_regex = (r'Hunk\s+#\d+\s+FAILED|'
                     r'Reversed \(or previously applied\) patch detected|'
@@ -166,7 +171,18 @@ class BenchResult:
         tolerant_valid_patch = load_config().get("Patch", {}).get("tolerant_valid_patch", True)
         p1_regex += r'|Hunk\s+#\d+\s+succeeded' if not tolerant_valid_patch else ''
 
-        if 'error:' not in git_apply_msg and patch_p1_msg == '':
+        if git_apply_code is not None:
+            if git_apply_code == 0:
+                logging.info("Patch applied successfully, no errors found.")
+                patch_valid = True
+            elif patch_p1_code == 0 and (tolerant_valid_patch or not re.search(p1_regex, patch_p1_msg,
+                                                                               re.RegexFlag.IGNORECASE)):
+                logging.info("Patch applied successfully with patch_p1.")
+                patch_valid = True
+            elif ori_check != patched_check:
+                logging.info("After patching, the original and patched code differ.")
+                patch_valid = True
+        elif 'error:' not in git_apply_msg and patch_p1_msg == '':
             logging.info("Patch applied successfully, no errors found.")
             patch_valid = True
         elif tolerant_valid_patch and patch_p1_msg != '' and re.search(r'Hunk\s+#\d+\s+succeeded', patch_p1_msg):
@@ -184,6 +200,11 @@ class BenchResult:
     def check_patch_work(self, item_data=None):
         if item_data is None:
             return False
+        if item_data.get('timeout'):
+            # A lane that timed out has no result to compare, the POC does not show the patch working
+            logging.warning(f"POC {item_data.get('name', '')} timed out in {', '.join(item_data['timeout'])}, "
+                            f"the patch is reported as not working.")
+            return False
 
         ori_result = item_data.get('result_path', {}).get('ori', '')
         patched_result = item_data.get('result_path', {}).get('patched', '')
@@ -247,8 +268,12 @@ class BenchResult:
                 continue
             if self.check_patch_valid(item):
                 valid_patches.append(item)
-            if self.check_patch_work(item):
-                working_patches.append(item)
+            try:
+                if self.check_patch_work(item):
+                    working_patches.append(item)
+            except (ValueError, FileNotFoundError) as e:
+                # One broken record does not stop the analysis of the others
+                logging.warning(f"Cannot compare the results of {item.get('name', '')}, reported as not working: {e}")
 
         logging.info(f"Valid patches found: {len(valid_patches)}")
         logging.info(f"Working patches found: {len(working_patches)}")
@@ -257,7 +282,9 @@ class BenchResult:
             logging.info("-" * 20 + f" VALID PATCHES [{i + 1}] " + "-" * 20)
             git_apply_msg = vp.get('patch_result', {}).get('git_apply', '')
             patch_p1_msg = vp.get('patch_result', {}).get('patch_p1', '')
-            if 'error:' not in git_apply_msg and patch_p1_msg == '':
+            git_apply_code = ((vp.get('exit_code') or {}).get('patched') or {}).get('git_apply')
+            if git_apply_code == 0 or (git_apply_code is None and 'error:' not in (git_apply_msg or '')
+                                       and not patch_p1_msg):
                 logging.info("** THIS PATCH VALID WITHOUT ERROR **")
                 logging.info(f"git apply: {git_apply_msg}\npatch p1: {patch_p1_msg}")
             logging.info(f"Patch valid: {vp['name']}")
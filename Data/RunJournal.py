@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import json
+import time
+import logging
+import threading
+from utils import get_workspace
+
+
+class RunJournal:
+    def __init__(self, run_id: str = '', journal_dir: str = ''):
+        """
+        Append-only journal of a benchmark sweep, one JSON record per line.
+        Every finished benchmark is written as soon as it completes, so a crashed sweep can be resumed.
+        :param run_id: ID of the run, if empty, a new ID will be generated from the current time.
+        :param journal_dir: Directory of the journals, default is `journal` under the workspace.
+        """
+        self.journal_dir = journal_dir if journal_dir else os.path.join(get_workspace(), "journal")
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.run_id = run_id.strip() if run_id else time.strftime('%Y%m%d%H%M%S', time.localtime(time.time()))
+        self.journal_path = os.path.join(self.journal_dir, f"{self.run_id}.jsonl")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str, patch: str) -> str:
+        """
+        Get the key of a benchmark in the journal.
+        :param name: The name of the POC.
+        :param patch: The path to the patch file, '' if there is none.
+        :return: The key of the benchmark.
+        """
+        return f"{name.strip().upper()}|{os.path.abspath(patch) if patch else ''}"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.journal_path)
+
+    def _append(self, record: dict) -> None:
+        """
+        Append a record to the journal and flush it to disk.
+        :param record: The record to append.
+        """
+        with self._lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start(self, patch_dir: str = '', poc_list: list = None) -> None:
+        """
+        Write the header of the run, if the journal is new.
+        :param patch_dir: The directory containing patch files, if any.
+        :param poc_list: A list of POC names to run, None means all available POCs.
+        """
+        if self.exists():
+            logging.info(f"Resuming run {self.run_id} from journal {self.journal_path}")
+            return
+        self._append({"type": "start", "run_id": self.run_id, "time": time.time(), "patch_dir": patch_dir,
+                      "poc_list": poc_list})
+        logging.info(f"Run {self.run_id} is journaled to {self.journal_path}")
+
+    def record(self, bench_result: dict, patch: str = '') -> None:
+        """
+        Record a finished benchmark.
+        :param bench_result: The benchmark result returned by Manage.run_bench.
+        :param patch: The patch selected for the POC, used as part of the key.
+        """
+        self._append({"type": "result", "key": self.key(bench_result.get("name", ""), patch), "time": time.time(),
+                      "bench_result": bench_result})
+
+    def load(self) -> list:
+        """
+        Load all records of the journal, a line cut short by a crash is ignored.
+        :return: List of the records.
+        """
+        records = []
+        if not self.exists():
+            return records
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if line == '':
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f"Ignoring broken line {line_no} in journal {self.journal_path}")
+        return records
+
+    def get_header(self) -> dict:
+        for record in self.load():
+            if record.get("type") == "start":
+                return record
+        return {}
+
+    def completed(self) -> dict:
+        """
+        Get the benchmarks already finished in this run.
+        :return: Dictionary of the key and the benchmark result.
+        """
+        return {record["key"]: record["bench_result"] for record in self.load()
+                if record.get("type") == "result" and record.get("key")}
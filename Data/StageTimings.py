@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import json
+import time
+import heapq
+import logging
+import threading
+from utils import get_workspace
+
+
+class StageTimings:
+    # Number of recent runs kept per stage, the estimate is their median
+    max_samples = 5
+
+    def __init__(self, timings_path: str = ''):
+        """
+        Historical durations of each benchmark stage, stored per POC and commit across runs.
+        They drive the ETA of a sweep and the longest-processing-time-first ordering of the POCs.
+        :param timings_path: Path of the timing database, default is `stage_timings.json` under the workspace.
+        """
+        self.timings_path = timings_path if timings_path else os.path.join(get_workspace(), "stage_timings.json")
+        self._lock = threading.Lock()
+        self.timings = self.load()
+
+    @staticmethod
+    def key(name: str, commit: str) -> str:
+        return f"{name.strip().upper()}|{commit.strip()}"
+
+    def load(self) -> dict:
+        if not os.path.exists(self.timings_path):
+            return {}
+        try:
+            with open(self.timings_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.warning(f"Failed to load stage timings from {self.timings_path}: {e}")
+            return {}
+
+    def save(self) -> None:
+        tmp_path = f"{self.timings_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.timings, f, indent=4)
+        os.replace(tmp_path, self.timings_path)
+
+    @staticmethod
+    def get_stages(bench_result: dict) -> dict:
+        """
+        Flatten the timing of a benchmark result into stage durations.
+        The original and patched lanes run concurrently, so the longer of the two counts.
+        :param bench_result: The benchmark result returned by Manage.run_bench.
+        :return: Dictionary of the stage name and its duration in seconds.
+        """
+        timing = bench_result.get("timing", {}) or {}
+        stages = {}
+        # The preparation and the execution are recorded apart, as the preparation may run ahead with prefetch
+        renamed = {"patch": "patch_download", "total": "prepare"}
+        for stage, duration in (timing.get("prepare", {}) or {}).items():
+            stages[renamed.get(stage, stage)] = duration
+        if timing.get("execute") is not None:
+            stages["execute"] = timing["execute"]
+        for lane in ("ori", "patched"):
+            for stage, duration in (timing.get(lane, {}) or {}).items():
+                if stage == "total":
+                    continue
+                stage = "apply" if stage == "patch" else stage
+                stages[stage] = max(stages.get(stage, 0), duration)
+        if timing.get("total") is not None:
+            stages["total"] = timing["total"]
+        return stages
+
+    def record(self, bench_result: dict) -> None:
+        """
+        Record the stage durations of a finished benchmark.
+        :param bench_result: The benchmark result returned by Manage.run_bench.
+        """
+        stages = self.get_stages(bench_result)
+        if not stages:
+            return
+        key = self.key(bench_result.get("name", ""), bench_result.get("commit", ""))
+        with self._lock:
+            entry = self.timings.setdefault(key, {"runs": 0, "stages": {}})
+            entry["runs"] += 1
+            entry["updated"] = time.time()
+            for stage, duration in stages.items():
+                samples = entry["stages"].setdefault(stage, [])
+                samples.append(round(duration, 3))
+                del samples[:-self.max_samples]
+            try:
+                self.save()
+            except Exception as e:
+                logging.error(f"Failed to save stage timings to {self.timings_path}: {e}")
+
+    def estimate(self, name: str, commit: str, stage: str = "total") -> float | None:
+        """
+        Estimate the duration of a stage of a POC from its history.
+        :param name: The name of the POC.
+        :param commit: The commit of the POC.
+        :param stage: The stage to estimate, default is the whole benchmark.
+        :return: The estimated duration in seconds, or None if the POC has never run.
+        """
+        samples = self.timings.get(self.key(name, commit), {}).get("stages", {}).get(stage, [])
+        if not samples:
+            return None
+        samples = sorted(samples)
+        return samples[len(samples) // 2]
+
+    def estimates(self, pocs: list) -> dict:
+        """
+        Estimate the duration of several POCs, POCs that never ran get the mean of the known ones.
+        :param pocs: List of (name, commit).
+        :return: Dictionary of the name and its estimated duration, empty if none of them ever ran.
+        """
+        known = {name: self.estimate(name, commit) for name, commit in pocs}
+        durations = [d for d in known.values() if d is not None]
+        if not durations:
+            return {}
+        default = sum(durations) / len(durations)
+        return {name: (d if d is not None else default) for name, d in known.items()}
+
+    @staticmethod
+    def makespan(durations: list, jobs: int = 1) -> float:
+        """
+        Simulate the POCs on the workers in the given order, each one going to the first free worker.
+        :param durations: The estimated durations, in the running order.
+        :param jobs: Number of workers.
+        :return: The estimated time until all POCs are done.
+        """
+        workers = [0.0] * max(1, jobs)
+        for duration in durations:
+            heapq.heappush(workers, heapq.heappop(workers) + duration)
+        return max(workers)
+
+    def order_lpt(self, pocs: list) -> list:
+        """
+        Order POCs longest-processing-time-first, which keeps the makespan short when running in parallel.
+        :param pocs: List of (name, commit), in the default order.
+        :return: The names of the POCs in the new order, or in the default order if none of them ever ran.
+        """
+        estimates = self.estimates(pocs)
+        names = [name for name, _ in pocs]
+        if not estimates:
+            return names
+        return sorted(names, key=lambda n: -estimates[n])
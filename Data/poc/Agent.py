@@ -0,0 +1,163 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import subprocess
+
+
+class Agent:
+
+    def __init__(self, job=None, out=None):
+        """
+        In-container agent running the command sequence of a benchmark lane in one call.
+        The job lists the steps to run (apply, check, deploy, exec, ...) and the result file to collect,
+        and the agent reports on them as events, one JSON object per line on its stdout.
+        :param job: The job description, see run.
+        :param out: Stream the events are written to, default is stdout.
+        """
+        self.job = job if job is not None else {}
+        self.out = out if out is not None else sys.stdout
+        self.lock = threading.Lock()
+        self.exit_codes = {}
+        self.process = None
+
+    def emit(self, event, **fields):
+        """
+        Write an event.
+        :param event: Type of the event: start, output, end, timeout, result or done.
+        :param fields: Fields of the event.
+        """
+        fields['event'] = event
+        fields['time'] = time.time()
+        line = json.dumps(fields)
+        with self.lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def pump(self, key, stream_name, stream):
+        """
+        Forward the output of a step line by line as `output` events.
+        :param key: Key of the step.
+        :param stream_name: stdout or stderr.
+        :param stream: The pipe to read.
+        """
+        for line in iter(stream.readline, b''):
+            self.emit('output', key=key, stream=stream_name, data=line.decode('utf-8', errors='replace'))
+        stream.close()
+
+    @staticmethod
+    def kill(process):
+        """
+        Kill a step and all the processes it started.
+        :param process: The process of the step, leading its own session.
+        """
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        process.wait()
+
+    def run_step(self, step, timeout=0):
+        """
+        Run one step of the job.
+        :param step: The step, see run.
+        :param timeout: Timeout of the step in seconds, 0 means no timeout.
+        :return: Exit code of the step, None if it timed out.
+        """
+        key = step.get('key', step.get('stage', ''))
+        command = step.get('command')
+        env = dict(os.environ)
+        env.update(step.get('env') or {})
+        self.emit('start', key=key, stage=step.get('stage', ''), command=command)
+        start = time.time()
+        process = subprocess.Popen(command, shell=not isinstance(command, list), cwd=step.get('cwd') or '/vulbench',
+                                   env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   start_new_session=True)
+        self.process = process
+        pumps = [threading.Thread(target=self.pump, args=(key, name, stream))
+                 for name, stream in (('stdout', process.stdout), ('stderr', process.stderr))]
+        for pump in pumps:
+            pump.daemon = True
+            pump.start()
+        try:
+            exit_code = process.wait(timeout=timeout if timeout else None)
+        except subprocess.TimeoutExpired:
+            self.kill(process)
+            exit_code = None
+        for pump in pumps:
+            pump.join(5)
+        self.process = None
+        self.exit_codes[key] = exit_code
+        self.emit('end', key=key, stage=step.get('stage', ''), exit_code=exit_code, duration=time.time() - start)
+        return exit_code
+
+    def terminate(self, signum, frame):
+        """
+        Signal handler stopping the agent along with the step it runs, which leads its own session.
+        """
+        # The step is not waited for here, the main thread may be waiting for it already
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        sys.exit(128 + signum)
+
+    def collect(self):
+        """
+        Read the result file of the job and send it as a `result` event, its content is None if there is none.
+        """
+        result_path = self.job.get('result', '/vulbench/vb_poc_result.json')
+        content = None
+        if os.path.exists(result_path):
+            with open(result_path, 'r') as f:
+                content = f.read()
+        self.emit('result', path=result_path, content=content)
+
+    def run(self):
+        """
+        Run the steps of the job one after another, then collect its result.
+        The job is a dictionary of `steps`, the number of seconds it may run as `deadline` (0 means no deadline),
+        and the path of its `result` file. Each step is a dictionary of:
+        `key` naming it in the events, `stage` it belongs to, `command` (a string run by the shell, or a list),
+        `timeout` in seconds (0 means no timeout), `env` variables added to the environment, `cwd` (default /vulbench)
+        and `if_failed`, the key of a step it only runs after if that one failed (e.g. a fallback).
+        A step timing out stops the job.
+        :return: True if the job ran to the end.
+        """
+        start = time.time()
+        deadline = self.job.get('deadline') or 0
+        for step in self.job.get('steps', []):
+            if step.get('if_failed') and self.exit_codes.get(step['if_failed']) == 0:
+                continue
+            timeout = step.get('timeout') or 0
+            if deadline:
+                left = deadline - (time.time() - start)
+                timeout = min(timeout, left) if timeout else left
+                if timeout <= 0:
+                    self.emit('timeout', key=step.get('key', ''), stage=step.get('stage', ''), seconds=0)
+                    return False
+            if self.run_step(step, timeout=timeout) is None:
+                self.emit('timeout', key=step.get('key', ''), stage=step.get('stage', ''), seconds=timeout)
+                return False
+        self.collect()
+        self.emit('done', duration=time.time() - start)
+        return True
+
+
+if __name__ == '__main__':
+    # The job is given as JSON, or as the path of a JSON file
+    job_arg = sys.argv[1] if len(sys.argv) > 1 else '/vulbench/vb_job.json'
+    if job_arg.lstrip().startswith('{'):
+        job_data = json.loads(job_arg)
+    else:
+        with open(job_arg, 'r') as job_file:
+            job_data = json.load(job_file)
+    agent = Agent(job_data)
+    signal.signal(signal.SIGTERM, agent.terminate)
+    sys.exit(0 if agent.run() else 1)
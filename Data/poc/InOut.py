@@ -7,6 +7,7 @@ import logging
 import time
 import json
 import base64
+import shlex
 
 
 class InOut:
@@ -33,14 +34,113 @@ class InOut:
         self.poc_dependencies = poc_dependencies if poc_dependencies is not None else []
         self.start_time = time.time()
         self.end_time = time.time()
+        # Time spent in env_init, and the dependencies found installed in the image or installed by it
+        self.env_init_info = {'time': 0, 'baked': 0, 'installed': 0}
+        env_init_start = time.time()
         self.env_init(output=output_dependencies)
+        self.env_init_info['time'] = time.time() - env_init_start
         self.expected_output = ''
         self.expected_error = ''
         self.expected_time = 0
 
+    @staticmethod
+    def baked_dependencies(baked_file='/vulbench/vb_poc_dependencies.txt'):
+        """
+        Get the dependencies installed in the image when it was built, see Deploy.poc_dependency_cmd.
+        :param baked_file: The file recording them, one JSON string per line.
+        :return: Set of the dependencies.
+        """
+        baked = set()
+        if not os.path.exists(baked_file):
+            return baked
+        try:
+            with open(baked_file, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        baked.add(json.loads(line))
+        except Exception as e:
+            logging.warning('Failed to read the dependencies installed in the image: {}'.format(e))
+        return baked
+
+    @staticmethod
+    def verify_dependency(dependency):
+        """
+        Check that the requirements of a dependency installed in the image are still satisfied.
+        Commands and local paths can not be checked and are trusted.
+        :param dependency: The dependency, as given in poc_dependencies.
+        :return: True if it is satisfied.
+        """
+        if dependency.startswith('@'):
+            return True
+        try:
+            tokens = shlex.split(dependency)
+        except ValueError:
+            return False
+        if tokens[:2] == ['pip', 'install']:
+            tokens = tokens[2:]
+        requirements = []
+        skip = False
+        for token in tokens:
+            if skip:
+                skip = False
+            elif token in ('-e', '--editable', '-r', '--requirement', '-c', '--constraint'):
+                skip = True
+            elif not token.startswith(('-', '.', '/')):
+                requirements.append(token)
+        if not requirements:
+            return True
+        for requirement in requirements:
+            try:
+                satisfied = InOut.requirement_satisfied(requirement)
+            except Exception as e:
+                logging.warning('Dependency {} installed in the image is not satisfied: {}'.format(requirement, e))
+                return False
+            if satisfied is None:
+                logging.warning('Dependency {} installed in the image can not be checked, '
+                                'neither importlib.metadata nor pkg_resources is available'.format(requirement))
+                return False
+            if not satisfied:
+                logging.warning('Dependency {} installed in the image is not satisfied'.format(requirement))
+                return False
+        return True
+
+    @staticmethod
+    def requirement_satisfied(requirement):
+        """
+        Check a requirement against the installed distributions, with importlib.metadata where it exists
+        (Python 3.8+), otherwise with pkg_resources.
+        :param requirement: The requirement, e.g. `lxml==4.9.2`.
+        :return: True if it is satisfied, False if not, None if it can not be checked.
+        :raise Exception: If the requirement is invalid or its distribution is not installed.
+        """
+        try:
+            from importlib import metadata
+        except ImportError:
+            metadata = None
+        try:
+            from packaging.requirements import Requirement
+        except ImportError:
+            try:
+                from pip._vendor.packaging.requirements import Requirement
+            except ImportError:
+                Requirement = None
+        if metadata is not None and Requirement is not None:
+            parsed = Requirement(requirement)
+            if parsed.marker is not None and not parsed.marker.evaluate():
+                return True
+            version = metadata.version(parsed.name)
+            return parsed.specifier.contains(version, prereleases=True)
+        try:
+            import pkg_resources
+        except ImportError:
+            return None
+        pkg_resources.get_distribution(requirement)
+        return True
+
     def env_init(self, output=True):
         """
         Initialize the environment by installing required dependencies.
+        Dependencies already installed in the image are only verified.
         :param output: If True, output the dependencies installed.
         :return: If dependencies are installed successfully, return True; otherwise, return False.
         """
@@ -49,10 +149,18 @@ class InOut:
         if len(self.poc_dependencies) == 0:
             return True
 
+        # Packages pip took from its cache and those it had to download, reported to the host in one line
+        pip_hits, pip_misses = 0, 0
+        baked = self.baked_dependencies()
         for dependency in self.poc_dependencies:
             dependency = dependency.strip()
             if dependency == '':
                 continue
+            if dependency in baked and self.verify_dependency(dependency):
+                logging.info('Dependency already installed in the image: {}'.format(dependency))
+                self.env_init_info['baked'] += 1
+                continue
+            self.env_init_info['installed'] += 1
             try:
                 if dependency.startswith('@'):
                     logging.warning("Installing dependency by cmd directly: {}".format(dependency))
@@ -67,12 +175,21 @@ class InOut:
                     continue
                 pip_cmd = "pip install {}".format(dependency) if not dependency.startswith('pip') else dependency
                 logging.info('Installing dependency via pip: {}'.format(dependency))
-                subprocess.run(pip_cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, )
+                result = subprocess.run(pip_cmd, shell=True, check=True, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, universal_newlines=True)
+                for line in result.stdout.splitlines():
+                    line = line.strip()
+                    if line.startswith('Using cached '):
+                        pip_hits += 1
+                    elif line.startswith('Downloading '):
+                        pip_misses += 1
                 logging.info('Successfully installed dependency: {}'.format(dependency))
                 continue
             except Exception as e:
                 logging.error('Failed to install dependency {}: {}'.format(dependency, e))
                 continue
+        if pip_hits or pip_misses:
+            logging.info('[vb_pip_cache] hits={} misses={}'.format(pip_hits, pip_misses))
 
     def save_result(self, output_file='vb_poc_result.json', poc=None, poc_input=None, poc_output=None, poc_error=None,
                     running_time=None, expected_output=None, expected_error=None, expected_time=None,
@@ -109,6 +226,7 @@ class InOut:
                 'ontime': False,
                 'is_dos': False,
             } if match_result is None else match_result,
+            'env_init': self.env_init_info,
         }
 
         try:
@@ -120,9 +238,12 @@ class InOut:
     def run(self, timeout=None):
         """
         Run the POC with the provided input and capture the output.
-        :param timeout: Timeout for the POC execution in seconds, default is None (no timeout).
+        :param timeout: Timeout for the POC execution in seconds, default is None,
+        which takes VB_POC_TIMEOUT from the environment if it is set by VulBench, otherwise no timeout.
         :return: Returns the output of the POC execution, error message if any, and the running time.
         """
+        if timeout is None and os.environ.get('VB_POC_TIMEOUT', '').isdigit():
+            timeout = int(os.environ['VB_POC_TIMEOUT'])
         logging.info('Starting POC execution: {}'.format(self.poc_file))
         self.start_time = time.time()
         try:
@@ -0,0 +1,237 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import json
+import logging
+import threading
+from Docker.DockerHandle import DockerHandle
+from utils import load_config
+
+
+class ContainerPool:
+    def __init__(self, per_image: int = 2, max_idle: int = 8, slots=None):
+        """
+        Pool of pre-started containers keyed by image, so a benchmark does not wait for its containers to start.
+        Containers are started in the background once the image of a benchmark is built, handed out to its lanes,
+        and discarded after use, as the lanes leave them patched and with the POC installed.
+        Each idle or starting container holds one of the container slots, it is only started if a slot is free,
+        and idle ones are removed when a benchmark waits for slots, see reserve.
+        :param per_image: Maximum number of idle containers kept per image, 0 disables the pool.
+        :param max_idle: Maximum number of idle containers kept over all images, 0 means no limit.
+        :param slots: The container slots, default is DockerHandle.container_slots.
+        """
+        self.per_image = max(0, int(per_image or 0))
+        self.max_idle = max(0, int(max_idle or 0))
+        self.slots = DockerHandle.container_slots if slots is None else slots
+        self.slots.reclaim = self.reclaim
+        self._idle = {}  # key -> list of container IDs ready to be handed out
+        self._starting = {}  # key -> number of containers being started
+        self._owned = {}  # key -> number of idle and starting containers whose slot the pool holds, see reserve
+        self._handles = {}  # key -> DockerHandle of the containers
+        self._releasing = []  # threads removing used containers
+        self._reclaiming = 0  # number of idle containers being removed to free their slots
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls):
+        """
+        Create the pool from `Bench.warm_containers` and `Bench.max_warm_containers` in the config.
+        :return: ContainerPool object.
+        """
+        bench_config = load_config().get("Bench", {}) or {}
+        return cls(per_image=bench_config.get("warm_containers", 2), max_idle=bench_config.get("max_warm_containers", 8))
+
+    @staticmethod
+    def key(dh: DockerHandle, image, run_kwargs: dict = None) -> tuple:
+        return dh.base_url, image.id, json.dumps(run_kwargs or {}, sort_keys=True, default=str)
+
+    def idle_count(self) -> int:
+        return sum(len(ids) for ids in self._idle.values()) + sum(self._starting.values())
+
+    def _count(self, key: tuple) -> int:
+        return len(self._idle.get(key, [])) + self._starting.get(key, 0)
+
+    def _disown(self, key: tuple) -> int:
+        """
+        Called with the lock held when a container of a key leaves the pool. The slots of the containers
+        reserved by a benchmark belong to it, so the pool only gives back a slot if it owned the container.
+        :return: Number of slots to give back once the lock is released.
+        """
+        if self._count(key) < self._owned.get(key, 0):
+            self._owned[key] -= 1
+            return 1
+        return 0
+
+    def warm(self, dh: DockerHandle, image, run_kwargs: dict = None, n: int = 0) -> None:
+        """
+        Start containers of an image in the background, up to n idle ones, `per_image` and the global limit.
+        :param dh: The Docker handle of the daemon holding the image.
+        :param image: Docker image object.
+        :param run_kwargs: Additional arguments for running the containers.
+        :param n: Number of containers wanted, default is `per_image`.
+        """
+        if self.per_image == 0 or image is None:
+            return
+        if (run_kwargs or {}).get("ports"):
+            # Published ports can only be bound by one container at once, the previous run may still hold them
+            return
+        key = self.key(dh, image, run_kwargs)
+        n = min(n, self.per_image) if n else self.per_image
+        with self._cond:
+            missing = n - self._count(key)
+            if self.max_idle:
+                missing = min(missing, self.max_idle - self.idle_count())
+        # Containers are only pre-started in the free slots, they never wait for one
+        started = 0
+        while started < missing and self.slots.try_acquire():
+            started += 1
+        if started == 0:
+            return
+        with self._cond:
+            self._starting[key] = self._starting.get(key, 0) + started
+            self._owned[key] = self._owned.get(key, 0) + started
+            self._handles[key] = dh
+        for _ in range(started):
+            threading.Thread(target=self._start, args=(dh, image, run_kwargs, key), daemon=True).start()
+
+    def _start(self, dh: DockerHandle, image, run_kwargs: dict, key: tuple) -> None:
+        container = dh.run_by_image(image=image, run_kwargs=run_kwargs, suffix="warm")
+        with self._cond:
+            self._starting[key] -= 1
+            if container is not None:
+                self._idle.setdefault(key, []).append(container.id)
+                freed = 0
+            else:
+                freed = self._disown(key)
+            self._cond.notify_all()
+        self.slots.release(freed)
+
+    def reserve(self, dh: DockerHandle, image, run_kwargs: dict = None, n: int = 1) -> int:
+        """
+        Take the container slots of a benchmark, the slots held by its idle and starting containers first,
+        which pass to the benchmark along with the containers it then gets from acquire.
+        If that is not enough and the other slots are busy, the benchmark waits for slots like any other,
+        while the idle containers of the pool are removed to make room, see reclaim.
+        :param dh: The Docker handle of the daemon holding the image.
+        :param image: Docker image object.
+        :param run_kwargs: Additional arguments for running the containers.
+        :param n: Number of slots wanted, capped at the total number of slots.
+        :return: Number of slots taken, to be given back with self.slots.release.
+        """
+        if self.per_image == 0 or image is None:
+            return self.slots.acquire(n)
+        if self.slots.total > 0:
+            n = min(n, self.slots.total)
+        key = self.key(dh, image, run_kwargs)
+        with self._cond:
+            claimed = min(n, self._owned.get(key, 0))
+            self._owned[key] = self._owned.get(key, 0) - claimed
+        if claimed == n or self.slots.try_acquire(n - claimed):
+            return n
+        # Waiting while holding only a part of the slots could deadlock with another benchmark doing the same
+        with self._cond:
+            owned = self._owned[key] + claimed
+            self._owned[key] = min(owned, self._count(key))
+        self.slots.release(owned - self._owned[key])
+        return self.slots.acquire(n)
+
+    def reclaim(self, n: int) -> None:
+        """
+        Remove up to n idle containers owned by the pool in the background, and give back their slots once removed.
+        Called by the container slots while a benchmark waits for slots.
+        :param n: Number of slots wanted.
+        """
+        evicted = []
+        with self._cond:
+            # The slots of the containers already being removed are on their way
+            n -= self._reclaiming
+            for key, ids in self._idle.items():
+                while ids and len(evicted) < n and self._owned.get(key, 0) > 0:
+                    evicted.append((self._handles[key], ids.pop(0)))
+                    self._owned[key] -= 1
+            self._reclaiming += len(evicted)
+        for dh, container_id in evicted:
+            logging.info(f"Removing pre-started container {container_id} to free its slot.")
+            thread = threading.Thread(target=self._remove, args=(dh, container_id), daemon=True)
+            thread.start()
+            with self._cond:
+                self._releasing = [t for t in self._releasing if t.is_alive()] + [thread]
+
+    def _remove(self, dh: DockerHandle, container_id: str) -> None:
+        try:
+            dh.container_remove(container_id)
+        finally:
+            with self._cond:
+                self._reclaiming -= 1
+            self.slots.release(1)
+
+    def acquire(self, dh: DockerHandle, image, run_kwargs: dict = None, patched: bool = False, suffix: str = ''):
+        """
+        Get a running container of an image, a pre-started one if any is ready or about to be, otherwise a new one.
+        :param dh: The Docker handle of the daemon holding the image.
+        :param image: Docker image object.
+        :param run_kwargs: Additional arguments for running the container.
+        :param patched: If True and a new container is started, add `patched` suffix to its name.
+        :param suffix: Suffix added to the name of a new container.
+        :return: The container object, or None if it could not be started.
+        """
+        if self.per_image > 0 and image is not None:
+            key = self.key(dh, image, run_kwargs)
+            with self._cond:
+                # A container being started is ready sooner than a new one
+                while not self._idle.get(key) and self._starting.get(key, 0) > 0:
+                    self._cond.wait()
+                container_id = self._idle[key].pop(0) if self._idle.get(key) else None
+                # The benchmark holds a slot for the container, whether it reserved this one or not
+                freed = self._disown(key) if container_id is not None else 0
+            self.slots.release(freed)
+            if container_id is not None:
+                try:
+                    container = dh.get_container(container_id)
+                except Exception as e:
+                    logging.warning(f"Pre-started container {container_id} is gone: {e}")
+                    container = None
+                if container is not None and container.status == 'running':
+                    with self._cond:
+                        self.hits += 1
+                    logging.info(f"Using pre-started container {container.name} of image {image.id}")
+                    return container
+                elif container is not None:
+                    dh.container_remove(container_id)
+        with self._cond:
+            self.misses += 1
+        return dh.run_by_image(image=image, patched=patched, run_kwargs=run_kwargs, suffix=suffix)
+
+    def release(self, dh: DockerHandle, container_id: str) -> None:
+        """
+        Discard a used container in the background, it is left patched and can not be handed out again.
+        :param dh: The Docker handle of the container.
+        :param container_id: ID of the container.
+        """
+        thread = threading.Thread(target=dh.container_remove, args=(container_id,), daemon=True)
+        thread.start()
+        with self._cond:
+            self._releasing = [t for t in self._releasing if t.is_alive()] + [thread]
+
+    def drain(self) -> None:
+        """
+        Remove all idle containers, once the containers being started are up, and wait for the used ones to be removed.
+        """
+        with self._cond:
+            while sum(self._starting.values()) > 0:
+                self._cond.wait()
+            idle = [(self._handles[key], container_id) for key, ids in self._idle.items() for container_id in ids]
+            self._idle.clear()
+            owned = sum(self._owned.values())
+            self._owned.clear()
+            releasing, self._releasing = self._releasing, []
+        for thread in releasing:
+            thread.join()
+        for dh, container_id in idle:
+            dh.container_remove(container_id)
+        self.slots.release(owned)
+        if self.hits or self.misses:
+            logging.info(f"Container pool: {self.hits} pre-started containers used, {self.misses} started on demand, "
+                         f"{len(idle)} unused removed.")
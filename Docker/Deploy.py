@@ -3,7 +3,7 @@ __author__ = 'WILL_V'
 
 import logging
 import os
-from typing import Any
+from typing import Any, IO
 import git
 import requests
 import zipfile
@@ -11,18 +11,37 @@ import tarfile
 import subprocess
 import json
 import shutil
-from Docker.template import get_dockerfile
+import threading
+import uuid
+import hashlib
+import ast
+import shlex
+import time
+import tempfile
+import re
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+from Docker.template import get_dockerfile, BASE_DEPENDENCIES
 from Docker.DockerHandle import DockerHandle
+from Docker.DownloadCache import DownloadCache
 from utils import get_workspace
 
 
 class Deploy:
-    def __init__(self):
+    # pkg_installed_info.json is shared by all deployments in the workspace
+    pkg_info_lock = threading.Lock()
+
+    def __init__(self, docker_handle: DockerHandle = None):
         """
         Deploy class for managing deployment tasks such as downloading files,
+        :param docker_handle: The Docker daemon to deploy on, if None, the default daemon is used.
         """
         self.space_path = get_workspace()
-        self.docker_handle = DockerHandle()
+        self.docker_handle = docker_handle if docker_handle is not None else DockerHandle()
 
     def download(self, url: str, path='') -> str:
         """
@@ -33,14 +52,19 @@ class Deploy:
         """
         if path == '':
             path = os.path.join(self.space_path, url.split('/')[-1])
-        response = requests.get(url)
         logging.info(f"Downloading {url} to {path}")
+        cached_path = DownloadCache().fetch(url)
+        if cached_path is None:
+            return ''
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
         try:
-            with open(path, 'wb') as file:
-                file.write(response.content)
+            shutil.copyfile(cached_path, tmp_path)
+            os.replace(tmp_path, path)
             return path
         except Exception as e:
             logging.error(f"Failed to download {url} to {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return ''
 
     @staticmethod
@@ -160,6 +184,268 @@ class Deploy:
         except Exception as e:
             logging.error(f"Failed to check out commit {commit} in repository {repo_path}: {e}")
 
+    def get_mirror_path(self, repo_url: str) -> str:
+        """
+        Gets the path of the bare mirror of a Git repository in the workspace.
+        :param repo_url: The URL of the Git repository.
+        :return: The path of the mirror, `mirrors/<repo>.git` under the workspace.
+        """
+        return os.path.join(self.space_path, "mirrors", repo_url.rstrip('/').split('/')[-1].removesuffix('.git') + ".git")
+
+    @staticmethod
+    def list_files(path: str) -> list:
+        """
+        Lists the files of a directory, only tracked and untracked but not ignored files if it is a Git working tree.
+        :param path: The directory.
+        :return: List of the file paths relative to the directory.
+        """
+        try:
+            output = git.Repo(path).git.ls_files("-z", "--cached", "--others", "--exclude-standard")
+            return sorted(set(f for f in output.split("\0") if f and os.path.lexists(os.path.join(path, f))))
+        except Exception as e:
+            logging.warning(f"Failed to list files of {path} with git, taking all files: {e}")
+        files = []
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), path))
+        return sorted(files)
+
+    def build_context(self, dockerfile_path: str, file_path: str) -> IO[bytes]:
+        """
+        Builds a minimal Docker build context: the Dockerfile and the files of the repository,
+        at the same paths relative to the workspace as the Dockerfile uses.
+        :param dockerfile_path: Path to the Dockerfile.
+        :param file_path: The path of the repository in the workspace.
+        :return: An uncompressed tar file, rewound to its start.
+        """
+        context_start = time.time()
+        context = tempfile.TemporaryFile()
+        files = self.list_files(file_path)
+        with tarfile.open(fileobj=context, mode='w') as tar:
+            tar.add(dockerfile_path, arcname=os.path.basename(dockerfile_path))
+            rel_path = os.path.relpath(file_path, self.space_path)
+            for f in files:
+                tar.add(os.path.join(file_path, f), arcname=os.path.join(rel_path, f), recursive=False)
+        size = context.tell()
+        context.seek(0)
+        logging.info(f"Build context of {rel_path} is {size / 1024 / 1024:.2f} MB with {len(files)} files, "
+                     f"packed in {time.time() - context_start:.2f} seconds.")
+        return context
+
+    @staticmethod
+    def get_tree_version(path: str) -> tuple[str, str]:
+        """
+        Gets the commit a Git working tree is checked out at, and the latest tag reachable from it.
+        :param path: The path of the working tree.
+        :return: The commit and the tag, '' if the path is not a Git working tree or no tag is reachable.
+        """
+        if not os.path.exists(os.path.join(path, '.git')):
+            return '', ''
+        try:
+            repo = git.Repo(path)
+            commit = repo.head.commit.hexsha
+        except Exception as e:
+            logging.warning(f"Failed to get the commit of {path}: {e}")
+            return '', ''
+        try:
+            tag = repo.git.describe("--tags", "--abbrev=0")
+        except Exception:
+            tag = ''
+        return commit, tag
+
+    def get_worktree_dir(self, repo_name: str) -> str:
+        """
+        Gets the directory holding the worktrees of a Git repository in the workspace.
+        :param repo_name: The name of the repository.
+        :return: The directory of the worktrees, `worktrees/<repo>` under the workspace.
+        """
+        return os.path.join(self.space_path, "worktrees", repo_name)
+
+    @staticmethod
+    def has_commit(repo_path: str, commit: str) -> bool:
+        """
+        Checks whether a commit exists in a Git repository.
+        :param repo_path: The local path to the Git repository.
+        :param commit: The commit hash.
+        :return: True if the commit exists.
+        """
+        try:
+            git.Repo(repo_path).git.cat_file("-e", f"{commit}^{{commit}}")
+            return True
+        except Exception:
+            return False
+
+    def mirror(self, repo_url: str, commit: str = '') -> str:
+        """
+        Mirrors the branches and tags of a Git repository into a bare repository in the workspace,
+        or fetches them incrementally if the commit is missing. Other refs, such as the pull requests of GitHub,
+        are left out, a commit only reachable from them is fetched on its own.
+        :param repo_url: The URL of the Git repository.
+        :param commit: The commit needed, if it already exists in the mirror nothing is fetched.
+        :return: The path of the mirror.
+        """
+        path = self.get_mirror_path(repo_url)
+        if not repo_url.startswith("http"):
+            repo_url = "https://github.com/" + repo_url.lstrip('/')
+        if not os.path.exists(path):
+            logging.info(f"Mirroring repository {repo_url} to {path}")
+            try:
+                git.Repo.clone_from(repo_url, path, bare=True)
+            except Exception as e:
+                logging.error(f"Failed to mirror repository {repo_url}: {e}")
+                return path
+        elif commit and self.has_commit(path, commit):
+            logging.info(f"Commit {commit} already exists in mirror {path}. Skipping fetch.")
+            return path
+        try:
+            repo = git.Repo(path)
+            # Mirrors made with `--mirror` fetch every ref, restrict them to the branches as well
+            repo.git.config("--replace-all", "remote.origin.fetch", "+refs/heads/*:refs/heads/*")
+            repo.git.config("remote.origin.mirror", "false")
+            if not (commit and self.has_commit(path, commit)):
+                logging.info(f"Fetching repository {repo_url} into mirror {path}")
+                repo.git.fetch("--prune", "--tags", "origin")
+            if commit and not self.has_commit(path, commit):
+                logging.info(f"Commit {commit} is not on a branch or tag, fetching it alone into mirror {path}")
+                repo.git.fetch("origin", f"{commit}:refs/vulbench/{commit}")
+        except Exception as e:
+            logging.error(f"Failed to fetch repository {repo_url} into mirror {path}: {e}")
+        return path
+
+    @staticmethod
+    def is_patch(path: str) -> bool:
+        """
+        Checks whether a file looks like a patch generated by Git, rather than e.g. an HTML error page.
+        :param path: The path of the file.
+        :return: True if it starts with `From ` or contains a `diff --git` header.
+        """
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return False
+        return content.startswith(b"From ") or b"diff --git" in content
+
+    @staticmethod
+    def format_patch(repo_path: str, commit: str, path: str) -> str | None:
+        """
+        Generates the patch of a commit against its parent from a local Git repository, like `git format-patch`.
+        The patch is cached at the given path, an existing file is reused if it is a patch, see is_patch.
+        :param repo_path: The local path to the Git repository.
+        :param commit: The commit hash.
+        :param path: The path to save the patch to.
+        :return: The path of the patch, or None if the commit is not in the repository or its patch is empty,
+                 e.g. for a merge commit.
+        """
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            if Deploy.is_patch(path):
+                logging.info(f"Patch of commit {commit} already exists at {path}. Skipping.")
+                return path
+            logging.warning(f"Cached patch {path} of commit {commit} is not a patch, generating it again.")
+        try:
+            repo = git.Repo(repo_path)
+            if len(repo.commit(commit).parents) > 1:
+                # format-patch skips merges, it would return the patch of an older commit instead
+                logging.warning(f"Commit {commit} is a merge commit, its patch cannot be generated from {repo_path}.")
+                return None
+            content = repo.git.format_patch("-1", "--stdout", commit, stdout_as_string=False)
+        except Exception as e:
+            logging.error(f"Failed to generate patch of commit {commit} from {repo_path}: {e}")
+            return None
+        if not content.strip():
+            logging.warning(f"Patch of commit {commit} generated from {repo_path} is empty.")
+            return None
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content if content.endswith(b"\n") else content + b"\n")
+        os.replace(tmp_path, path)
+        logging.info(f"Patch of commit {commit} generated from {repo_path} to {path}")
+        return path
+
+    def add_worktree(self, mirror_path: str, commit: str, repo_name: str = '') -> str:
+        """
+        Adds a detached worktree of a mirror at a commit, private to one benchmark.
+        :param mirror_path: The path of the mirror.
+        :param commit: The commit hash to check out.
+        :param repo_name: The name of the repository, default is the name of the mirror.
+        :return: The path of the worktree, `worktrees/<repo>/<repo>_<commit>_<pid>_<id>` under the workspace.
+                 The ID of the process lets prune_worktrees tell the worktrees of interrupted runs.
+        """
+        repo_name = repo_name if repo_name else os.path.basename(mirror_path).removesuffix('.git')
+        path = os.path.join(self.get_worktree_dir(repo_name),
+                            f"{repo_name}_{commit[:7]}_{os.getpid()}_{uuid.uuid4().hex[:8]}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logging.info(f"Adding worktree of {mirror_path} at commit {commit} to {path}")
+        git.Repo(mirror_path).git.worktree("add", "--detach", path, commit)
+        return path
+
+    @staticmethod
+    def remove_worktree(mirror_path: str, path: str) -> None:
+        """
+        Removes a worktree added by add_worktree.
+        :param mirror_path: The path of the mirror.
+        :param path: The path of the worktree.
+        """
+        try:
+            git.Repo(mirror_path).git.worktree("remove", "--force", path)
+            logging.info(f"Removed worktree {path}")
+        except Exception as e:
+            logging.error(f"Failed to remove worktree {path}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def pid_alive(pid: int) -> bool:
+        """
+        Checks whether a process is running on this host.
+        :param pid: The ID of the process.
+        :return: True if it is running.
+        """
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def prune_worktrees(self) -> None:
+        """
+        Removes the worktrees left behind by interrupted runs, whose process is gone, and prunes them from
+        their mirrors. The worktrees of other runs sharing the workspace are left alone.
+        """
+        worktrees_path = os.path.join(self.space_path, "worktrees")
+        mirrors_path = os.path.join(self.space_path, "mirrors")
+        if os.path.exists(worktrees_path):
+            for repo_name in os.listdir(worktrees_path):
+                repo_dir = os.path.join(worktrees_path, repo_name)
+                if not os.path.isdir(repo_dir):
+                    continue
+                for worktree in os.listdir(repo_dir):
+                    # <repo>_<commit>_<pid>_<id>, see add_worktree
+                    pid = worktree.split('_')[-2] if worktree.count('_') >= 3 else ''
+                    if pid.isdigit() and int(pid) != os.getpid() and not self.pid_alive(int(pid)):
+                        logging.info(f"Removing worktree {worktree} left behind by process {pid}")
+                        shutil.rmtree(os.path.join(repo_dir, worktree), ignore_errors=True)
+        if not os.path.exists(mirrors_path):
+            return
+        for mirror in os.listdir(mirrors_path):
+            try:
+                git.Repo(os.path.join(mirrors_path, mirror)).git.worktree("prune")
+            except Exception as e:
+                logging.error(f"Failed to prune worktrees of mirror {mirror}: {e}")
+
+    @staticmethod
+    def get_head(repo_path: str) -> str:
+        """
+        Gets the commit currently checked out in a Git repository.
+        :param repo_path: The local path to the Git repository.
+        :return: The commit hash, or '' if it can not be read.
+        """
+        try:
+            return git.Repo(repo_path).head.commit.hexsha
+        except Exception:
+            return ''
+
     def unzip(self, file_path: str, extract_to='') -> None:
         """
         Unzips or tars a file based on its extension.
@@ -328,6 +614,191 @@ class Deploy:
             json.dump(pkg_installed_info, f, indent=4)
         return install_commands
 
+    @staticmethod
+    def setup_requires(setup_path: str) -> list:
+        """
+        Gets the literal `install_requires` of a setup.py without running it.
+        :param setup_path: The path of setup.py.
+        :return: List of the requirements, empty if they are not a literal list.
+        """
+        try:
+            with open(setup_path, 'r', encoding='utf-8') as f:
+                tree = ast.parse(f.read())
+        except Exception as e:
+            logging.warning(f"Failed to parse {setup_path}: {e}")
+            return []
+        names = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                names[node.targets[0].id] = node.value
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            for keyword in node.keywords:
+                if keyword.arg != "install_requires":
+                    continue
+                value = names.get(keyword.value.id) if isinstance(keyword.value, ast.Name) else keyword.value
+                try:
+                    requires = ast.literal_eval(value) if value is not None else []
+                except ValueError:
+                    return []
+                return [r for r in requires if isinstance(r, str)]
+        return []
+
+    @staticmethod
+    def poc_dependencies(run_path: str) -> list:
+        """
+        Gets the literal `poc_dependencies` passed to InOut in the run.py of a POC without running it.
+        :param run_path: The path of run.py.
+        :return: List of the dependencies, empty if there are none or they are not a literal list.
+        """
+        try:
+            with open(run_path, 'r', encoding='utf-8') as f:
+                tree = ast.parse(f.read())
+        except Exception as e:
+            logging.warning(f"Failed to parse {run_path}: {e}")
+            return []
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            for keyword in node.keywords:
+                if keyword.arg != "poc_dependencies":
+                    continue
+                try:
+                    dependencies = ast.literal_eval(keyword.value)
+                except ValueError:
+                    return []
+                return [d for d in dependencies if isinstance(d, str)] if isinstance(dependencies, list) else []
+        return []
+
+    @staticmethod
+    def reinstall_cmd(install_commands: list) -> list:
+        """
+        Gets the commands reinstalling a project after its source is patched in a container started from
+        a deployed snapshot, see deploy_snapshot. The install commands that leave the code in place (editable
+        installs, dependency installs, poetry and hatch environments) are skipped. Those building or copying it
+        (e.g. `pip install .[extra]`, `python setup.py build_ext`, `make`) are rerun, and local pip installs are forced.
+        :param install_commands: The commands installing the project.
+        :return: List of the commands.
+        """
+        commands = []
+        for command in install_commands:
+            command = command.strip()
+            try:
+                tokens = shlex.split(command)
+            except ValueError:
+                commands.append(command)
+                continue
+            if tokens[:2] == ["python", "-m"]:
+                tokens = tokens[2:]
+            if tokens[:2] == ["pip", "install"]:
+                args = tokens[2:]
+                if any(a in ("-e", "--editable") or a.startswith("--editable=") for a in args):
+                    continue
+                if not any(a == "." or a.startswith((".[", "./", "/vulbench")) for a in args):
+                    continue
+                commands.append(f"{command} --no-deps --force-reinstall")
+            elif tokens[:1] == ["poetry"] or tokens[:2] == ["hatch", "env"]:
+                continue
+            elif command:
+                commands.append(command)
+        return commands
+
+    @staticmethod
+    def poc_dependency_cmd(poc_dependencies: list) -> list:
+        """
+        Gets the commands installing the `poc_dependencies` of a POC the way InOut.env_init does, after the project.
+        Each installed dependency is recorded in /vulbench/vb_poc_dependencies.txt, so env_init only verifies it.
+        A failure is left to env_init, which installs the dependency again.
+        :param poc_dependencies: The `poc_dependencies` of the POC.
+        :return: List of the commands.
+        """
+        commands = []
+        for dependency in poc_dependencies:
+            dependency = dependency.strip()
+            if dependency == '':
+                continue
+            if dependency.startswith('@'):
+                command = dependency[1:]
+            else:
+                command = f"pip install {dependency}" if not dependency.startswith('pip') else dependency
+            commands.append(f"{command} && echo {shlex.quote(json.dumps(dependency))} >> /vulbench/vb_poc_dependencies.txt"
+                            f" || echo 'Installing a POC dependency failed, left to env_init'")
+        return commands
+
+    @staticmethod
+    def pip_requirements(dependency: str) -> list:
+        """
+        Gets the requirements installed from PyPI by a POC dependency, as InOut.env_init installs it.
+        Options (e.g. --force-reinstall), local paths (e.g. -e .) and commands (starting with @) are left out.
+        :param dependency: The POC dependency, e.g. `--force-reinstall "PyYAML<5.1"`.
+        :return: List of the requirements, e.g. ["PyYAML<5.1"].
+        """
+        dependency = dependency.strip()
+        if dependency == '' or dependency.startswith('@'):
+            return []
+        try:
+            tokens = shlex.split(dependency)
+        except ValueError:
+            return []
+        if tokens[:2] == ["pip", "install"]:
+            tokens = tokens[2:]
+        requirements = []
+        skip = False
+        for token in tokens:
+            if skip:
+                skip = False
+                continue
+            if token in ("-e", "--editable", "-r", "--requirement", "-c", "--constraint"):
+                skip = True
+                continue
+            if token.startswith('-') or token.startswith('.') or token.startswith('/'):
+                continue
+            requirements.append(token)
+        return requirements
+
+    def dependency_install_cmd(self, package_dir: str) -> tuple[list, list]:
+        """
+        Gets the commands installing the third-party dependencies of a package from its manifests alone,
+        before its source is copied into the image.
+        :param package_dir: The directory containing the package files.
+        :return: The manifests relative to the directory, which the dependency layer depends on,
+                 and the installation commands.
+        """
+        manifests = []
+        commands = []
+        requires = []
+        files = sorted(f for f in os.listdir(package_dir) if os.path.isfile(os.path.join(package_dir, f)))
+        if 'pyproject.toml' in files:
+            try:
+                with open(os.path.join(package_dir, 'pyproject.toml'), 'rb') as f:
+                    pyproject = tomllib.load(f)
+            except Exception as e:
+                logging.warning(f"Failed to parse pyproject.toml in {package_dir}: {e}")
+                pyproject = {}
+            if 'poetry' in pyproject.get('tool', {}):
+                manifests.extend(f for f in ('pyproject.toml', 'poetry.lock') if f in files)
+                commands.extend(["pip install poetry", "poetry config virtualenvs.create false",
+                                 "poetry install --no-interaction --no-ansi --no-root"])
+            else:
+                project_requires = pyproject.get('project', {}).get('dependencies', [])
+                if project_requires:
+                    # The commands do not read the manifest, it is copied so the layer is rebuilt when it changes
+                    manifests.append('pyproject.toml')
+                    requires.extend(project_requires)
+        if 'setup.py' in files:
+            setup_requires = self.setup_requires(os.path.join(package_dir, 'setup.py'))
+            if setup_requires:
+                manifests.append('setup.py')
+                requires.extend(setup_requires)
+        if requires:
+            commands.append("pip install " + " ".join(shlex.quote(r) for r in dict.fromkeys(requires)))
+        requirements = [f for f in files if f.lower().startswith('requirements') and f.lower().endswith('.txt')]
+        if 'requirements.txt' in requirements:
+            manifests.extend(requirements)
+            commands.append("pip install -r requirements.txt")
+        return manifests, commands
+
     def get_package_installed_info(self, package_name='', package_dir='') -> list:
         """
         Gets the installed package information based on the package name or directory.
@@ -352,6 +823,18 @@ class Deploy:
         else:
             return pkg_installed_info
 
+    def get_install_method(self, package_dir: str) -> str:
+        """
+        Gets the installation method last chosen by package_install_cmd for a repository in the workspace.
+        :param package_dir: The directory of the repository.
+        :return: The installation type, e.g. poetry, setup or requirements, or '' if it was never deployed.
+        """
+        package_dir = os.path.abspath(package_dir)
+        methods = [pkg.get('type', '') for pkg in self.get_package_installed_info()
+                   if os.path.abspath(pkg.get('path', '')) == package_dir or
+                   os.path.abspath(pkg.get('path', '')).startswith(package_dir + os.sep)]
+        return methods[-1] if methods else ''
+
     def package_uninstall_cmd(self, package_dir: str = '', package_name: str = '') -> list:
         """
         Gets the uninstallation commands for a package based on its directory contents.
@@ -397,6 +880,40 @@ class Deploy:
         :param run_kwargs: Additional keyword arguments to pass to the Docker run command.
         :return: Dockerfile path and the created container object.
         """
+        dockerfile_path, image = self.dockerfile_build(py_version=py_version, file_path=file_path,
+                                                       dependencies=dependencies, other_commands=other_commands,
+                                                       environment=environment, cmd=cmd, commit=commit,
+                                                       package_name=package_name, patch=patch,
+                                                       lazy_deploy=lazy_deploy)
+        container = self.docker_handle.run_by_image(image=image, run_kwargs=run_kwargs)
+        if container is None:
+            logging.error(f"Failed to create container from Dockerfile {dockerfile_path}.")
+            raise RuntimeError(f"Failed to create container from Dockerfile {dockerfile_path}.")
+        logging.info(f"Container {container.id} created from image {image.tags[0] if image.tags else image.id}")
+
+        return dockerfile_path, container
+
+    def dockerfile_build(self, py_version="3.7.9", file_path="", dependencies=None, other_commands=None,
+                         environment="", cmd=None, commit='', package_name='', patch='', lazy_deploy=False,
+                         build_stats=None, image_name='', poc_dependencies=None) -> tuple[str, Any]:
+        """
+        Builds a Docker image using a Dockerfile generated from the specified file path, without running it.
+        :param py_version: python version to use in the Dockerfile.
+        :param file_path: The workspace path to the file or directory to be used in the Dockerfile.
+        :param dependencies: List of dependencies to be installed in the Docker container.
+        :param other_commands: List of other commands to be executed in the Docker container.
+        :param environment: Environment variables to be set in the Docker container.
+        :param cmd: Command to run in the Docker container.
+        :param commit: Commit hash to be used in the image name.
+        :param package_name: Name of the package to be installed.
+        :param patch: Path of the patch file to be copied into the Docker container.
+        :param lazy_deploy: If True, the deployment will be lazy, meaning it will not execute the commands immediately.
+        :param build_stats: If a dictionary is given, the cache hits of the build are filled in, see DockerHandle.build_image.
+        :param image_name: Name of the image without the `vulbench_` prefix and the commit,
+                           default is the name of the file path.
+        :param poc_dependencies: The `poc_dependencies` of the POC, installed in the image, see poc_dependency_cmd.
+        :return: Dockerfile path and the built image object.
+        """
         if file_path == '':
             logging.error(f"File path cannot be empty.")
             raise ValueError("File path cannot be empty.")
@@ -418,7 +935,9 @@ class Deploy:
         file_path = os.path.relpath(file_path_true, self.space_path)
 
         if dependencies is None:
-            dependencies = ["vim", "curl", "patch", "git"]
+            dependencies = list(BASE_DEPENDENCIES)
+        # Custom deployment commands can not be split into dependencies and project install
+        other_commands_auto = other_commands is None
         if other_commands is None:
             other_commands = []
             # for root, dirs, files in os.walk(os.path.dirname(file_path_true)):
@@ -428,7 +947,8 @@ class Deploy:
             #     if 'requirements.txt' in files:
             #         other_commands.append("pip install -r requirements.txt")
             #         break
-            other_commands.extend(self.package_install_cmd(file_path_true, package_name=package_name))
+            with self.pkg_info_lock:
+                other_commands.extend(self.package_install_cmd(file_path_true, package_name=package_name))
             # for file in os.listdir(file_path_true):
             #     file_full_path = os.path.join(file_path_true, file)
             #     if not os.path.isfile(file_full_path):
@@ -456,6 +976,9 @@ class Deploy:
             #         break
             if len(other_commands) == 0:
                 logging.warning(f"No installation commands found in {file_path_true}. ")
+        reinstall_commands = self.reinstall_cmd(other_commands)
+        # Built into the image after the project install, so they are cached with the image
+        poc_dependency_commands = self.poc_dependency_cmd(poc_dependencies) if poc_dependencies else []
 
         if lazy_deploy:
             # Not executing the commands immediately, but adding them to the deployment script for later execution.
@@ -466,20 +989,31 @@ class Deploy:
             def shell_quote_single(s: str) -> str:
                 return "'" + s.replace("'", "'\"'\"'") + "'"
 
-            for oc in other_commands:
+            # The project is only installed by the deployment, the POC dependencies installed in the image are
+            # installed again after it, a no-op unless it changed their versions
+            for oc in list(other_commands) + poc_dependency_commands:
                 oc = oc.strip()
                 quoted_oc = shell_quote_single(oc)
                 new_commands.extend([f"echo {quoted_oc} >> /vulbench/vb_deploy.sh"])
 
+            # A deployed snapshot is built from the unpatched source, what the deployment built or copied
+            # has to be rebuilt after patching, see deploy_snapshot and reinstall_cmd
+            new_commands.append("touch /vulbench/vb_reinstall.sh")
+            for rc in reinstall_commands:
+                new_commands.append(f"echo {shell_quote_single(rc)} >> /vulbench/vb_reinstall.sh")
+
             other_commands = new_commands
 
-            other_commands.extend(['chmod +x /vulbench/vb_deploy.sh'])
+            other_commands.extend(['chmod +x /vulbench/vb_deploy.sh /vulbench/vb_reinstall.sh'])
 
         if environment == "":
             environment = "ENV PATH=$PATH:/vulbench"
         if cmd is None:
             cmd = ["/bin/bash"]
 
+        git_commit, git_tag = self.get_tree_version(file_path_true)
+        base_image = self.docker_handle.get_base_image(py_version)
+        manifests, dependency_commands = self.dependency_install_cmd(file_path_true) if other_commands_auto else ([], [])
         dockerfile_content = get_dockerfile(
             py_version=py_version,
             file_path=file_path,
@@ -487,24 +1021,126 @@ class Deploy:
             other_commands=other_commands,
             environment=environment,
             cmd=cmd,
-            patch=patch
+            patch=patch,
+            git_commit=git_commit,
+            git_tag=git_tag,
+            base_image=base_image,
+            manifests=manifests,
+            dependency_commands=dependency_commands,
+            poc_dependency_commands=poc_dependency_commands,
+            build_args=list(self.docker_handle.package_index)
         )
 
         dockerfile_path = os.path.join(self.space_path, f"vulbench_{os.path.basename(file_path)}.dockerfile".lower())
-        with open(dockerfile_path, 'w') as dockerfile:
-            dockerfile.write(dockerfile_content)
-            logging.info(f"Dockerfile written to {dockerfile_path}")
+
+        # The tag hashes everything the image is built from, the paths private to this run left out
+        cache_source = dockerfile_content.replace(file_path, "<source>")
+        base_image_id = ''
+        if base_image:
+            try:
+                base_image_id = self.docker_handle.client.images.get(base_image).id
+            except Exception as e:
+                logging.warning(f"Failed to get the ID of base image {base_image}: {e}")
+        cache_tag = hashlib.sha256("\n".join([image_name, commit, cache_source, base_image_id]
+                                              ).encode('utf-8')).hexdigest()[:16]
 
         if commit != '':
             if len(commit) > 7:
                 commit = commit[:7]
             commit = '_' + commit
 
-        image_name = f"vulbench_{os.path.basename(file_path)}{commit}".lower()
-        container = self.docker_handle.run_by_dockerfile(dockerfile_path=dockerfile_path, image_name=image_name, run_kwargs=run_kwargs)
-        if container is None:
-            logging.error(f"Failed to create container from Dockerfile {dockerfile_path}.")
-            raise RuntimeError(f"Failed to create container from Dockerfile {dockerfile_path}.")
-        logging.info(f"Container {container.id} created from image {image_name}")
+        image_name = f"vulbench_{image_name if image_name else os.path.basename(file_path)}{commit}".lower()
+        image = self.docker_handle.get_cached_image(image_name, cache_tag)
+        if image is not None:
+            logging.info(f"Image {image_name}:{cache_tag} already exists, skipping the build.")
+            if build_stats is not None:
+                build_stats.update({"image": True, "image_cache": True, "layers": [0, 0]})
+            return dockerfile_path, image
+        if build_stats is not None:
+            build_stats["image_cache"] = False
+        with open(dockerfile_path, 'w') as dockerfile:
+            dockerfile.write(dockerfile_content)
+            logging.info(f"Dockerfile written to {dockerfile_path}")
+        try:
+            with self.build_context(dockerfile_path, file_path_true) as context:
+                image = self.docker_handle.build_image(dockerfile_path=dockerfile_path, image_name=image_name,
+                                                       tag=cache_tag, stats=build_stats, context=context,
+                                                       nocache=self.docker_handle.rebuild_images,
+                                                       buildargs=self.docker_handle.package_index)
+        finally:
+            # The Dockerfile is part of the build context, it is not needed once the image is built
+            os.remove(dockerfile_path)
+        if image is None:
+            logging.error(f"Failed to build image from Dockerfile {dockerfile_path}.")
+            raise RuntimeError(f"Failed to build image from Dockerfile {dockerfile_path}.")
+        logging.info(f"Image {image_name} built from Dockerfile {dockerfile_path}")
 
-        return dockerfile_path, container
+        return dockerfile_path, image
+
+    @staticmethod
+    def pip_cache_stats(output: str) -> list:
+        """
+        Count the packages pip took from its cache and those it had to download in the output of a command,
+        including the summaries logged by InOut.env_init for the POC dependencies.
+        :param output: Output of the command.
+        :return: [hits, misses].
+        """
+        hits, misses = 0, 0
+        for line in (output or '').splitlines():
+            line = line.strip()
+            summary = re.search(r'\[vb_pip_cache] hits=(\d+) misses=(\d+)', line)
+            if summary:
+                hits += int(summary.group(1))
+                misses += int(summary.group(2))
+            elif line.startswith("Using cached "):
+                hits += 1
+            elif line.startswith("Downloading "):
+                misses += 1
+        return [hits, misses]
+
+    def deploy_snapshot(self, image, timeout=0, build_stats=None):
+        """
+        Run the lazy deploy script once in a temporary container and commit it as a snapshot image,
+        so the original and patched containers both start with the project installed.
+        The snapshot is tagged after the image it is deployed from, and reused as long as that image is.
+        :param image: The image built by dockerfile_build with lazy deploy.
+        :param timeout: Deadline of the deploy script in seconds, 0 means no deadline.
+        :param build_stats: If a dictionary is given, `snapshot` is set to whether the snapshot was reused,
+                            and `pip` to the pip cache hits and misses of the deploy script.
+        :return: The snapshot image, or None if it failed and the containers have to run the deploy script themselves.
+        :raise ExecTimeout: If the deploy script runs past the deadline.
+        """
+        dh = self.docker_handle
+        if image is None or not image.tags:
+            return None
+        image_name = image.tags[0].split(':')[0]
+        tag = f"deployed-{image.id.split(':')[-1][:16]}"
+        with dh.get_image_lock(f"{image_name}:{tag}"):
+            snapshot = dh.get_cached_image(image_name, tag)
+            if build_stats is not None:
+                build_stats["snapshot"] = snapshot is not None
+            if snapshot is not None:
+                logging.info(f"Deployed snapshot {image_name}:{tag} already exists, skipping the deploy script.")
+                return snapshot
+
+            container = dh.run_by_image(image=image, suffix="deploy")
+            if container is None:
+                logging.error(f"Failed to start the deploy container of {image_name}.")
+                return None
+            try:
+                logging.info(f"Running lazy deploy script for snapshot {image_name}:{tag}, this may take a while...")
+                deploy_start = time.time()
+                output = dh.container_exec(container_id=container.id, command="bash /vulbench/vb_deploy.sh",
+                                           timeout=timeout)
+                if output is None:
+                    logging.error(f"Failed to run the lazy deploy script for snapshot {image_name}:{tag}.")
+                    return None
+                logging.info(f"Lazy deploy script finished in {time.time() - deploy_start:.2f} seconds: \n{output}")
+                if build_stats is not None:
+                    build_stats["pip"] = self.pip_cache_stats(output)
+                snapshot = dh.commit_container(container.id, image_name, tag)
+            finally:
+                dh.container_remove(container.id)
+            if snapshot is None:
+                logging.error(f"Failed to snapshot the deployed container of {image_name}.")
+            return snapshot
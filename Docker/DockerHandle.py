@@ -7,17 +7,63 @@ import time
 import os
 import tarfile
 import io
+import threading
+import hashlib
+import shlex
+import uuid
 import utils
+from Docker.template import get_base_dockerfile
+
+
+class ExecTimeout(TimeoutError):
+    def __init__(self, command, timeout, stage=''):
+        """
+        Raised when a command executed in a container runs past its deadline.
+        :param command: The command that timed out.
+        :param timeout: The deadline of the command in seconds.
+        :param stage: The benchmark stage running the command, filled in by the caller.
+        """
+        super().__init__(f"Command '{command}' timed out after {timeout:.0f} seconds")
+        self.command = command
+        self.timeout = timeout
+        self.stage = stage
 
 
 class DockerHandle:
+    # Shared by all instances, so every Deploy/Manage in a parallel sweep draws from the same pool
+    build_slots = utils.Slots()
+    container_slots = utils.Slots()
+    # Seconds a timed out command gets to return before its container is killed
+    exec_grace = 10
+    # Base images are built once per daemon and Python version, even when several POCs need them at once
+    base_image_name = "vulbench-base"
+    rebuild_base = False
+    # One lock per image built or committed on a daemon, so concurrent runs do not build the same image twice
+    _image_locks = {}
+    _image_locks_guard = threading.Lock()
+    _base_rebuilt = set()
+    # With a rebuild requested, cached POC images are only reused once they were rebuilt in this run
+    rebuild_images = False
+    _rebuilt_images = set()
+    # Docker volumes of the pip cache shared by the containers of each Python version, see get_pip_cache
+    pip_cache_volume = "vulbench-pip-cache"
+    pip_cache_path = "/vulbench_pip_cache"
+    # pip environment and extra hosts pointing to the local wheelhouse while it is served, see Wheelhouse.start
+    package_index = {}
+    package_index_hosts = {}
 
-    def __init__(self):
+    def __init__(self, base_url=''):
         """
         DockerHandle class to manage Docker containers.
+        :param base_url: URL of the Docker daemon, e.g. unix:///var/run/docker.sock or tcp://127.0.0.1:2375,
+                         if empty, the daemon is taken from the environment.
         """
+        self.base_url = base_url
         try:
-            self.client = docker.from_env()
+            if base_url:
+                self.client = docker.DockerClient(base_url=base_url)
+            else:
+                self.client = docker.from_env()
         except Exception as e:
             logging.error(e)
 
@@ -111,10 +157,12 @@ class DockerHandle:
             logging.error(f"Error retrieving vulbench containers: {e}")
             return []
 
-    def get_image_vulbench(self, image_name="vulbench") -> list:
+    def get_image_vulbench(self, image_name="vulbench", include_base=False) -> list:
         """
         Get Docker images of vulbench.
         :param image_name: If specified, filter by image name.
+        :param include_base: If True, the shared base images (see get_base_image) are included, they are left out
+                             by default so that cleaning up the PoC images does not force them to be rebuilt.
         :return: All Docker image objects of vulbench or filtered by name.
         """
         try:
@@ -124,7 +172,9 @@ class DockerHandle:
             all_images = self.get_images(all=True)
             images = []
             for image in all_images:
-                if image.tags and any(tag.lower().startswith(image_name) for tag in image.tags):
+                tags = [tag.lower() for tag in image.tags or []
+                        if include_base or not tag.lower().startswith(f"{self.base_image_name}:")]
+                if any(tag.startswith(image_name) for tag in tags):
                     images.append(image)
             return images
         except Exception as e:
@@ -161,7 +211,136 @@ class DockerHandle:
             logging.error(f"Error retrieving status for container {container_id}: {e}")
             return None
 
-    def run_by_image(self, image=None, name='', tag='latest', patched=False, run_kwargs=None):
+    @staticmethod
+    def job_limits() -> tuple[dict, dict]:
+        """
+        Get the per-job resource caps configured in the `Bench` section.
+        :return: Keyword arguments for client.containers.run, and container_limits for client.images.build.
+        """
+        bench_config = utils.load_config().get("Bench", {}) or {}
+        run_limits = {}
+        build_limits = {}
+        cpus = bench_config.get("cpus_per_job", 0) or 0
+        if float(cpus) > 0:
+            run_limits["nano_cpus"] = int(float(cpus) * 1e9)
+        mem = str(bench_config.get("mem_per_job", "") or "").strip()
+        if mem != "":
+            run_limits["mem_limit"] = mem
+            build_limits["memory"] = docker.utils.parse_bytes(mem)
+        return run_limits, build_limits
+
+    def _with_limits(self, run_kwargs=None) -> dict:
+        """
+        Merge the per-job caps into the run arguments, the arguments given by the PoC take precedence.
+        :param run_kwargs: Additional keyword arguments for client.containers.run.
+        :return: Merged keyword arguments.
+        """
+        run_limits, _ = self.job_limits()
+        run_limits.update(run_kwargs if run_kwargs else {})
+        return run_limits
+
+    def get_pip_cache(self, image) -> str:
+        """
+        Get the shared pip cache volume of the Python version of an image, creating it if needed.
+        Wheels downloaded or built in any container of that Python version are reused by all later ones.
+        :param image: Docker image object.
+        :return: The name of the volume, or '' if the pip cache is disabled or the Python version is unknown.
+        """
+        if not (utils.load_config().get("Docker", {}) or {}).get("pip_cache", True):
+            return ''
+        env = (image.attrs.get("Config", {}) or {}).get("Env", []) or []
+        py_version = next((e.split('=', 1)[1] for e in env if e.startswith("PYTHON_VERSION=")), '')
+        if py_version == '':
+            return ''
+        volume_name = f"{self.pip_cache_volume}-{'.'.join(py_version.split('.')[:2])}"
+        try:
+            self.client.volumes.get(volume_name)
+        except docker.errors.NotFound:
+            try:
+                self.client.volumes.create(name=volume_name, labels={"maintainer": "vulbench"})
+            except docker.errors.APIError as e:
+                # Created by a concurrent run in the meantime
+                logging.debug(f"Error creating volume {volume_name}: {e}")
+        except Exception as e:
+            logging.error(f"Error getting pip cache volume {volume_name}: {e}")
+            return ''
+        return volume_name
+
+    def _with_pip_cache(self, image, run_kwargs) -> dict:
+        """
+        Mount the shared pip cache of the image into the container and point pip to it.
+        Nothing is changed if the PoC sets PIP_CACHE_DIR itself or already mounts something on the cache path.
+        :param image: Docker image object.
+        :param run_kwargs: Keyword arguments for client.containers.run.
+        :return: Merged keyword arguments.
+        """
+        environment = run_kwargs.get("environment") or {}
+        if isinstance(environment, dict):
+            env_keys = set(environment)
+        else:
+            env_keys = {str(e).split('=', 1)[0] for e in environment}
+        volumes = run_kwargs.get("volumes") or {}
+        if isinstance(volumes, dict):
+            targets = {v.get("bind") if isinstance(v, dict) else str(v) for v in volumes.values()}
+        else:
+            targets = {str(v).split(':')[1] if ':' in str(v) else str(v) for v in volumes}
+        targets.update(m.get("Target") for m in run_kwargs.get("mounts") or [])
+        if "PIP_CACHE_DIR" in env_keys or self.pip_cache_path in targets:
+            logging.info("The PoC sets its own pip cache, the shared cache is not mounted.")
+            return run_kwargs
+        volume_name = self.get_pip_cache(image)
+        # A PoC mounting the cache volume elsewhere keeps its mount, a dictionary holds one per volume
+        if volume_name == '' or (isinstance(volumes, dict) and volume_name in volumes):
+            return run_kwargs
+        run_kwargs = dict(run_kwargs)
+        if isinstance(volumes, dict):
+            volumes = {**volumes, volume_name: {"bind": self.pip_cache_path, "mode": "rw"}}
+        else:
+            volumes = list(volumes) + [f"{volume_name}:{self.pip_cache_path}:rw"]
+        run_kwargs.update({"volumes": volumes,
+                           "environment": self.merge_environment(environment, {"PIP_CACHE_DIR": self.pip_cache_path})})
+        return run_kwargs
+
+    @staticmethod
+    def merge_environment(environment, defaults: dict):
+        """
+        Add default variables to an environment, the variables already set are kept.
+        :param environment: A dictionary, a list of "KEY=value" or None.
+        :param defaults: Dictionary of the default variables.
+        :return: The merged environment, of the same type as the given one.
+        """
+        environment = environment or {}
+        if isinstance(environment, dict):
+            return {**defaults, **environment}
+        keys = {str(e).split('=', 1)[0] for e in environment}
+        return list(environment) + [f"{k}={v}" for k, v in defaults.items() if k not in keys]
+
+    def _with_package_index(self, run_kwargs) -> dict:
+        """
+        Point pip in the container to the local wheelhouse while it is served, see Wheelhouse.start.
+        :param run_kwargs: Keyword arguments for client.containers.run.
+        :return: Merged keyword arguments.
+        """
+        if not self.package_index:
+            return run_kwargs
+        run_kwargs = dict(run_kwargs)
+        run_kwargs["environment"] = self.merge_environment(run_kwargs.get("environment"), self.package_index)
+        if self.package_index_hosts:
+            run_kwargs["extra_hosts"] = {**self.package_index_hosts, **(run_kwargs.get("extra_hosts") or {})}
+        return run_kwargs
+
+    @staticmethod
+    def container_name(image_name: str) -> str:
+        """
+        Generate a container name for an image. The timestamp only changes once per second,
+        so a random part keeps apart the containers of an image started at once (e.g. by ContainerPool).
+        :param image_name: Name of the image.
+        :return: The container name.
+        """
+        prefix = image_name if image_name.startswith('vulbench') else f"vulbench_{image_name}"
+        return f"{prefix}_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+    def run_by_image(self, image=None, name='', tag='latest', patched=False, run_kwargs=None, suffix=''):
         """
         Build and run a Docker container from an existing image.
         :param image: Docker image object.
@@ -169,6 +348,7 @@ class DockerHandle:
         :param tag: Tag for the Docker image.
         :param patched: If True, add `patched` suffix to the container name.
         :param run_kwargs: Additional keyword arguments for client.containers.run.
+        :param suffix: Suffix added to the generated container name, to tell apart containers of the same image.
         :return: The created container object.
         """
         try:
@@ -176,10 +356,9 @@ class DockerHandle:
                 raise Exception("Image cannot be empty.")
             if name == '':
                 image_name = image.tags[0].split(':')[0] if image.tags else 'vulbench'
-                if image_name.startswith('vulbench'):
-                    name = f"{image_name}_{time.strftime('%Y%m%d%H%M%S')}"
-                else:
-                    name = f"vulbench_{image_name}_{time.strftime('%Y%m%d%H%M%S')}"
+                name = self.container_name(image_name)
+                if suffix:
+                    name += f'_{suffix}'
                 if patched:
                     name += '_patched'
             img_name, img_tag = image.tags[0].split(':') if image.tags else (image.name, tag)
@@ -191,13 +370,179 @@ class DockerHandle:
                 name=name,
                 stdin_open=True,  # -i
                 tty=True,  # -t
-                **(run_kwargs if run_kwargs else {})
+                **self._with_package_index(self._with_pip_cache(image, self._with_limits(run_kwargs)))
             )
             return container
         except Exception as e:
             logging.error(f"Error running container from image {image.tags}: {e}")
             return None
 
+    def build_image(self, dockerfile_path, image_name, tag='latest', stats=None, context=None, labels=None,
+                    pull=False, nocache=False, buildargs=None):
+        """
+        Build a Docker image from a Dockerfile.
+        :param dockerfile_path: Path to the Dockerfile.
+        :param image_name: Name of the Docker image to build.
+        :param tag: Tag for the Docker image.
+        :param stats: If a dictionary is given, the cache hits of the build are filled in:
+                      `image` whether the image was already built as is, `layers` the cached and total build steps.
+        :param context: An uncompressed tar file object to use as the build context, holding the Dockerfile under
+                        its base name. If None, the directory of the Dockerfile is the build context.
+        :param labels: Additional labels of the image.
+        :param pull: If True, pull the newer version of the base image.
+        :param nocache: If True, build without the layer cache.
+        :param buildargs: Build arguments declared by the Dockerfile, the hosts of the local wheelhouse are
+                          resolvable in the build when they are given.
+        :return: The built image object, or None if the build failed.
+        """
+        try:
+            build_dir = os.path.dirname(dockerfile_path)
+            dockerfile_name = os.path.basename(dockerfile_path)
+            logging.info(f"Trying to build image {image_name}:{tag} from {dockerfile_path}")
+            try:
+                old_image_id = self.client.images.get(f"{image_name}:{tag}").id
+            except docker.errors.ImageNotFound:
+                old_image_id = None
+            _, build_limits = self.job_limits()
+            build_kwargs = {"path": build_dir} if context is None else {"fileobj": context, "custom_context": True}
+            if buildargs:
+                build_kwargs.update({"buildargs": buildargs, "extra_hosts": self.package_index_hosts or None})
+            with self.build_slots.hold():
+                build_start = time.time()
+                # The daemon answers once the whole context is uploaded, so the first answer ends the upload
+                first_answer = None
+                image_id = None
+                logs = []
+                for chunk in self.client.api.build(dockerfile=dockerfile_name, tag=f"{image_name}:{tag}",
+                                                   labels={"maintainer": "vulbench", **(labels or {})},
+                                                   rm=True, forcerm=True, pull=pull, nocache=nocache,
+                                                   container_limits=build_limits if build_limits else None,
+                                                   decode=True, **build_kwargs):
+                    if first_answer is None:
+                        first_answer = time.time()
+                        logging.info(f"Build context of {image_name}:{tag} uploaded in "
+                                     f"{first_answer - build_start:.2f} seconds.")
+                    logs.append(chunk)
+                    if "error" in chunk:
+                        raise docker.errors.BuildError(chunk["error"], logs)
+                    if "aux" in chunk and "ID" in chunk["aux"]:
+                        image_id = chunk["aux"]["ID"]
+                    elif chunk.get("stream", "").startswith("Successfully built "):
+                        image_id = chunk["stream"].split()[-1]
+            if image_id is None:
+                raise docker.errors.BuildError("Unknown image ID of the build", logs)
+            image = self.client.images.get(image_id)
+            self._rebuilt_images.add((self.base_url, f"{image_name}:{tag}"))
+            if stats is not None:
+                lines = [line.get("stream", "") for line in logs if isinstance(line, dict)]
+                stats["image"] = old_image_id is not None and old_image_id == image.id
+                stats["layers"] = [sum(1 for line in lines if "Using cache" in line),
+                                   sum(1 for line in lines if line.startswith("Step "))]
+            return image
+        except Exception as e:
+            logging.error(f"Error building image from {dockerfile_path}: {e}")
+            return None
+
+    def get_image_lock(self, image):
+        """
+        Get the lock of an image on this daemon.
+        :param image: Name and tag of the image.
+        :return: The lock of the image.
+        """
+        with self._image_locks_guard:
+            return self._image_locks.setdefault((self.base_url, image), threading.Lock())
+
+    def commit_container(self, container_id, image_name, tag):
+        """
+        Commit the current state of a container as an image, with the configuration and labels of its image.
+        :param container_id: ID of the Docker container.
+        :param image_name: Name of the image.
+        :param tag: Tag of the image.
+        :return: The committed image object, or None if the commit failed.
+        """
+        try:
+            container = self.get_container(container_id)
+            image = container.commit(repository=image_name, tag=tag)
+            self._rebuilt_images.add((self.base_url, f"{image_name}:{tag}"))
+            logging.info(f"Committed container {container_id} as image {image_name}:{tag}")
+            return image
+        except Exception as e:
+            logging.error(f"Error committing container {container_id} as image {image_name}:{tag}: {e}")
+            return None
+
+    def get_cached_image(self, image_name, tag):
+        """
+        Get an image built before with the same name and tag, unless a rebuild is requested.
+        :param image_name: Name of the Docker image.
+        :param tag: Tag of the Docker image, the hash of everything the image is built from.
+        :return: The image object, or None if it has to be built.
+        """
+        if self.rebuild_images and (self.base_url, f"{image_name}:{tag}") not in self._rebuilt_images:
+            return None
+        try:
+            return self.client.images.get(f"{image_name}:{tag}")
+        except docker.errors.ImageNotFound:
+            return None
+        except Exception as e:
+            logging.error(f"Error looking up image {image_name}:{tag}: {e}")
+            return None
+
+    def get_base_image(self, py_version, dependencies=None):
+        """
+        Get the shared base image of a Python version, with the system packages and the build tools installed.
+        It is built if it is missing, if its Dockerfile changed, if it is older than `Docker.base_max_age` days,
+        or once per run if a rebuild is requested.
+        :param py_version: Python version of the base image.
+        :param dependencies: System packages of the base image, default is BASE_DEPENDENCIES of the template.
+        :return: The name of the base image, or '' if base images are disabled or the build failed.
+        """
+        docker_config = utils.load_config().get("Docker", {}) or {}
+        if not docker_config.get("base_images", True):
+            return ''
+        py_version = py_version if py_version else "3.10"
+        base_image = f"{self.base_image_name}:{py_version}"
+        content = get_base_dockerfile(py_version=py_version, dependencies=dependencies)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+        key = (self.base_url, base_image)
+        with self.get_image_lock(base_image):
+            try:
+                labels = self.client.images.get(base_image).labels or {}
+            except docker.errors.ImageNotFound:
+                labels = None
+            max_age = float(docker_config.get("base_max_age", 30) or 0) * 86400
+            if labels is None:
+                reason = "missing"
+            elif self.rebuild_base and key not in self._base_rebuilt:
+                reason = "requested"
+            elif labels.get("vulbench.base.digest") != digest:
+                reason = "outdated"
+            elif max_age and time.time() - float(labels.get("vulbench.base.created", 0)) > max_age:
+                reason = "stale"
+            else:
+                return base_image
+
+            logging.info(f"Building base image {base_image} ({reason}), this may take a while...")
+            print(f"[VulBench] Building base image {base_image} ({reason}), this may take a while...")
+            dockerfile_name = f"{self.base_image_name}_{py_version}.dockerfile"
+            context = io.BytesIO()
+            with tarfile.open(fileobj=context, mode='w') as tar:
+                data = content.encode('utf-8')
+                info = tarfile.TarInfo(name=dockerfile_name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+            context.seek(0)
+            image = self.build_image(dockerfile_path=dockerfile_name, image_name=self.base_image_name, tag=py_version,
+                                     context=context, pull=reason in ("requested", "stale"),
+                                     nocache=reason in ("requested", "stale"),
+                                     labels={"vulbench.base.digest": digest,
+                                             "vulbench.base.created": str(int(time.time()))})
+            self._base_rebuilt.add(key)
+            if image is None:
+                logging.error(f"Failed to build base image {base_image}, building from python:{py_version} instead.")
+                return ''
+            return base_image
+
     def run_by_dockerfile(self, dockerfile_path, image_name, name='', tag='latest', run_kwargs=None):
         """
         Build and run a Docker container from a Dockerfile.
@@ -210,28 +555,18 @@ class DockerHandle:
         """
         try:
             if name == '':
-                if image_name.startswith('vulbench'):
-                    name = f"{image_name}_{time.strftime('%Y%m%d%H%M%S')}"
-                else:
-                    name = f"vulbench_{image_name}_{time.strftime('%Y%m%d%H%M%S')}"
-            build_dir = os.path.dirname(dockerfile_path)
-            dockerfile_name = os.path.basename(dockerfile_path)
-            logging.info(f"Trying to build and run container from {dockerfile_path} with image {image_name}:{tag}")
-            image = self.client.images.build(
-                path=build_dir,
-                dockerfile=dockerfile_name,
-                tag=f"{image_name}:{tag}",
-                labels={"maintainer": "vulbench"},
-                rm=True,
-                forcerm=True
-            )[0]
+                name = self.container_name(image_name)
+            image = self.build_image(dockerfile_path, image_name, tag=tag)
+            if image is None:
+                raise Exception(f"Image {image_name}:{tag} could not be built.")
+            logging.info(f"Trying to run container {name} from image {image_name}:{tag}")
             container = self.client.containers.run(
                 image=image,
                 detach=True,  # -d
                 name=name,
                 stdin_open=True,  # -i
                 tty=True,  # -t
-                **(run_kwargs if run_kwargs else {})
+                **self._with_package_index(self._with_pip_cache(image, self._with_limits(run_kwargs)))
             )
             return container
         except Exception as e:
@@ -257,6 +592,25 @@ class DockerHandle:
         except Exception as e:
             logging.error(f"Error copying files to container {container_id}: {e}")
 
+    def container_put_archive(self, container_id, archive: bytes, dest_dir: str) -> bool:
+        """
+        Extract a tar archive built on the host into a Docker container.
+        :param container_id: ID of the Docker container.
+        :param archive: Content of the tar archive.
+        :param dest_dir: Directory in the container the archive is extracted to.
+        :return: True if the archive was extracted.
+        """
+        try:
+            container = self.get_container(container_id)
+            if not container.put_archive(dest_dir, archive):
+                logging.error(f"Failed to extract archive in container {container_id}:{dest_dir}")
+                return False
+            logging.info(f"Copied {len(archive)} bytes to {container_id}:{dest_dir}")
+            return True
+        except Exception as e:
+            logging.error(f"Error copying files to container {container_id}: {e}")
+            return False
+
     def get_files_from_container(self, container_id, src_path='/vulbench/vb_poc_result.json', dest_path=''):
         """
         Get files from a Docker container to the host.
@@ -280,23 +634,164 @@ class DockerHandle:
             logging.error(f"Error getting files from container {container_id}: {e}")
             return None
 
-    def container_exec(self, container_id, command):
+    def container_exec(self, container_id, command, timeout=0, environment=None):
         """
         Execute a command in a Docker container.
         :param container_id: ID of the Docker container.
         :param command: Command to execute in the container.
+        :param timeout: Deadline of the command in seconds, 0 means no deadline. The command is killed inside
+                        the container when it is hit, and the container itself if the command still does not return.
+        :param environment: Environment variables of the command, a dictionary or a list of "KEY=value".
         :return: Output of the command execution.
+        :raise ExecTimeout: If the deadline is hit.
         """
+        watchdog = None
+        exec_start = time.time()
         try:
             container = self.get_container(container_id)
-            exec_result = self.client.api.exec_create(container.id, command)
-            output = self.client.api.exec_start(exec_result['Id'])
+            if timeout and timeout > 0:
+                seconds = str(int(timeout) + (1 if timeout % 1 else 0))
+                if isinstance(command, list):
+                    command = ["timeout", "-s", "KILL", seconds] + command
+                else:
+                    command = f"timeout -s KILL {seconds} {command}"
+                watchdog = threading.Timer(timeout + self.exec_grace, self.container_kill, args=(container_id,))
+                watchdog.daemon = True
+                watchdog.start()
+            exec_result = self.client.api.exec_create(container.id, command, environment=environment)
+            try:
+                output = self.client.api.exec_start(exec_result['Id'])
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+            if timeout and timeout > 0 and time.time() - exec_start >= timeout:
+                try:
+                    exit_code = self.client.api.exec_inspect(exec_result['Id']).get('ExitCode')
+                except Exception:
+                    exit_code = None
+                # 137 is SIGKILL from `timeout`, None means the container was killed by the watchdog
+                if exit_code in (124, 137, None):
+                    logging.error(f"Command '{command}' in container {container_id} timed out after {timeout:.0f} seconds")
+                    raise ExecTimeout(command, timeout)
             logging.info(f"Executed command '{command}' in container {container_id}")
             return output.decode('utf-8')
+        except ExecTimeout:
+            raise
         except Exception as e:
+            if timeout and timeout > 0 and time.time() - exec_start >= timeout:
+                raise ExecTimeout(command, timeout)
             logging.error(f"Error executing command in container {container_id}: {e}")
             return None
 
+    def container_exec_stream(self, container_id, command, timeout=0, environment=None, log_path='',
+                              cancel: threading.Event = None, max_buffer: int = 1 << 20, on_output=None) -> dict:
+        """
+        Execute a command in a Docker container, streaming its output as it arrives. stdout and stderr are kept apart,
+        each one in memory up to its last `max_buffer` bytes, and written in full to a log file that can be followed
+        while the command runs.
+        :param container_id: ID of the Docker container.
+        :param command: Command to execute in the container.
+        :param timeout: Deadline of the command in seconds, 0 means no deadline, see container_exec.
+        :param environment: Environment variables of the command, a dictionary or a list of "KEY=value".
+        :param log_path: Path of the log file on the host the output is appended to, empty means no log file.
+        :param cancel: Event stopping the command when set, its process group is terminated in the container.
+        :param max_buffer: Maximum number of bytes of stdout and of stderr kept in memory.
+        :param on_output: Function called with the stream name ("stdout" or "stderr") and each chunk as it arrives.
+        :return: Dictionary of the exit code (None if it is unknown), stdout, stderr, both of them as `output`
+                 (None if the command could not be run), whether they were truncated, the duration in seconds
+                 and whether the command was cancelled.
+        :raise ExecTimeout: If the deadline is hit.
+        """
+        result = {"exit_code": None, "stdout": "", "stderr": "", "output": None, "truncated": False,
+                  "duration": 0, "cancelled": False}
+        buffers = {"stdout": bytearray(), "stderr": bytearray()}
+        exec_start = time.time()
+        watchdog = None
+        done = threading.Event()
+        # `timeout` leads the process group of the command and passes a SIGTERM on to all of it, 0 means no deadline
+        pid_file = f"/tmp/vb_exec_{uuid.uuid4().hex[:12]}.pid"
+        seconds = str(int(timeout) + (1 if timeout % 1 else 0)) if timeout and timeout > 0 else "0"
+        args = command if isinstance(command, list) else shlex.split(command)
+        wrapped = ["sh", "-c", f'echo $$ > {pid_file}; exec timeout -s KILL {seconds} "$@"', "sh"] + args
+
+        def watch_cancel():
+            while not done.wait(0.5):
+                if cancel.is_set():
+                    result["cancelled"] = True
+                    logging.warning(f"Cancelling command '{command}' in container {container_id}")
+                    try:
+                        for sig in ("TERM", "KILL"):
+                            self.client.api.exec_start(self.client.api.exec_create(
+                                container_id, ["sh", "-c", f"kill -{sig} $(cat {pid_file}) 2>/dev/null"])['Id'])
+                            if done.wait(self.exec_grace):
+                                break
+                    except Exception as e:
+                        logging.warning(f"Failed to cancel command '{command}' in container {container_id}: {e}")
+                    return
+
+        log_file = None
+        try:
+            container = self.get_container(container_id)
+            if log_path:
+                os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+                log_file = open(log_path, 'ab')
+                log_file.write(f"$ {shlex.join(args)}\n".encode('utf-8'))
+                log_file.flush()
+            if timeout and timeout > 0:
+                watchdog = threading.Timer(timeout + self.exec_grace, self.container_kill, args=(container_id,))
+                watchdog.daemon = True
+                watchdog.start()
+            if cancel is not None:
+                threading.Thread(target=watch_cancel, daemon=True).start()
+            exec_result = self.client.api.exec_create(container.id, wrapped, environment=environment)
+            try:
+                for stdout, stderr in self.client.api.exec_start(exec_result['Id'], stream=True, demux=True):
+                    for stream_name, chunk in (("stdout", stdout), ("stderr", stderr)):
+                        if not chunk:
+                            continue
+                        if on_output is not None:
+                            on_output(stream_name, chunk)
+                        if log_file is not None:
+                            log_file.write(chunk)
+                            log_file.flush()
+                        buffer = buffers[stream_name]
+                        buffer.extend(chunk)
+                        if len(buffer) > max_buffer:
+                            del buffer[:len(buffer) - max_buffer]
+                            result["truncated"] = True
+            finally:
+                done.set()
+                if watchdog is not None:
+                    watchdog.cancel()
+            result["duration"] = time.time() - exec_start
+            try:
+                result["exit_code"] = self.client.api.exec_inspect(exec_result['Id']).get('ExitCode')
+            except Exception as e:
+                logging.warning(f"Failed to get the exit code of '{command}' in container {container_id}: {e}")
+            if timeout and timeout > 0 and result["duration"] >= timeout and not result["cancelled"]:
+                # 137 is SIGKILL from `timeout`, None means the container was killed by the watchdog
+                if result["exit_code"] in (124, 137, None):
+                    logging.error(f"Command '{command}' in container {container_id} timed out after {timeout:.0f} seconds")
+                    raise ExecTimeout(command, timeout)
+            result["stdout"] = buffers["stdout"].decode('utf-8', errors='replace')
+            result["stderr"] = buffers["stderr"].decode('utf-8', errors='replace')
+            result["output"] = result["stdout"] + result["stderr"]
+            logging.info(f"Executed command '{command}' in container {container_id}, exit code {result['exit_code']} "
+                         f"in {result['duration']:.2f} seconds")
+            return result
+        except ExecTimeout:
+            raise
+        except Exception as e:
+            done.set()
+            if timeout and timeout > 0 and time.time() - exec_start >= timeout:
+                raise ExecTimeout(command, timeout)
+            logging.error(f"Error executing command in container {container_id}: {e}")
+            result["duration"] = time.time() - exec_start
+            return result
+        finally:
+            if log_file is not None:
+                log_file.close()
+
     def container_kill(self, container_id):
         """
         Kill a Docker container.
@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import logging
+import threading
+from Docker.DockerHandle import DockerHandle
+from utils import load_config
+
+
+class DockerEndpoint:
+    def __init__(self, url: str = '', capacity: int = 0, name: str = ''):
+        """
+        A Docker daemon that benchmarks can be placed on.
+        :param url: URL of the daemon, e.g. unix:///var/run/docker.sock or tcp://127.0.0.1:2375,
+                    empty means the default daemon from the environment.
+        :param capacity: Maximum number of POCs running on this daemon at once, 0 means no limit.
+        :param name: Name of the daemon shown in the logs, default is the URL.
+        """
+        self.url = url.strip() if url else ''
+        self.capacity = max(0, int(capacity or 0))
+        self.name = name if name else (self.url if self.url else 'default')
+        self.running = 0
+        self.images = {}  # repository name -> whether images of it exist on this daemon
+
+    def has_room(self) -> bool:
+        return self.capacity == 0 or self.running < self.capacity
+
+    def load(self) -> float:
+        return self.running / self.capacity if self.capacity else float(self.running)
+
+    def get_handle(self) -> DockerHandle:
+        return DockerHandle(base_url=self.url)
+
+    def __str__(self):
+        return f"{self.name} ({self.running}/{self.capacity if self.capacity else 'unlimited'})"
+
+
+class DockerPool:
+    def __init__(self, endpoints: list = None):
+        """
+        Pool of Docker daemons, POCs are placed on them by image locality, load and capacity.
+        :param endpoints: List of DockerEndpoint, if empty, only the default daemon from the environment is used.
+        """
+        self.endpoints = endpoints if endpoints else [DockerEndpoint()]
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls):
+        """
+        Create the pool from `Docker.endpoints` in the config.
+        :return: DockerPool object.
+        """
+        docker_config = load_config().get("Docker", {}) or {}
+        endpoints = []
+        for endpoint in docker_config.get("endpoints", []) or []:
+            if isinstance(endpoint, str):
+                endpoint = {"url": endpoint}
+            endpoints.append(DockerEndpoint(url=endpoint.get("url", ""), capacity=endpoint.get("capacity", 0),
+                                            name=endpoint.get("name", "")))
+        if endpoints:
+            logging.info(f"Docker endpoints: {', '.join(str(e) for e in endpoints)}")
+        return cls(endpoints)
+
+    def _has_images(self, endpoint: DockerEndpoint, repo_name: str) -> bool:
+        """
+        Check whether images of the repository were built on the daemon, the daemon is only asked once.
+        :param endpoint: The Docker endpoint.
+        :param repo_name: The name of the repository.
+        :return: True if the daemon has images of the repository.
+        """
+        if not repo_name:
+            return False
+        if repo_name not in endpoint.images:
+            images = endpoint.get_handle().get_image_vulbench(image_name=f"vulbench_{repo_name}".lower())
+            endpoint.images[repo_name] = len(images) > 0
+        return endpoint.images[repo_name]
+
+    def acquire(self, repo_name: str = '') -> DockerEndpoint:
+        """
+        Block until a daemon has room, and place a POC on it.
+        Daemons already holding images of the repository are preferred, then the least loaded one.
+        :param repo_name: The name of the repository of the POC.
+        :return: The chosen Docker endpoint, to be passed back to release().
+        """
+        with self._cond:
+            while True:
+                candidates = [e for e in self.endpoints if e.has_room()]
+                if candidates:
+                    break
+                self._cond.wait()
+            chosen = min(candidates, key=lambda e: (not self._has_images(e, repo_name), e.load()))
+            chosen.running += 1
+            if repo_name:
+                chosen.images[repo_name] = True
+            if len(self.endpoints) > 1:
+                logging.info(f"Placed {repo_name} on Docker endpoint {chosen}")
+            return chosen
+
+    def release(self, endpoint: DockerEndpoint) -> None:
+        with self._cond:
+            endpoint.running = max(0, endpoint.running - 1)
+            self._cond.notify_all()
+
+    def get_handles(self) -> list:
+        return [endpoint.get_handle() for endpoint in self.endpoints]
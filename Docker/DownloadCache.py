@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import requests
+import docker
+from requests.adapters import HTTPAdapter
+from utils import get_workspace, load_config
+
+
+class DownloadCache:
+    # One pooled session for all downloads, so connections to the same host are reused
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir: str = ''):
+        """
+        Content-addressed cache of downloaded files in the workspace.
+        Files are stored by their SHA-256, revalidated with ETag/Last-Modified, and the least recently used ones
+        are evicted once the cache grows over `Download.cache_size` in the config.
+        :param cache_dir: Directory of the cache, default is `downloads` under the workspace.
+        """
+        self.cache_dir = cache_dir if cache_dir else os.path.join(get_workspace(), "downloads")
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        download_config = load_config().get("Download", {}) or {}
+        self.timeout = download_config.get("timeout", 60) or None
+        cache_size = download_config.get("cache_size", "2g")
+        self.max_size = docker.utils.parse_bytes(str(cache_size)) if cache_size else 0
+
+    def load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.warning(f"Failed to load download cache index {self.index_path}: {e}")
+            return {}
+
+    def save_index(self, index: dict) -> None:
+        tmp_path = f"{self.index_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def get_object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256)
+
+    def fetch(self, url: str) -> str | None:
+        """
+        Get a file from the cache, downloading it only if it is missing or changed on the server.
+        :param url: The URL of the file.
+        :return: The path of the cached file, or None if the download failed and nothing is cached.
+        """
+        with self._lock:
+            entry = self.load_index().get(url)
+        if entry is not None and not os.path.exists(self.get_object_path(entry["sha256"])):
+            entry = None
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        tmp_path = os.path.join(self.objects_dir, f".{uuid.uuid4().hex}.tmp")
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304 and entry is not None:
+                    logging.info(f"Download cache hit for {url}, not modified on the server.")
+                    return self._touch(url, entry)
+                response.raise_for_status()
+                sha256 = hashlib.sha256()
+                size = 0
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+                entry = {"sha256": sha256.hexdigest(), "size": size, "etag": response.headers.get("ETag", ""),
+                         "last_modified": response.headers.get("Last-Modified", "")}
+            object_path = self.get_object_path(entry["sha256"])
+            os.replace(tmp_path, object_path)
+            logging.info(f"Downloaded {url} ({size} bytes) into the download cache as {entry['sha256']}")
+            return self._touch(url, entry)
+        except Exception as e:
+            if entry is not None:
+                logging.warning(f"Failed to revalidate {url}, using the cached file: {e}")
+                return self._touch(url, entry)
+            logging.error(f"Failed to download {url}: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _touch(self, url: str, entry: dict) -> str:
+        """
+        Record the use of a cache entry and evict the least recently used entries over the size limit.
+        :param url: The URL of the entry.
+        :param entry: The entry.
+        :return: The path of the cached file.
+        """
+        with self._lock:
+            index = self.load_index()
+            entry["used"] = time.time()
+            index[url] = entry
+            self.evict(index, keep=entry["sha256"])
+            self.save_index(index)
+        return self.get_object_path(entry["sha256"])
+
+    def evict(self, index: dict, keep: str = '') -> None:
+        """
+        Remove the least recently used files until the cache fits in its size limit, the index is updated in place.
+        :param index: The index of the cache.
+        :param keep: The SHA-256 of a file that must not be evicted.
+        """
+        if not self.max_size:
+            return
+        objects = {}
+        for url, entry in index.items():
+            used = objects.get(entry["sha256"], {}).get("used", 0)
+            objects[entry["sha256"]] = {"size": entry.get("size", 0), "used": max(used, entry.get("used", 0))}
+        total = sum(o["size"] for o in objects.values())
+        for sha256, o in sorted(objects.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+            try:
+                os.remove(self.get_object_path(sha256))
+            except FileNotFoundError:
+                pass
+            total -= o["size"]
+            for url in [u for u, e in index.items() if e["sha256"] == sha256]:
+                del index[url]
+            logging.info(f"Evicted {sha256} ({o['size']} bytes) from the download cache.")
@@ -0,0 +1,225 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import re
+import shlex
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import functools
+import docker
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from Docker.DockerHandle import DockerHandle
+from utils import get_workspace, load_config
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+
+class IndexHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug(f"Wheelhouse request from {self.address_string()}: {format % args}")
+
+
+class Wheelhouse:
+    # Build backends of the projects, needed to build them from source when the wheelhouse is the only index
+    build_requirements = ["pip", "setuptools", "wheel", "build", "poetry-core", "hatchling", "flit-core"]
+    # Directory of the wheels in the build container
+    wheel_dir = "/vulbench_wheels"
+
+    def __init__(self, docker_handle: DockerHandle = None, wheelhouse_dir: str = ''):
+        """
+        Local wheelhouse of the dependencies of the POCs, served as a simple index (PEP 503),
+        so that the image builds and the containers install them without internet access.
+        :param docker_handle: Docker handle to build the wheels with.
+        :param wheelhouse_dir: Directory of the wheelhouse, default is `wheelhouse` under the workspace.
+        """
+        self.wheelhouse_dir = wheelhouse_dir if wheelhouse_dir else os.path.join(get_workspace(), "wheelhouse")
+        self.files_dir = os.path.join(self.wheelhouse_dir, "files")
+        self.index_dir = os.path.join(self.wheelhouse_dir, "simple")
+        os.makedirs(self.files_dir, exist_ok=True)
+        wheelhouse_config = load_config().get("Wheelhouse", {}) or {}
+        self.bind = wheelhouse_config.get("bind", "0.0.0.0") or "0.0.0.0"
+        self.port = int(wheelhouse_config.get("port", 8642) or 8642)
+        self.host = wheelhouse_config.get("host", "host.docker.internal") or "host.docker.internal"
+        self.fallback = bool(wheelhouse_config.get("fallback", False))
+        self.docker_handle = docker_handle
+        self.server = None
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool((load_config().get("Wheelhouse", {}) or {}).get("enabled", False))
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return re.sub(r"[-_.]+", "-", name).lower()
+
+    @property
+    def index_url(self) -> str:
+        return f"http://{self.host}:{self.port}/simple/"
+
+    @staticmethod
+    def build_requires(package_dir: str) -> list:
+        """
+        Gets the build requirements declared in the pyproject.toml of a package.
+        :param package_dir: The directory of the package.
+        :return: List of the requirements, empty if there is no pyproject.toml.
+        """
+        pyproject_path = os.path.join(package_dir, "pyproject.toml")
+        if not os.path.exists(pyproject_path):
+            return []
+        try:
+            with open(pyproject_path, 'rb') as f:
+                requires = tomllib.load(f).get("build-system", {}).get("requires", [])
+        except Exception as e:
+            logging.warning(f"Failed to parse {pyproject_path}: {e}")
+            return []
+        return [r for r in requires if isinstance(r, str)]
+
+    def wheel_commands(self, install_commands: list, requirements: list, build_requires: list = None) -> list:
+        """
+        Translate the install commands of a project and the requirements of its POC into `pip wheel` commands.
+        Commands installing the project itself (e.g. `poetry install`, `python setup.py install`) build it,
+        along with all its dependencies.
+        :param install_commands: Commands installing the project, run in its directory.
+        :param requirements: Requirements of the POC.
+        :param build_requires: Build requirements of the project.
+        :return: List of the `pip wheel` commands.
+        """
+        pip_wheel = f"pip wheel --wheel-dir {self.wheel_dir}"
+        commands = []
+        project = False
+        for command in install_commands:
+            try:
+                tokens = shlex.split(command)
+            except ValueError:
+                continue
+            if tokens[:2] != ["pip", "install"]:
+                project = True
+                continue
+            args = [t for t in tokens[2:] if t not in ("-e", "--editable", "--force-reinstall", "-U", "--upgrade")]
+            if args == ["."]:
+                project = True
+            elif args:
+                commands.append(f"{pip_wheel} {shlex.join(args)}")
+        if project:
+            commands.append(f"{pip_wheel} .")
+        build_requires = list(dict.fromkeys(self.build_requirements + (build_requires or [])))
+        commands.append(f"{pip_wheel} {shlex.join(build_requires)}")
+        if requirements:
+            commands.append(f"{pip_wheel} {shlex.join(requirements)}")
+        return list(dict.fromkeys(commands))
+
+    def build(self, py_version: str, package_dir: str, install_commands: list, requirements: list) -> int:
+        """
+        Build the wheels of a project and of the requirements of its POC in a container of its Python version,
+        and add them to the wheelhouse.
+        :param py_version: Python version of the POC.
+        :param package_dir: The directory of the project.
+        :param install_commands: Commands installing the project, see wheel_commands.
+        :param requirements: Requirements of the POC.
+        :return: Number of wheels added to the wheelhouse.
+        """
+        dh = self.docker_handle if self.docker_handle else DockerHandle()
+        py_version = py_version if py_version else "3.10"
+        base_image = dh.get_base_image(py_version) or f"python:{py_version}"
+        try:
+            try:
+                image = dh.client.images.get(base_image)
+            except docker.errors.ImageNotFound:
+                image = dh.client.images.pull(base_image)
+        except Exception as e:
+            logging.error(f"Failed to get image {base_image} to build wheels: {e}")
+            return 0
+        container = dh.run_by_image(image=image, suffix="wheelhouse")
+        if container is None:
+            logging.error(f"Failed to start a container of {base_image} to build wheels.")
+            return 0
+        try:
+            dh.container_copy(container_id=container.id, src_path=package_dir, dest_path="/vulbench_src")
+            for command in self.wheel_commands(install_commands, requirements, self.build_requires(package_dir)):
+                logging.info(f"Building wheels with `{command}` on Python {py_version}...")
+                output = dh.container_exec(container_id=container.id,
+                                           command=["sh", "-c", f"mkdir -p {self.wheel_dir} && cd /vulbench_src "
+                                                                f"&& {command}"])
+                if output is None or "ERROR:" in output:
+                    logging.warning(f"Building wheels with `{command}` failed on Python {py_version}: \n{output}")
+
+            added = 0
+            with tempfile.TemporaryDirectory(dir=self.wheelhouse_dir) as tmp_dir:
+                if dh.get_files_from_container(container.id, src_path=self.wheel_dir, dest_path=tmp_dir) is None:
+                    return 0
+                for root, _, files in os.walk(tmp_dir):
+                    for file in files:
+                        if file.endswith(".whl") and not os.path.exists(os.path.join(self.files_dir, file)):
+                            shutil.move(os.path.join(root, file), os.path.join(self.files_dir, file))
+                            added += 1
+            return added
+        finally:
+            dh.container_remove(container.id)
+
+    def write_index(self) -> int:
+        """
+        Write the simple index of the wheels in the wheelhouse.
+        :return: Number of packages in the index.
+        """
+        packages = {}
+        for file in sorted(os.listdir(self.files_dir)):
+            if file.endswith(".whl"):
+                packages.setdefault(self.normalize(file.split('-')[0]), []).append(file)
+        os.makedirs(self.index_dir, exist_ok=True)
+        for name, files in packages.items():
+            links = []
+            for file in files:
+                sha256 = hashlib.sha256()
+                with open(os.path.join(self.files_dir, file), 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b''):
+                        sha256.update(chunk)
+                sha256 = sha256.hexdigest()
+                links.append(f'<a href="../../files/{file}#sha256={sha256}">{file}</a><br/>')
+            os.makedirs(os.path.join(self.index_dir, name), exist_ok=True)
+            with open(os.path.join(self.index_dir, name, "index.html"), 'w', encoding='utf-8') as f:
+                f.write("<!DOCTYPE html>\n<html><body>\n" + "\n".join(links) + "\n</body></html>\n")
+        with open(os.path.join(self.index_dir, "index.html"), 'w', encoding='utf-8') as f:
+            f.write("<!DOCTYPE html>\n<html><body>\n" +
+                    "\n".join(f'<a href="{name}/">{name}</a><br/>' for name in sorted(packages)) +
+                    "\n</body></html>\n")
+        logging.info(f"Wheelhouse index of {len(packages)} packages written to {self.index_dir}")
+        return len(packages)
+
+    def start(self) -> bool:
+        """
+        Serve the wheelhouse in the background, and point pip in the image builds and containers to it.
+        :return: True if the wheelhouse is served.
+        """
+        if self.write_index() == 0:
+            logging.warning(f"The wheelhouse {self.wheelhouse_dir} is empty, build it with `--wheelhouse build` first.")
+        try:
+            self.server = ThreadingHTTPServer((self.bind, self.port),
+                                              functools.partial(IndexHandler, directory=self.wheelhouse_dir))
+        except OSError as e:
+            logging.error(f"Failed to serve the wheelhouse on {self.bind}:{self.port}: {e}")
+            return False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        package_index = {"PIP_INDEX_URL": self.index_url, "PIP_TRUSTED_HOST": self.host}
+        if self.fallback:
+            package_index["PIP_EXTRA_INDEX_URL"] = "https://pypi.org/simple/"
+        DockerHandle.package_index = package_index
+        # On Linux the Docker host is only known by this name in the containers if it is mapped explicitly
+        DockerHandle.package_index_hosts = {self.host: "host-gateway"} if self.host == "host.docker.internal" else {}
+        logging.info(f"Wheelhouse served on {self.bind}:{self.port}, containers install from {self.index_url}")
+        print(f"[VulBench] Wheelhouse served at {self.index_url}")
+        return True
+
+    def stop(self) -> None:
+        DockerHandle.package_index = {}
+        DockerHandle.package_index_hosts = {}
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -3,12 +3,48 @@ __author__ = 'WILL_V'
 
 import logging
 import os
+import shlex
 import shutil
 import utils
 
 
+# System packages of every image, on top of the build tools
+BASE_DEPENDENCIES = ["vim", "curl", "patch", "git"]
+
+
+def get_base_dockerfile(py_version="", dependencies=None):
+    """
+    Generate the Dockerfile content of the shared base image of a Python version.
+    :param py_version: Python version to use in the Dockerfile.
+    :param dependencies: Dependencies to be installed in the Docker image, default is BASE_DEPENDENCIES.
+    :return: Dockerfile content as a string.
+    """
+    py_version = py_version if py_version else "3.10"
+    dependencies = ' '.join(dep.strip() for dep in (dependencies if dependencies else BASE_DEPENDENCIES))
+
+    base_dockerfile = f"""
+FROM python:{py_version}
+
+USER root
+
+RUN mkdir /vulbench
+
+WORKDIR /vulbench
+
+RUN apt-get update \\
+    && apt-get install -y --no-install-recommends build-essential libssl-dev libffi-dev {dependencies} \\
+    && apt-get clean
+
+# Initialize the environment
+RUN pip install --upgrade pip setuptools wheel build
+    """
+
+    return base_dockerfile
+
+
 def get_dockerfile(py_version="", file_path="", dependencies=None, other_commands=None, environment="", cmd=None,
-                   patch="", apply_patch=False):
+                   patch="", apply_patch=False, git_commit="", git_tag="", base_image="", manifests=None,
+                   dependency_commands=None, poc_dependency_commands=None, build_args=None):
     """
     Generate the Dockerfile content.
     :param py_version: Python version to use in the Dockerfile.
@@ -19,6 +55,18 @@ def get_dockerfile(py_version="", file_path="", dependencies=None, other_command
     :param cmd: Command to be executed when the Docker container starts.
     :param patch: Path of the patch file to be applied in the Docker image.
     :param apply_patch: Whether to apply the patch file.
+    :param git_commit: Commit the files are checked out at, if they come from a Git repository. The image gets
+                       a new repository holding only this tree, not the history of the project.
+    :param git_tag: Latest tag reachable from the commit, set on the tree so that versions taken from Git still work.
+    :param base_image: The shared base image built from get_base_dockerfile, if any.
+                       Only the dependencies missing from BASE_DEPENDENCIES are installed on top of it.
+    :param manifests: Dependency manifests of the project (e.g. setup.py, requirements.txt), relative to file_path.
+                      They are copied before the source, so the dependency layers survive source changes.
+    :param dependency_commands: Commands installing the third-party dependencies from the manifests only.
+    :param poc_dependency_commands: Commands installing the dependencies of the POC, run after the other commands,
+                                    so that installing the project does not change the versions the POC asks for.
+    :param build_args: Names of the build arguments passed to the build, e.g. PIP_INDEX_URL of the local wheelhouse.
+                       They are only set while building, not in the containers.
     :return: Dockerfile content as a string.
     """
 
@@ -32,6 +80,8 @@ def get_dockerfile(py_version="", file_path="", dependencies=None, other_command
     ocs = "\n"
     for oc in other_commands:
         ocs += f"RUN {oc.strip()}\n"
+    for pdc in poc_dependency_commands or []:
+        ocs += f"RUN {pdc.strip()}\n"
     environment = environment if environment else ""
     cmd = cmd if cmd is not None and len(cmd) > 0 else ["/bin/bash"]
 
@@ -42,6 +92,8 @@ def get_dockerfile(py_version="", file_path="", dependencies=None, other_command
         if not file_path.endswith('/'):
             file_path += '/'
 
+    do_args = "".join(f"ARG {arg}\n" for arg in build_args) if build_args else ""
+
     do_patch = ""
     if patch != '' and os.path.exists(patch):
         patch_name = os.path.basename(patch)
@@ -49,26 +101,74 @@ def get_dockerfile(py_version="", file_path="", dependencies=None, other_command
         if apply_patch:
             do_patch = f"git apply /vulbench/{patch_name}\n"
 
+    # The checked-out tree is committed in a new repository, patches and trials need one but not the history
+    do_git = ""
+    if git_commit != '':
+        do_git = (f"RUN rm -rf /vulbench/.git \\\n"
+                  f"    && git init -q /vulbench \\\n"
+                  f"    && git -C /vulbench add -A \\\n"
+                  f"    && git -C /vulbench -c user.name=VulBench -c user.email=vulbench@localhost "
+                  f"commit -q --no-verify -m {git_commit}\n")
+        if git_tag != '':
+            do_git += f"RUN git -C /vulbench tag {shlex.quote(git_tag)}\n"
+
+    # Third-party dependencies are installed from the manifests alone, the source only comes in afterwards.
+    # A failure is left to the project install, which installs them again anyway.
+    do_dependencies = ""
+    if dependency_commands:
+        for manifest in manifests or []:
+            do_dependencies += f"COPY {file_path.rstrip('/')}/{manifest} /vulbench/{manifest}\n"
+        for dc in dependency_commands:
+            do_dependencies += f"RUN {dc.strip()} \\\n" \
+                               f"    || echo 'Installing dependencies from the manifests failed, left to the project install'\n"
+
+    if base_image != '':
+        extra_dependencies = ' '.join(dep for dep in dependencies.split() if dep not in BASE_DEPENDENCIES)
+        do_install = f"RUN apt-get update \\\n    && apt-get install -y --no-install-recommends {extra_dependencies} \\\n" \
+                     f"    && apt-get clean\n" if extra_dependencies else ""
+        base_dockerfile = f"""
+FROM {base_image}
+
+USER root
+{do_args}
+WORKDIR /vulbench
+{do_install}
+# Install the dependencies
+{do_dependencies}
+COPY {file_path}/ /vulbench/
+{do_git}
+# Apply patch if provided
+{do_patch}
+{ocs}
+
+{environment}
+
+CMD {str(cmd).replace("'", '"')}
+    """
+        return base_dockerfile
+
     base_dockerfile = f"""
 FROM python:{py_version}
 
 USER root
-
+{do_args}
 RUN mkdir /vulbench
 
 WORKDIR /vulbench
 
-COPY {file_path}/ /vulbench/
-
 RUN apt-get update \\
     && apt-get install -y --no-install-recommends build-essential libssl-dev libffi-dev {dependencies} \\
     && apt-get clean
 
-# Apply patch if provided
-{do_patch}
-
 # Initialize the environment
 RUN pip install --upgrade pip setuptools wheel build
+
+# Install the dependencies
+{do_dependencies}
+COPY {file_path}/ /vulbench/
+{do_git}
+# Apply patch if provided
+{do_patch}
 {ocs}
 
 {environment}
@@ -2,13 +2,16 @@
 __author__ = 'WILL_V'
 
 import json
+import glob
 import logging
 import os.path
 import utils
 import time
 from Manage import Manage
 from Docker.DockerHandle import DockerHandle
+from Docker.DockerPool import DockerPool
 from Docker.Deploy import Deploy
+from Docker.Wheelhouse import Wheelhouse
 from Data.PatchesAnalysis import PatchesAnalysis
 
 utils.setup_logging()
@@ -40,12 +43,18 @@ class Invoke:
                 clean_args = ['log']
             fun_args.append({"function": "clean", "args": clean_args})
             return fun_args  # If user selected clean, we return immediately
+        elif self.args.wheelhouse is not None:  # Building or serving the wheelhouse
+            fun_args.append({"function": "wheelhouse", "args": self.args.wheelhouse})
+            return fun_args
         elif self.args.new is not None:  # Creating a new POC
             new_arg = self.args.new.strip()
             if new_arg == '':
                 logging.error("Must provide a name for the new poc.")
                 return None
             fun_args.append({"function": "new", "args": new_arg})
+        elif self.args.run is None and self.args.resume is not None:
+            logging.error("Must provide the poc names to resume with `-r`, e.g. `-r all --resume <run_id>`.")
+            return None
         elif self.args.run is not None:
             run_arg = self.args.run.strip()
             if run_arg == '':
@@ -63,13 +72,64 @@ class Invoke:
                 if patch_path == '':
                     logging.error("Must provide a path for the patch to apply.")
                     return None
-                if not os.path.exists(patch_path):
-                    logging.error(f"Patch file/directory does not exist: {patch_path}")
+                patch_path = self.expand_patch_path(patch_path)
+                if patch_path is None:
                     return None
-            fun_args.append({"function": "run", "args": run_arg, "patch": patch_path})
+            if self.args.jobs is not None and self.args.jobs < 1:
+                logging.error("The number of jobs must be at least 1.")
+                return None
+            if self.args.prefetch is not None and self.args.prefetch < 0:
+                logging.error("The number of prefetched PoCs can not be negative.")
+                return None
+            if self.args.trials and type(patch_path) is not list:
+                logging.warning("`--trials` only applies to several patch directories (matrix mode), ignored.")
+            fun_args.append({"function": "run", "args": run_arg, "patch": patch_path, "jobs": self.args.jobs,
+                             "prefetch": self.args.prefetch,
+                             "resume": self.args.resume.strip() if self.args.resume else '',
+                             "rebuild": self.args.rebuild, "rebuild_base": self.args.rebuild_base,
+                             "trials": self.args.trials})
 
         return fun_args
 
+    @staticmethod
+    def expand_patch_path(patch_arg: str) -> str | list | None:
+        """
+        Expand the patch argument, which can be a path, or several directories separated by commas or given by a glob,
+        e.g. `patches/*/` for one directory of `<CVE>.patch` files per model.
+        :param patch_arg: The patch argument.
+        :return: The path of the patch file/directory, a list of patch directories (matrix mode), or None if invalid.
+        """
+        patch_paths = []
+        for pattern in patch_arg.split(','):
+            pattern = pattern.strip()
+            if pattern == '':
+                continue
+            matched = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matched:
+                logging.error(f"No patch directory matches: {pattern}")
+                return None
+            for path in matched:
+                if not os.path.exists(path):
+                    logging.error(f"Patch file/directory does not exist: {path}")
+                    return None
+                if path not in patch_paths:
+                    patch_paths.append(path)
+        if len(patch_paths) == 0:
+            logging.error("Must provide a path for the patch to apply.")
+            return None
+        if len(patch_paths) == 1:
+            return patch_paths[0]
+        not_dirs = [path for path in patch_paths if not os.path.isdir(path)]
+        if not_dirs:
+            logging.error(f"Several patches must all be directories (one per model): {', '.join(not_dirs)}")
+            return None
+        models = [os.path.basename(os.path.normpath(path)) for path in patch_paths]
+        if len(set(models)) != len(models):
+            logging.error(f"Patch directories must have distinct names, as they are used as model names: {models}")
+            return None
+        logging.info(f"Matrix mode with {len(patch_paths)} patch directories: {', '.join(patch_paths)}")
+        return patch_paths
+
     @staticmethod
     def clean(clean_args: list):
         """
@@ -99,39 +159,41 @@ class Invoke:
 
         def clean_docker():
             logging.info("[CLEAN] Cleaning Docker resources.")
-            dh = DockerHandle()
+            for dh in DockerPool.from_config().get_handles():
+                if dh.base_url:
+                    logging.info(f"Cleaning Docker endpoint: {dh.base_url}")
 
-            # Clean up Docker containers related to VulBench
-            vb_containers = dh.get_container_vulbench()
-            if vb_containers:
-                all_containers = [container.name for container in vb_containers if container.name]
-                print(f"{len(all_containers)} VulBench containers found: {all_containers}")
-                choice = input("Do you want to remove these containers? (y/n): ").strip().lower()
-                if choice == 'y':
-                    for container in vb_containers:
-                        logging.warning(f"Removing container: {container.name}")
-                        dh.container_remove(container.name)
+                # Clean up Docker containers related to VulBench
+                vb_containers = dh.get_container_vulbench()
+                if vb_containers:
+                    all_containers = [container.name for container in vb_containers if container.name]
+                    print(f"{len(all_containers)} VulBench containers found: {all_containers}")
+                    choice = input("Do you want to remove these containers? (y/n): ").strip().lower()
+                    if choice == 'y':
+                        for container in vb_containers:
+                            logging.warning(f"Removing container: {container.name}")
+                            dh.container_remove(container.name)
+                    else:
+                        logging.info("Skipping container removal.")
                 else:
-                    logging.info("Skipping container removal.")
-            else:
-                logging.info("No VulBench containers found.")
+                    logging.info("No VulBench containers found.")
 
-            # Clean up Docker images related to VulBench
-            vb_images = dh.get_image_vulbench()
-            if vb_images:
-                all_images = [image.tags[0] for image in vb_images if image.tags]
-                print(f"{len(all_images)} VulBench images found: {all_images}")
-                choice = input("Do you want to remove these images? (y/n): ").strip().lower()
-                if choice == 'y':
-                    for image in vb_images:
-                        logging.warning(f"Removing image: {image.tags[0]}")
-                        dh.image_remove(image.tags[0])
+                # Clean up Docker images related to VulBench
+                vb_images = dh.get_image_vulbench()
+                if vb_images:
+                    all_images = [image.tags[0] for image in vb_images if image.tags]
+                    print(f"{len(all_images)} VulBench images found: {all_images}")
+                    choice = input("Do you want to remove these images? (y/n): ").strip().lower()
+                    if choice == 'y':
+                        for image in vb_images:
+                            logging.warning(f"Removing image: {image.tags[0]}")
+                            dh.image_remove(image.tags[0])
+                    else:
+                        logging.info("Skipping image removal.")
                 else:
-                    logging.info("Skipping image removal.")
-            else:
-                logging.info("No VulBench images found.")
+                    logging.info("No VulBench images found.")
 
-            dh.remove_dangling_images(only_vulbench=True)
+                dh.remove_dangling_images(only_vulbench=True)
 
         def clean_log():
             logging.info("[CLEAN] Cleaning logs.")
@@ -253,6 +315,49 @@ class Invoke:
         else:
             logging.error(f"New POC '{name}' creation failed.")
 
+    @staticmethod
+    def run(fun_arg: dict):
+        """
+        Run the PoCs given by the `run` arguments.
+        :param fun_arg: The parsed `run` arguments, see parse_args.
+        :return:
+        """
+        manage = Manage()
+        manage.trials = fun_arg['trials']
+        try:
+            if type(fun_arg['args']) is str:
+                if fun_arg['args'].strip().lower() == 'all':
+                    manage.run_all_bench(poc_list=None, patch_dir=fun_arg['patch'], jobs=fun_arg['jobs'],
+                                         resume=fun_arg['resume'], prefetch=fun_arg['prefetch'])
+                elif type(fun_arg['patch']) is list:
+                    manage.run_all_bench(poc_list=[fun_arg['args']], patch_dir=fun_arg['patch'],
+                                         jobs=fun_arg['jobs'], resume=fun_arg['resume'],
+                                         prefetch=fun_arg['prefetch'])
+                else:
+                    manage.run_bench_by_name(fun_arg['args'], fun_arg['patch'])
+            elif type(fun_arg['args']) is list:
+                manage.run_all_bench(poc_list=fun_arg['args'], patch_dir=fun_arg['patch'], jobs=fun_arg['jobs'],
+                                     resume=fun_arg['resume'], prefetch=fun_arg['prefetch'])
+        finally:
+            # Remove the pre-started containers no run used
+            manage.container_pool.drain()
+
+    @staticmethod
+    def serve_wheelhouse():
+        """
+        Serve the local wheelhouse as a package index until interrupted.
+        :return:
+        """
+        wheelhouse = Wheelhouse()
+        if not wheelhouse.start():
+            return
+        print("[VulBench] Press Ctrl+C to stop serving the wheelhouse.")
+        try:
+            while True:
+                time.sleep(3600)
+        finally:
+            wheelhouse.stop()
+
     def start(self):
         logging.info("VulBench initialized.")
         fun_args = self.parse_args()
@@ -268,15 +373,24 @@ class Invoke:
             if fun_arg['function'] == 'new':  # Creating a new benchmark
                 self.new_poc(fun_arg['args'])
                 break
+            if fun_arg['function'] == 'wheelhouse':  # Building or serving the wheelhouse
+                if fun_arg['args'] == 'build':
+                    Manage().build_wheelhouse()
+                else:
+                    self.serve_wheelhouse()
+                break
             if fun_arg['function'] == 'run':
-                manage = Manage()
-                if type(fun_arg['args']) is str:
-                    if fun_arg['args'].strip().lower() == 'all':
-                        manage.run_all_bench(poc_list=None, patch_dir=fun_arg['patch'])
-                    else:
-                        manage.run_bench_by_name(fun_arg['args'], fun_arg['patch'])
-                elif type(fun_arg['args']) is list:
-                    manage.run_all_bench(poc_list=fun_arg['args'], patch_dir=fun_arg['patch'])
+                DockerHandle.rebuild_images = fun_arg['rebuild']
+                DockerHandle.rebuild_base = fun_arg['rebuild_base']
+                wheelhouse = Wheelhouse() if Wheelhouse.enabled() else None
+                if wheelhouse is not None and not wheelhouse.start():
+                    logging.error("Failed to serve the wheelhouse, dependencies will be installed from PyPI.")
+                    wheelhouse = None
+                try:
+                    self.run(fun_arg)
+                finally:
+                    if wheelhouse is not None:
+                        wheelhouse.stop()
                 break
         end_time = time.time()
         logging.info(f"VulBench finished in {time.strftime('%H h %M m %S s', time.gmtime(end_time - start_time))}.")
@@ -1,21 +1,106 @@
 # -*- coding: UTF-8 -*-
 __author__ = 'WILL_V'
 
+import io
 import json
+import hashlib
 import os
+import re
+import copy
 import logging
 import base64
 import time
+import shutil
+import shlex
+import tarfile
+import tempfile
+import threading
 import concurrent.futures
 from Docker.Deploy import Deploy
-from Docker.DockerHandle import DockerHandle
+from Docker.DockerHandle import DockerHandle, ExecTimeout
+from Docker.DockerPool import DockerPool
+from Docker.ContainerPool import ContainerPool
+from Docker.Wheelhouse import Wheelhouse
 from Data.ResultAnalysis import BenchResult
-from utils import get_workspace, load_config
+from Data.RunJournal import RunJournal
+from Data.StageTimings import StageTimings
+from utils import get_workspace, load_config, Slots
 
 
 class Manage:
     def __init__(self):
         self.local_poc_path = os.path.join(os.path.dirname(__file__), "Data", "poc")
+        # Mirrors are shared by all runs of a repository, so fetching and adding worktrees to them are serialized
+        self._repo_locks = {}
+        self._repo_locks_guard = threading.Lock()
+        self.docker_pool = DockerPool.from_config()
+        self.container_pool = ContainerPool.from_config()
+        self.stage_timings = StageTimings()
+        # Archives of the POC files copied into the containers, by content hash, see poc_payload
+        self._payloads = {}
+        self._payloads_guard = threading.Lock()
+        # Run the patches of matrix mode as trials in one patched container, see _run_matrix_containers
+        self.trials = False
+        # Run the commands of each lane in one call to the agent in the container, see run_lane_agent
+        self.agent = bool((load_config().get("Bench", {}) or {}).get("agent", False))
+
+    def get_repo_lock(self, repo_name: str) -> threading.Lock:
+        """
+        Get the lock guarding the mirror of a repository in the workspace.
+        :param repo_name: The name of the repository.
+        :return: The lock of the repository.
+        """
+        with self._repo_locks_guard:
+            if repo_name not in self._repo_locks:
+                self._repo_locks[repo_name] = threading.Lock()
+            return self._repo_locks[repo_name]
+
+    def poc_payload(self, name: str) -> bytes:
+        """
+        Get the archive of the files a POC needs in its containers, its directory, InOut.py and the agent
+        running the lanes (Agent.py) under `poc/`.
+        It is built once and cached by the hash of its content, so the containers of a POC share it
+        until its files change.
+        :param name: The name of the POC.
+        :return: Content of the tar archive, to be extracted in /vulbench.
+        """
+        files = [os.path.join(self.local_poc_path, "InOut.py"), os.path.join(self.local_poc_path, "Agent.py")]
+        for root, dirs, file_names in os.walk(os.path.join(self.local_poc_path, name)):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            files += [os.path.join(root, f) for f in sorted(file_names) if not f.endswith(".pyc")]
+        digest = hashlib.sha256()
+        contents = []
+        for file in files:
+            with open(file, 'rb') as f:
+                content = f.read()
+            arcname = "poc/" + os.path.relpath(file, self.local_poc_path).replace(os.sep, "/")
+            digest.update(arcname.encode() + b"\0" + hashlib.sha256(content).digest())
+            contents.append((arcname, content, os.stat(file)))
+        key = digest.hexdigest()
+        with self._payloads_guard:
+            if key in self._payloads:
+                return self._payloads[key]
+        tar_stream = io.BytesIO()
+        with tarfile.open(fileobj=tar_stream, mode='w') as tar:
+            for arcname in sorted({os.path.dirname(arcname) for arcname, _, _ in contents}):
+                for i in range(arcname.count("/") + 1):
+                    dir_name = "/".join(arcname.split("/")[:i + 1])
+                    if dir_name not in tar.getnames():
+                        dir_info = tarfile.TarInfo(dir_name)
+                        dir_info.type = tarfile.DIRTYPE
+                        dir_info.mode = 0o755
+                        tar.addfile(dir_info)
+            for arcname, content, stat in contents:
+                tar_info = tarfile.TarInfo(arcname)
+                tar_info.size = len(content)
+                tar_info.mode = stat.st_mode & 0o777
+                tar_info.mtime = int(stat.st_mtime)
+                tar.addfile(tar_info, io.BytesIO(content))
+        payload = tar_stream.getvalue()
+        with self._payloads_guard:
+            self._payloads[key] = payload
+        logging.info(f"Built POC payload of {name}: {len(contents)} files, {len(payload)} bytes")
+        return payload
 
     def get_info(self, name: str) -> tuple:
         """
@@ -63,6 +148,7 @@ class Manage:
                         "check_command": security_issue.get("check_command", ""),
                         "deploy_command": security_issue.get("deploy_command", None),
                         "run_kwargs": security_issue.get("run_kwargs", {}),
+                        "timeout": security_issue.get("timeout", None),
                     }
                     return item, necessary
 
@@ -106,7 +192,8 @@ class Manage:
             "input": "",
             "output": "",
             "error": "",
-            "running_time": 0
+            "running_time": 0,
+            "env_init": None,
         }
         if not os.path.exists(result_file):
             logging.error(f"Result file {result_file} does not exist.")
@@ -119,6 +206,7 @@ class Manage:
             "poc_output") else ""
         result["error"] = base64.b64decode(data.get("poc_error", "")).decode('utf-8') if data.get("poc_error") else ""
         result["running_time"] = data.get("running_time", 0)
+        result["env_init"] = data.get("env_init")
         if output:
             print()
             embed = '-' * 50
@@ -138,12 +226,17 @@ class Manage:
             else:
                 print(f"\n[VulBench] POC {result['poc']} running with no error.")
             print(f"\n[VulBench] Running time: {result['running_time']} seconds")
+            if result["env_init"]:
+                print(f"[VulBench] Environment initialized in {result['env_init'].get('time', 0):.2f} seconds, "
+                      f"{result['env_init'].get('baked', 0)} dependencies already in the image, "
+                      f"{result['env_init'].get('installed', 0)} installed")
             print(embed)
             print()
         return result
 
     def run_bench(self, git_repo: str, commit: str, py_version: str, name: str, check_command: str, patch: str = "",
-                  lazy_deploy: bool = True, deploy_command: list = None, run_kwargs: dict = None) -> dict:
+                  lazy_deploy: bool = True, deploy_command: list = None, run_kwargs: dict = None,
+                  timeout: int | dict = None) -> dict:
         """
         Run the benchmark for a specific POC.
         :param git_repo: Git repository URL.
@@ -155,176 +248,1037 @@ class Manage:
         :param lazy_deploy: Lazy deploy or not, default is True.
         :param deploy_command: Command to run for deployment, if empty, will deploy automatically.
         :param run_kwargs: Additional arguments for running the container.
+        :param timeout: Deadlines of the POC from the info file, see get_timeouts.
         :return: Results of the benchmark execution.
         """
-        deployer = Deploy()
+        prepared = self.prepare_bench(git_repo=git_repo, commit=commit, py_version=py_version, name=name,
+                                      check_command=check_command, patch=patch, lazy_deploy=lazy_deploy,
+                                      deploy_command=deploy_command, run_kwargs=run_kwargs, timeout=timeout)
+        return self.execute_bench(prepared)
+
+    def prepare_bench(self, git_repo: str, commit: str, py_version: str, name: str, check_command: str,
+                      patch: str = "", lazy_deploy: bool = True, deploy_command: list = None,
+                      run_kwargs: dict = None, timeout: int | dict = None) -> dict:
+        """
+        Prepare the benchmark for a specific POC: clone the repository, check out the parent commit,
+        get the patch and build the image. No container is started, see execute_bench.
+        :param git_repo: Git repository URL.
+        :param commit: Commit hash to check out.
+        :param py_version: Python version to use for the deployment.
+        :param name: Name of the POC to run.
+        :param check_command: Check command to run before and after patching.
+        :param patch: Path to the patch file, if any, or a dictionary of the model name and its patch file in matrix mode.
+        :param lazy_deploy: Lazy deploy or not, default is True.
+        :param deploy_command: Command to run for deployment, if empty, will deploy automatically.
+        :param run_kwargs: Additional arguments for running the container.
+        :param timeout: Deadlines of the POC from the info file, see get_timeouts.
+        :return: The prepared benchmark, to be passed to execute_bench.
+        """
+        git_url, repo_name = self.get_git_url(git_repo)
+        timing = {}
+        prepare_start = time.time()
+
+        # The image is built on the chosen daemon, so the whole benchmark stays there until execute_bench is done
+        endpoint = self.docker_pool.acquire(repo_name)
+        timeouts = self.get_timeouts(timeout)
+        try:
+            prepared = self._prepare_on(Deploy(docker_handle=endpoint.get_handle()), git_url, repo_name, commit,
+                                        py_version, name, check_command, patch, lazy_deploy, deploy_command, timing)
+            deployed = lazy_deploy and self.snapshot_deploy(prepared, timeout=timeouts["deploy"])
+            timing["total"] = time.time() - prepare_start
+            logging.info(f"Benchmark of {name} prepared in {timing['total']:.2f} seconds "
+                         f"on Docker endpoint {endpoint.name}.")
+            prepared["bench_result"]["docker_endpoint"] = endpoint.name
+            prepared.update({
+                "endpoint": endpoint,
+                "check_command": check_command,
+                "lazy_deploy": lazy_deploy,
+                "deployed": deployed,
+                "run_kwargs": run_kwargs,
+                "patches": patch if isinstance(patch, dict) else None,
+                "timeouts": timeouts,
+            })
+            # Start the containers while the benchmark waits for its turn, one for the original and each patched
+            # lane, in the container slots that are free
+            self.container_pool.warm(prepared["deployer"].docker_handle, prepared["image"], run_kwargs,
+                                     n=1 + (len(patch) if isinstance(patch, dict) and not self.trials else 1))
+        except BaseException:
+            self.docker_pool.release(endpoint)
+            raise
+        return prepared
+
+    def snapshot_deploy(self, prepared: dict, timeout: float = 0) -> bool:
+        """
+        Run the lazy deploy script of a prepared benchmark once and start its containers from the deployed snapshot,
+        see Deploy.deploy_snapshot. It can be turned off with `Docker.snapshot_deploy` in the config.
+        :param prepared: The prepared benchmark, its image is replaced by the snapshot.
+        :param timeout: Deadline of the deploy script in seconds, 0 means no deadline.
+        :return: True if the containers start deployed, False if they have to run the deploy script themselves.
+        """
+        if not (load_config().get("Docker", {}) or {}).get("snapshot_deploy", True):
+            return False
+        bench_result = prepared["bench_result"]
+        stage_start = time.time()
+        try:
+            # The deploy container counts against the running containers like those of the lanes
+            with DockerHandle.container_slots.hold():
+                snapshot = prepared["deployer"].deploy_snapshot(prepared["image"], timeout=timeout,
+                                                                build_stats=bench_result["cache"])
+        except ExecTimeout as e:
+            logging.error(f"Lazy deploy of {prepared['name']} timed out in the snapshot container, "
+                          f"the containers will run the deploy script themselves: {e}")
+            snapshot = None
+        bench_result["timing"]["prepare"]["deploy"] = time.time() - stage_start
+        if snapshot is None:
+            return False
+        prepared["image"] = snapshot
+        return True
+
+    @staticmethod
+    def get_git_url(git_repo: str) -> tuple:
+        """
+        Get the URL and the name of a repository from the info file.
+        :param git_repo: Git repository URL, or `owner/repo` on GitHub.
+        :return: The URL and the name of the repository.
+        """
         if not git_repo.startswith("http"):
             git_url = "https://github.com/" + git_repo.lstrip('/')
         else:
             git_url = git_repo.rstrip('/')
-        repo_name = git_url.split("/")[-1].replace(".git", "")
-        path = deployer.clone(git_url)
+        return git_url, git_url.split("/")[-1].replace(".git", "")
+
+    def _prepare_on(self, deployer: Deploy, git_url: str, repo_name: str, commit: str, py_version: str, name: str,
+                    check_command: str, patch, lazy_deploy: bool, deploy_command: list, timing: dict) -> dict:
+        """
+        Clone, check out, get the patch and build the image with the given deployer, see prepare_bench.
+        :return: The deployer, the image, the Dockerfile path and the initialized benchmark result.
+        """
+        mirror_path = deployer.get_mirror_path(git_url)
         current_commit = commit
-        pc = deployer.get_parent_commit(repo_path=path, current_commit=current_commit)
-        deployer.checkout(path, pc)
-
-        if patch == '':
-            # download the patch
-            git_patch = f"{git_url}/commit/{current_commit}.patch"
-            patch_path = deployer.download(git_patch,
-                                           os.path.join(deployer.space_path, f"{repo_name}_{current_commit}.patch"))
-        else:
-            patch_path = patch
-        # deployer.copy_file(patch_path, os.path.join(path, f"{repo_name}.patch"))
+        # Only the mirror is shared, each benchmark builds from its own worktree
+        with self.get_repo_lock(repo_name):
+            cache = {"clone": os.path.exists(mirror_path),
+                     "checkout": os.path.exists(mirror_path) and deployer.has_commit(mirror_path, current_commit)}
+            stage_start = time.time()
+            deployer.mirror(git_url, current_commit)
+            timing["clone"] = time.time() - stage_start
+            stage_start = time.time()
+            pc = deployer.get_parent_commit(repo_path=mirror_path, current_commit=current_commit)
+            path = deployer.add_worktree(mirror_path, pc, repo_name=repo_name)
+            timing["checkout"] = time.time() - stage_start
+
+        try:
+            stage_start = time.time()
+            if isinstance(patch, dict):
+                # matrix mode, each model brings its own patch
+                patch_path = ''
+            elif patch == '':
+                # generate the patch from the mirror, download it only if the commit can not be found locally
+                patch_path = os.path.join(deployer.space_path, f"{repo_name}_{current_commit}.patch")
+                if deployer.format_patch(mirror_path, current_commit, patch_path) is None:
+                    git_patch = f"{git_url}/commit/{current_commit}.patch"
+                    patch_path = deployer.download(git_patch, patch_path)
+                    if patch_path and not deployer.is_patch(patch_path):
+                        # Not kept, so the next run does not take it for a cached patch
+                        logging.error(f"Downloaded {git_patch} is not a patch.")
+                        os.remove(patch_path)
+                        patch_path = ''
+            else:
+                patch_path = patch
+            # deployer.copy_file(patch_path, os.path.join(path, f"{repo_name}.patch"))
+            timing["patch"] = time.time() - stage_start
+
+            bench_result = {
+                "name": name,
+                "patch_path": patch_path,
+                "repo_name": repo_name,
+                # The worktree is removed once the image is built, the mirror and the commits locate the source
+                "repo_path": mirror_path,
+                "commit": current_commit,
+                "parent_commit": pc,
+                "patch_result": {"git_apply": None, "patch_p1": None},
+                "check_result": {"ori": None, "patched": None},
+                "result_path": {"ori": None, "patched": None},
+                "exit_code": {"ori": None, "patched": None},
+                "log_path": {"ori": None, "patched": None},
+                "timing": {"prepare": timing, "ori": None, "patched": None},
+                "cache": cache,
+                "timeout": None,
+            }  # Initialize the benchmark result dictionary
+
+            # build the docker image, the containers are started by execute_bench
+            logging.info(f"Building Docker image for {repo_name} at commit {pc} with Python version {py_version}.")
+            logging.info(f"Please wait, this may take a while...")
+            stage_start = time.time()
+            dp, image = deployer.dockerfile_build(py_version=py_version, file_path=path, commit=pc,
+                                                  lazy_deploy=lazy_deploy, other_commands=deploy_command,
+                                                  build_stats=cache, image_name=repo_name,
+                                                  poc_dependencies=deployer.poc_dependencies(
+                                                      os.path.join(self.local_poc_path, name, "run.py")))
+            timing["build"] = time.time() - stage_start
+        finally:
+            # The worktree is only needed to build the image, the containers run from the image
+            with self.get_repo_lock(repo_name):
+                deployer.remove_worktree(mirror_path, path)
 
-        bench_result = {
+        return {
+            "deployer": deployer,
+            "image": image,
+            "dockerfile_path": dp,
+            "bench_result": bench_result,
             "name": name,
-            "patch_path": patch_path,
-            "repo_name": repo_name,
-            "repo_path": path,
-            "commit": current_commit,
-            "parent_commit": pc,
-            "patch_result": {"git_apply": None, "patch_p1": None},
-            "check_result": {"ori": None, "patched": None},
-            "result_path": {"ori": None, "patched": None},
-        }  # Initialize the benchmark result dictionary
-
-        # build the docker image and run the container by dockerfile
-        logging.info(f"Building Docker image for {repo_name} at commit {pc} with Python version {py_version}.")
-        logging.info(f"Please wait, this may take a while...")
-        dp, container_ori = deployer.dockerfile_deploy(py_version=py_version, file_path=path, commit=pc,
-                                                       lazy_deploy=lazy_deploy, other_commands=deploy_command,
-                                                       run_kwargs=run_kwargs)
+        }
+
+    @staticmethod
+    def get_timeouts(poc_timeout: int | dict = None) -> dict:
+        """
+        Get the deadlines of a POC in seconds, 0 means no deadline.
+        The defaults come from `Timeout` in the config, and are overridden by `timeout` of the POC in the info file,
+        either a number for the whole POC or a dictionary of the stages.
+        :param poc_timeout: The `timeout` of the POC in the info file.
+        :return: Dictionary of the stage (apply, check, deploy, exec) or `poc` for the whole POC and its deadline.
+        """
+        timeouts = {"apply": 0, "check": 0, "deploy": 0, "exec": 0, "poc": 0}
+        overrides = [load_config().get("Timeout", {}) or {}]
+        if isinstance(poc_timeout, dict):
+            overrides.append(poc_timeout)
+        elif poc_timeout:
+            overrides.append({"poc": poc_timeout})
+        for override in overrides:
+            for stage, seconds in override.items():
+                if stage in timeouts:
+                    try:
+                        timeouts[stage] = max(0.0, float(seconds or 0))
+                    except (TypeError, ValueError):
+                        logging.warning(f"Ignoring invalid timeout of stage {stage}: {seconds}")
+        return timeouts
+
+    def execute_bench(self, prepared: dict) -> dict:
+        """
+        Execute a benchmark prepared by prepare_bench in the original and patched containers.
+        :param prepared: The prepared benchmark.
+        :return: Results of the benchmark execution, a list with one result per model in matrix mode.
+        """
+        deployer = prepared["deployer"]
+        patches = prepared.get("patches")
+        timeouts = prepared.get("timeouts") or self.get_timeouts()
+        # The deadline of the whole POC counts from here, waiting for a build or a Docker daemon does not count
+        deadline = time.time() + timeouts["poc"] if timeouts["poc"] else 0
+        # Containers started from a deployed snapshot skip the deploy script
+        deployed = prepared.get("deployed", False)
+        lazy_deploy = prepared["lazy_deploy"] and not deployed
+        # Each run holds the original container and one patched container (per model in matrix mode, unless trials),
+        # starting with the slots of the containers pre-started for it
+        slots = self.container_pool.reserve(deployer.docker_handle, prepared["image"], prepared["run_kwargs"],
+                                            n=1 + (len(patches) if patches and not self.trials else 1))
+        # The time spent executing, recorded apart from the preparation, which may have run ahead, see record_timing
+        execute_start = time.time()
+        try:
+            startup = time.time()
+            container_ori = self.container_pool.acquire(deployer.docker_handle, prepared["image"],
+                                                        run_kwargs=prepared["run_kwargs"])
+            startup = time.time() - startup
+            if container_ori is None:
+                raise RuntimeError(f"Failed to create container from Dockerfile {prepared['dockerfile_path']}.")
+            if patches:
+                results = self._run_matrix_containers(deployer, container_ori, prepared["bench_result"],
+                                                      prepared["name"], prepared["check_command"], lazy_deploy,
+                                                      prepared["run_kwargs"], patches, max_lanes=slots,
+                                                      timeouts=timeouts, deadline=deadline, reinstall=deployed,
+                                                      startup=startup, trials=self.trials)
+            else:
+                results = self._run_containers(deployer, container_ori, prepared["bench_result"], prepared["name"],
+                                               prepared["check_command"], lazy_deploy, prepared["run_kwargs"],
+                                               timeouts=timeouts, deadline=deadline, reinstall=deployed,
+                                               startup=startup)
+            for br in (results if isinstance(results, list) else [results]):
+                br["timing"]["execute"] = time.time() - execute_start
+            return results
+        finally:
+            self.container_pool.slots.release(slots)
+            self.docker_pool.release(prepared["endpoint"])
+
+    @staticmethod
+    def _join_lanes(dh: DockerHandle, futures: dict, containers: dict, cancel: threading.Event,
+                    isolated: bool = False) -> tuple:
+        """
+        Wait for the lanes of a benchmark. When a lane hits a deadline its container is torn down,
+        and so are the containers of all other lanes, unless the lanes are isolated from each other.
+        :param dh: The Docker handle of the containers.
+        :param futures: Dictionary of the lane name and its future.
+        :param containers: Dictionary of the lane name and the ID of its container, filled in as they are created.
+        :param cancel: Set when the whole benchmark is torn down, lanes not started yet must not start
+                       and the commands of the running ones are stopped.
+        :param isolated: If True, a timed out lane other than "ori" only tears down its own container (matrix mode).
+        :return: Dictionaries of the lane name and its result, its error, and its timeout.
+        """
+        lanes = {future: lane for lane, future in futures.items()}
+        results, errors, timeouts = {}, {}, {}
+        torn_down = set()
+
+        def tear_down(lane_names):
+            for lane_name in lane_names:
+                torn_down.add(lane_name)
+                container_id = containers.pop(lane_name, None)
+                if container_id is not None:
+                    dh.container_remove(container_id)
+
+        pending = set(lanes)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                lane = lanes[future]
+                try:
+                    results[lane] = future.result()
+                except concurrent.futures.CancelledError:
+                    timeouts[lane] = {"torn_down": True}
+                except ExecTimeout as e:
+                    logging.error(f"Lane {lane} timed out in stage {e.stage} after {e.timeout:.0f} seconds, "
+                                  f"tearing down its containers.")
+                    print(f"[VulBench] Lane {lane} timed out in stage {e.stage} after {e.timeout:.0f} seconds.")
+                    timeouts[lane] = {"stage": e.stage, "seconds": e.timeout, "command": str(e.command)}
+                    if isolated and lane != "ori":
+                        tear_down([lane])
+                        continue
+                    cancel.set()
+                    for other in pending:
+                        other.cancel()
+                    tear_down(list(futures))
+                except Exception as e:
+                    if lane in torn_down:
+                        timeouts.setdefault(lane, {"torn_down": True})
+                    else:
+                        errors[lane] = e
+        # A lane cancelled while creating its container may have registered it after the teardown
+        if cancel.is_set():
+            tear_down(list(containers))
+        return results, errors, timeouts
+
+    def _run_containers(self, deployer: Deploy, container_ori, bench_result: dict, name: str, check_command: str,
+                        lazy_deploy: bool, run_kwargs: dict, timeouts: dict = None, deadline: float = 0,
+                        reinstall: bool = False, startup: float = 0) -> dict:
+        """
+        Run the POC in the original container and in a patched container started from the same image.
+        Both lanes run concurrently end-to-end and are only joined for the analysis.
+        :param deployer: The deployer holding the Docker handle.
+        :param container_ori: The original container created by the deployment.
+        :param bench_result: The benchmark result dictionary to fill in.
+        :param name: Name of the POC to run.
+        :param check_command: Check command to run before and after patching.
+        :param lazy_deploy: Lazy deploy or not.
+        :param run_kwargs: Additional arguments for running the container.
+        :param timeouts: The deadlines of the stages, see get_timeouts.
+        :param deadline: The time by which the whole POC must be done, 0 means no deadline.
+        :param reinstall: If True, the containers start from a deployed snapshot, see run_lane.
+        :param startup: Time it took to get the original container.
+        :return: Results of the benchmark execution.
+        """
         logging.info(f"Container ID: {container_ori.id}")
-        dh = DockerHandle()
+        dh = deployer.docker_handle
         image_deployed = dh.get_image_by_container(container_id=container_ori.id)
-        container_patched = dh.run_by_image(image=image_deployed, patched=True, run_kwargs=run_kwargs)
+        startups = {"ori": startup, "patched": time.time()}
+        container_patched = self.container_pool.acquire(dh, image_deployed, run_kwargs=run_kwargs, patched=True)
+        startups["patched"] = time.time() - startups["patched"]
+        if container_patched is None:
+            self.container_pool.release(dh, container_ori.id)
+            raise RuntimeError(f"Failed to create patched container of {name}.")
         logging.info(f"Container ID (patched): {container_patched.id}")
 
+        logging.info("Running original and patched lanes concurrently...")
+        containers = {"ori": container_ori.id, "patched": container_patched.id}
+        cancel = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures = {lane: executor.submit(self.run_lane, deployer, containers[lane], lane, bench_result, name,
+                                             check_command, lazy_deploy, timeouts=timeouts, deadline=deadline,
+                                             reinstall=reinstall, startup=startups[lane], cancel=cancel)
+                       for lane in ("ori", "patched")}
+            lane_results, errors, lane_timeouts = self._join_lanes(dh, futures, containers, cancel)
+        # The containers are left patched and with the POC installed, they are not reused
+        for container_id in containers.values():
+            self.container_pool.release(dh, container_id)
+        for lane in ("ori", "patched"):
+            if lane in errors:
+                raise errors[lane]
+
+        if lane_timeouts:
+            bench_result["timeout"] = lane_timeouts
+            print(f"POC {name} timed out, its containers have been removed.")
+        else:
+            print(f"POC {name} executed successfully in both containers.")
+
+        lane_ori = lane_results.get("ori")
+        lane_patched = lane_results.get("patched")
+        self.add_lane_stats(bench_result, lane_results.values())
+        if lane_patched is not None:
+            bench_result["patch_result"] = lane_patched["patch_result"]
+        for lane, lane_result, result_type in (("ori", lane_ori, "original"), ("patched", lane_patched, "patched")):
+            if lane_result is None:
+                continue
+            bench_result["timing"][lane] = lane_result["timing"]
+            bench_result["check_result"][lane] = lane_result["check_result"]
+            bench_result["result_path"][lane] = lane_result["result_path"]
+            bench_result["exit_code"][lane] = lane_result["exit_code"]
+            bench_result["log_path"][lane] = lane_result["log_path"]
+            if lane_result["result_path"] is not None:
+                self.show_results(lane_result["result_path"], result_type=result_type)
+
+        return bench_result
+
+    def _run_matrix_containers(self, deployer: Deploy, container_ori, bench_result: dict, name: str,
+                               check_command: str, lazy_deploy: bool, run_kwargs: dict, patches: dict,
+                               max_lanes: int = 0, timeouts: dict = None, deadline: float = 0,
+                               reinstall: bool = False, startup: float = 0, trials: bool = False) -> list:
+        """
+        Run the POC once in the original container and once per model in patched containers
+        started from the same image.
+        In trial mode, the models run one after another in a single patched container, whose tree is reset
+        between the trials. It is only recreated when a trial corrupts it, see reset_trial.
+        :param deployer: The deployer holding the Docker handle.
+        :param container_ori: The original container created by the deployment.
+        :param bench_result: The benchmark result dictionary shared by all models.
+        :param name: Name of the POC to run.
+        :param check_command: Check command to run before and after patching.
+        :param lazy_deploy: Lazy deploy or not.
+        :param run_kwargs: Additional arguments for running the container.
+        :param patches: Dictionary of the model name and the path to its patch file.
+        :param max_lanes: Maximum number of lanes running at once, 0 means all of them.
+        :param timeouts: The deadlines of the stages, see get_timeouts.
+        :param deadline: The time by which the whole POC must be done, 0 means no deadline.
+        :param reinstall: If True, the containers start from a deployed snapshot, see run_lane.
+        :param startup: Time it took to get the original container.
+        :param trials: If True, run the models as trials in one patched container.
+        :return: List of the benchmark results, one per model.
+        """
+        logging.info(f"Container ID: {container_ori.id}")
+        dh = deployer.docker_handle
+        image_deployed = dh.get_image_by_container(container_id=container_ori.id)
+        result_dir = os.path.join(deployer.space_path, f"result")
+        containers = {"ori": container_ori.id}
+        cancel = threading.Event()
+        trial = {"container": None, "fingerprint": None, "containers": 0}
+
+        def trial_lane(model: str, model_result: dict) -> dict:
+            patched_startup = time.time()
+            if trial["container"] is not None and not self.reset_trial(dh, trial["container"], trial["fingerprint"]):
+                logging.warning(f"Trial container of {name} was corrupted by the previous trial, recreating it...")
+                self.container_pool.release(dh, trial["container"])
+                trial["container"] = None
+            if trial["container"] is None:
+                container_trial = self.container_pool.acquire(dh, image_deployed, run_kwargs=run_kwargs, patched=True,
+                                                              suffix="trials")
+                if container_trial is None:
+                    raise RuntimeError(f"Failed to create trial container of {name} for model {model}.")
+                # Registered first, so it is torn down if its setup times out
+                containers[model] = container_trial.id
+                fingerprint = self.setup_trial(deployer, container_trial.id, lazy_deploy,
+                                               timeout=(timeouts or {}).get("deploy", 0))
+                if fingerprint is None:
+                    raise RuntimeError(f"Failed to set up trial container of {name} for model {model}.")
+                trial.update({"container": container_trial.id, "fingerprint": fingerprint,
+                              "containers": trial["containers"] + 1})
+                logging.info(f"Container ID (trials): {container_trial.id}")
+            containers[model] = trial["container"]
+            patched_startup = time.time() - patched_startup
+            if cancel.is_set():
+                raise RuntimeError(f"Benchmark of {name} was torn down before the trial of model {model} started.")
+            # The deploy script already ran in setup_trial, the patched tree is reinstalled instead
+            lane_result = self.run_lane(deployer, trial["container"], "patched", model_result, name, check_command,
+                                        False, result_dir=os.path.join(result_dir, model), timeouts=timeouts,
+                                        deadline=deadline, reinstall=True, startup=patched_startup, cancel=cancel)
+            # The container is released once, after the last trial
+            containers.pop(model, None)
+            return lane_result
+
+        def patched_lane(model: str, patch_path: str) -> dict:
+            model_result = copy.deepcopy(bench_result)
+            model_result["model"] = model
+            model_result["patch_path"] = patch_path
+            if trials:
+                return trial_lane(model, model_result)
+            patched_startup = time.time()
+            container_patched = self.container_pool.acquire(dh, image_deployed, run_kwargs=run_kwargs, patched=True,
+                                                            suffix=re.sub(r'[^a-zA-Z0-9_.-]', '_', model))
+            patched_startup = time.time() - patched_startup
+            if container_patched is None:
+                raise RuntimeError(f"Failed to create patched container of {name} for model {model}.")
+            containers[model] = container_patched.id
+            if cancel.is_set():
+                raise RuntimeError(f"Benchmark of {name} was torn down before the lane of model {model} started.")
+            logging.info(f"Container ID (patched, {model}): {container_patched.id}")
+            return self.run_lane(deployer, container_patched.id, "patched", model_result, name, check_command,
+                                 lazy_deploy, result_dir=os.path.join(result_dir, model), timeouts=timeouts,
+                                 deadline=deadline, reinstall=reinstall, startup=patched_startup, cancel=cancel)
+
+        logging.info(f"Running original lane and {len(patches)} patched {'trials' if trials else 'lanes'} of {name}...")
+        lane_workers = 1 + len(patches) if max_lanes <= 0 else max(2, min(max_lanes, 1 + len(patches)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2 if trials else lane_workers) as executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as trial_executor:
+            futures = {"ori": executor.submit(self.run_lane, deployer, container_ori.id, "ori", bench_result, name,
+                                              check_command, lazy_deploy, timeouts=timeouts, deadline=deadline,
+                                              reinstall=reinstall, startup=startup, cancel=cancel)}
+            # Trials share their container, so they run one at a time
+            futures.update({model: (trial_executor if trials else executor).submit(patched_lane, model, patch_path)
+                            for model, patch_path in patches.items()})
+            lane_results, errors, lane_timeouts = self._join_lanes(dh, futures, containers, cancel, isolated=True)
+        # The containers are left patched and with the POC installed, they are not reused
+        if trial["container"] is not None and trial["container"] not in containers.values():
+            containers["trials"] = trial["container"]
+        for container_id in set(containers.values()):
+            self.container_pool.release(dh, container_id)
+        if trials:
+            logging.info(f"{len(patches)} trials of {name} ran in {trial['containers']} containers.")
+        if "ori" in errors:
+            raise errors["ori"]
+        for model, e in errors.items():
+            logging.error(f"Error running patched lane of {name} for model {model}: {e}")
+
+        lane_ori = lane_results.get("ori")
+        self.add_lane_stats(bench_result, lane_results.values())
+        lane_patched = {model: lane_results.get(model) for model in patches
+                        if model in lane_results or model in lane_timeouts}
+        if lane_timeouts:
+            print(f"POC {name} timed out in {len(lane_timeouts)} lanes, their containers have been removed.")
+        else:
+            print(f"POC {name} executed successfully in the original container and {len(lane_patched)} patched ones.")
+        if lane_ori is not None and lane_ori["result_path"] is not None:
+            self.show_results(lane_ori["result_path"], result_type="original")
+
+        model_results = []
+        for model, lane_result in lane_patched.items():
+            model_result = copy.deepcopy(bench_result)
+            model_result["model"] = model
+            model_result["patch_path"] = patches[model]
+            model_timeouts = {lane: lane_timeouts[lane] for lane in ("ori", model) if lane in lane_timeouts}
+            if model_timeouts:
+                model_result["timeout"] = {("patched" if lane == model else lane): t for lane, t in model_timeouts.items()}
+            if lane_ori is not None:
+                model_result["check_result"]["ori"] = lane_ori["check_result"]
+                model_result["timing"]["ori"] = lane_ori["timing"]
+                model_result["exit_code"]["ori"] = lane_ori["exit_code"]
+                model_result["log_path"]["ori"] = lane_ori["log_path"]
+                if lane_ori["result_path"] is not None:
+                    # Keep a copy of the original result next to the patched one, so they can be paired per model
+                    ori_to = os.path.join(result_dir, model, os.path.basename(lane_ori["result_path"]))
+                    os.makedirs(os.path.dirname(ori_to), exist_ok=True)
+                    deployer.copy_file(lane_ori["result_path"], ori_to)
+                    model_result["result_path"]["ori"] = ori_to
+            if lane_result is not None:
+                model_result["patch_result"] = lane_result["patch_result"]
+                model_result["check_result"]["patched"] = lane_result["check_result"]
+                model_result["timing"]["patched"] = lane_result["timing"]
+                model_result["result_path"]["patched"] = lane_result["result_path"]
+                model_result["exit_code"]["patched"] = lane_result["exit_code"]
+                model_result["log_path"]["patched"] = lane_result["log_path"]
+                if lane_result["result_path"] is not None:
+                    self.show_results(lane_result["result_path"], result_type=f"patched {model}")
+            model_results.append(model_result)
+
+        return model_results
+
+    @staticmethod
+    def add_lane_stats(bench_result: dict, lane_results) -> None:
+        """
+        Add the pip cache hits and misses of the lanes to those of the preparation in the benchmark result,
+        as well as the bytes of POC payload copied into their containers.
+        :param bench_result: The benchmark result dictionary.
+        :param lane_results: The results of the lanes returned by run_lane.
+        """
+        pip = bench_result["cache"].get("pip", [0, 0])
+        payload = bench_result["cache"].get("payload", 0)
+        for lane_result in lane_results:
+            pip = [a + b for a, b in zip(pip, lane_result.get("pip", [0, 0]))]
+            payload += lane_result.get("payload", 0)
+        bench_result["cache"]["pip"] = pip
+        bench_result["cache"]["payload"] = payload
+
+    def start_lane(self, deployer: Deploy, container_id: str, lane: str, bench_result: dict, name: str,
+                   result_dir: str = '', startup: float = 0) -> tuple:
+        """
+        Set up a lane of run_lane or run_lane_agent: its result dictionary and log file, and the POC files
+        copied to its container.
+        :param deployer: The deployer holding the Docker handle.
+        :param container_id: ID of the container of this lane.
+        :param lane: "ori" or "patched".
+        :param bench_result: The benchmark result dictionary, only read here.
+        :param name: Name of the POC to run.
+        :param result_dir: The directory to save the result to, default is `result` under the workspace.
+        :param startup: Time it took to get the container, see run_lane.
+        :return: The lane result and the result directory.
+        """
+        lane_result = {
+            "patch_result": {"git_apply": None, "patch_p1": None},
+            "check_result": None,
+            "result_path": None,
+            "timing": {},
+            "pip": [0, 0],
+            "payload": 0,
+            "exit_code": {},
+            "log_path": None,
+        }
+        timing = lane_result["timing"]
+        if result_dir == '':
+            result_dir = os.path.join(deployer.space_path, f"result")
+        lane_result["log_path"] = os.path.join(result_dir, f"{name}_{lane}_{bench_result['repo_name']}_"
+                                                           f"{bench_result['commit']}.log")
+
         # copy the poc files to the container
-        deployer.docker_handle.container_copy(container_id=container_ori.id,
-                                              src_path=self.local_poc_path,
-                                              dest_path="/vulbench/poc")
-        deployer.docker_handle.container_copy(container_id=container_patched.id,
-                                              src_path=self.local_poc_path,
-                                              dest_path="/vulbench/poc")
-
-        # copy the patch file to the container
-        deployer.docker_handle.container_copy(container_id=container_patched.id,
-                                              src_path=patch_path,
-                                              dest_path=f"/vulbench/{repo_name}.patch")
-
-        # patch the container and run the POC in the patched container
-        patch_result = deployer.docker_handle.container_exec(container_id=container_patched.id,
-                                                             command=f"git apply /vulbench/{repo_name}.patch")
-        bench_result["patch_result"]["git_apply"] = patch_result
-        if "error: patch failed:" in patch_result or "error: corrupt patch at line" in patch_result or str(
-                patch_result).strip().startswith("error:"):
-            logging.error(f"\n{patch_result}")
-            logging.error(f"Patch {patch_path} does not apply to the container, try `patch` command")
-            patch_result = deployer.docker_handle.container_exec(container_id=container_patched.id,
-                                                                 command=f"sh -c 'patch -p1 < /vulbench/{repo_name}.patch'")
-            logging.warning(f"\n{patch_result}")
-            bench_result["patch_result"]["patch_p1"] = patch_result
+        stage_start = time.time()
+        payload = self.poc_payload(name)
+        deployer.docker_handle.container_put_archive(container_id=container_id, archive=payload, dest_dir="/vulbench")
+        lane_result["payload"] = len(payload)
+        timing["copy"] = time.time() - stage_start
+        # From asking for the container to the end of the first command in it
+        timing["startup"] = startup
+        timing["first_exec"] = startup + timing["copy"]
+        return lane_result, result_dir
+
+    def finish_lane(self, lane_result: dict, lane: str, name: str, result_to: str | None, lane_start: float) -> dict:
+        """
+        Record the result file of a lane of run_lane or run_lane_agent and how long the lane took.
+        :param lane_result: The lane result from start_lane.
+        :param lane: "ori" or "patched".
+        :param name: Name of the POC.
+        :param result_to: The result file fetched from the container, None if there is none.
+        :param lane_start: Time the lane started at.
+        :return: The lane result.
+        """
+        timing = lane_result["timing"]
+        if result_to is not None:
+            logging.info(f"{'Original' if lane == 'ori' else 'Patched'} result saved to {result_to}")
+            lane_result["result_path"] = result_to
+            # The POC dependencies are installed in the image, what is left of env_init is part of exec
+            env_init = self.show_results(result_to, output=False)["env_init"]
+            if env_init:
+                timing["env_init"] = env_init.get("time", 0)
+
+        timing["total"] = time.time() - lane_start
+        logging.info(f"Lane {lane} of {name} finished in {timing['total']:.2f} seconds: " +
+                     ", ".join(f"{k} {v:.2f}s" for k, v in timing.items() if k != "total"))
+        return lane_result
+
+    def run_lane(self, deployer: Deploy, container_id: str, lane: str, bench_result: dict, name: str,
+                 check_command: str, lazy_deploy: bool, result_dir: str = '', timeouts: dict = None,
+                 deadline: float = 0, reinstall: bool = False, startup: float = 0,
+                 cancel: threading.Event = None) -> dict:
+        """
+        Run one lane of the benchmark in a container: copy the POC, apply the patch (patched lane only),
+        run the check command and the lazy deploy script, execute the POC and fetch its result.
+        The output of the commands is streamed to a log file next to the result, which can be followed while they run.
+        :param deployer: The deployer holding the Docker handle.
+        :param container_id: ID of the container of this lane.
+        :param lane: "ori" or "patched".
+        :param bench_result: The benchmark result dictionary, only read here.
+        :param name: Name of the POC to run.
+        :param check_command: Check command to run in the container.
+        :param lazy_deploy: Lazy deploy or not.
+        :param result_dir: The directory to save the result to, default is `result` under the workspace.
+        :param timeouts: The deadlines of the stages, see get_timeouts.
+        :param deadline: The time by which the whole POC must be done, 0 means no deadline.
+        :param reinstall: If True, the container starts from a deployed snapshot, so the patched lane reinstalls
+                          the project after patching if it was installed as a copy rather than in place.
+        :param startup: Time it took to get the container, a pre-started one or a new one, see ContainerPool.
+        :param cancel: Set when the benchmark is torn down, the command running in the container is stopped.
+        :return: Dictionary of the lane results, the exit code of the commands, the duration of each stage in seconds
+                 and the pip cache hits and misses.
+        :raise ExecTimeout: If a stage or the whole POC runs past its deadline.
+        """
+        if self.agent:
+            return self.run_lane_agent(deployer, container_id, lane, bench_result, name, check_command, lazy_deploy,
+                                       result_dir=result_dir, timeouts=timeouts, deadline=deadline,
+                                       reinstall=reinstall, startup=startup, cancel=cancel)
+        repo_name = bench_result["repo_name"]
+        patch_path = bench_result["patch_path"]
+        lane_name = "before patching" if lane == "ori" else "after patching"
+        lane_start = time.time()
+        lane_result, result_dir = self.start_lane(deployer, container_id, lane, bench_result, name,
+                                                  result_dir=result_dir, startup=startup)
+        timing = lane_result["timing"]
+        timeouts = timeouts if timeouts else {}
+        stage = "copy"
 
+        def stage_timeout() -> float:
+            # The deadline of the stage, cut short by the deadline of the whole POC
+            limits = [timeouts.get(stage, 0)] + ([deadline - time.time()] if deadline else [])
+            limits = [limit for limit in limits if limit]
+            if not limits:
+                return 0
+            if min(limits) <= 0:
+                raise ExecTimeout(f"stage {stage}", timeouts.get("poc", 0), stage=stage)
+            return min(limits)
+
+        def exec_stage(command: str, environment: dict = None, key: str = '') -> dict:
+            result = deployer.docker_handle.container_exec_stream(container_id=container_id, command=command,
+                                                                  timeout=stage_timeout(), environment=environment,
+                                                                  log_path=lane_result["log_path"], cancel=cancel)
+            lane_result["exit_code"][key if key else stage] = result["exit_code"]
+            if result["cancelled"]:
+                raise RuntimeError(f"Lane {lane} of {name} was cancelled in stage {stage}.")
+            return result
+
+        stage_start = time.time()
+        try:
+            if lane == "patched":
+                stage = "apply"
+                stage_start = time.time()
+                # copy the patch file to the container
+                deployer.docker_handle.container_copy(container_id=container_id,
+                                                      src_path=patch_path,
+                                                      dest_path=f"/vulbench/{repo_name}.patch")
+
+                # patch the container
+                apply_result = exec_stage(f"git apply /vulbench/{repo_name}.patch", key="git_apply")
+                lane_result["patch_result"]["git_apply"] = apply_result["output"]
+                if apply_result["exit_code"] != 0:
+                    logging.error(f"\n{apply_result['output']}")
+                    logging.error(f"Patch {patch_path} does not apply to the container, try `patch` command")
+                    apply_result = exec_stage(f"sh -c 'patch -p1 < /vulbench/{repo_name}.patch'", key="patch_p1")
+                    logging.warning(f"\n{apply_result['output']}")
+                    lane_result["patch_result"]["patch_p1"] = apply_result["output"]
+                if reinstall:
+                    exec_stage("sh -c 'test ! -f /vulbench/vb_reinstall.sh || bash /vulbench/vb_reinstall.sh'",
+                               key="reinstall")
+                timing["patch"] = time.time() - stage_start
+
+            if check_command is not None and check_command.strip():
+                stage = "check"
+                stage_start = time.time()
+                output = exec_stage(check_command)["output"]
+                logging.info(f"Output {lane_name}: \n{output}")
+                lane_result["check_result"] = output
+                timing["check"] = time.time() - stage_start
+
+            # run the lazy deploy script
+            if lazy_deploy:
+                stage = "deploy"
+                logging.info(f"Running lazy deploy script {lane_name}, this may take a while, "
+                             f"follow it in {lane_result['log_path']}...")
+                stage_start = time.time()
+                output = exec_stage("bash /vulbench/vb_deploy.sh")["output"]
+                timing["deploy"] = time.time() - stage_start
+                lane_result["pip"] = [a + b for a, b in zip(lane_result["pip"], deployer.pip_cache_stats(output))]
+                logging.info(f"Lazy deploy script executed successfully {lane_name}.")
+
+            logging.info(f"Running POC {lane_name}...")
+            stage = "exec"
+            stage_start = time.time()
+            exec_timeout = stage_timeout()
+            # InOut.run stops the POC a little earlier on its own, so its result is still saved with the timeout
+            environment = {"VB_POC_TIMEOUT": str(max(1, int(exec_timeout) - 5))} if exec_timeout else None
+            output = exec_stage(f"python /vulbench/poc/{name}/run.py", environment=environment)["output"]
+            timing["exec"] = time.time() - stage_start
+            logging.info(f"Output of POC execution {lane_name}: \n{output}")
+            lane_result["pip"] = [a + b for a, b in zip(lane_result["pip"], deployer.pip_cache_stats(output))]
+        except ExecTimeout as e:
+            e.stage = stage
+            timing[stage if stage != "apply" else "patch"] = time.time() - stage_start
+            raise
+
+        # Get vb_poc_result.json from the container
+        stage_start = time.time()
+        result_to = self.fetch_result(deployer, container_id, result_dir,
+                                      f"{name}_{lane}_{repo_name}_{bench_result['commit']}.json")
+        timing["fetch"] = time.time() - stage_start
+        return self.finish_lane(lane_result, lane, name, result_to, lane_start)
+
+    def run_lane_agent(self, deployer: Deploy, container_id: str, lane: str, bench_result: dict, name: str,
+                       check_command: str, lazy_deploy: bool, result_dir: str = '', timeouts: dict = None,
+                       deadline: float = 0, reinstall: bool = False, startup: float = 0,
+                       cancel: threading.Event = None) -> dict:
+        """
+        Run one lane of the benchmark like run_lane, but hand the whole command sequence in the container
+        (apply, check, deploy, exec and collecting the result) to the agent shipped with the POC (Data/poc/Agent.py)
+        in one call. Its events are streamed back as they happen, and the output of the commands is written
+        to the log file of the lane.
+        The parameters and the return value are those of run_lane.
+        :raise ExecTimeout: If a stage or the whole POC runs past its deadline.
+        """
+        repo_name = bench_result["repo_name"]
+        patch_path = bench_result["patch_path"]
+        lane_start = time.time()
+        lane_result, result_dir = self.start_lane(deployer, container_id, lane, bench_result, name,
+                                                  result_dir=result_dir, startup=startup)
+        timing = lane_result["timing"]
+        timeouts = timeouts if timeouts else {}
+        dh = deployer.docker_handle
+
+        if lane == "patched":
+            # copy the patch file to the container, the agent adds the apply steps to the time of the patch stage
+            stage_start = time.time()
+            dh.container_copy(container_id=container_id, src_path=patch_path, dest_path=f"/vulbench/{repo_name}.patch")
+            timing["patch"] = time.time() - stage_start
+
+        steps = []
+        if lane == "patched":
+            steps.append({"key": "git_apply", "stage": "apply",
+                          "command": ["git", "apply", f"/vulbench/{repo_name}.patch"]})
+            steps.append({"key": "patch_p1", "stage": "apply", "if_failed": "git_apply",
+                          "command": ["sh", "-c", f"patch -p1 < /vulbench/{repo_name}.patch"]})
+            if reinstall:
+                steps.append({"key": "reinstall", "stage": "apply",
+                              "command": ["sh", "-c", "test ! -f /vulbench/vb_reinstall.sh || "
+                                                      "bash /vulbench/vb_reinstall.sh"]})
         if check_command is not None and check_command.strip():
-            # check_command = check_command
-            output = deployer.docker_handle.container_exec(container_id=container_ori.id, command=check_command)
-            logging.info(f"Output before patching: \n{output}")
-            bench_result["check_result"]["ori"] = output
+            steps.append({"key": "check", "stage": "check", "command": shlex.split(check_command)})
+        if lazy_deploy:
+            steps.append({"key": "deploy", "stage": "deploy", "command": ["bash", "/vulbench/vb_deploy.sh"]})
+        left = deadline - time.time() if deadline else 0
+        if deadline and left <= 0:
+            raise ExecTimeout("agent", timeouts.get("poc", 0), stage=steps[0]["stage"] if steps else "exec")
+        limits = [limit for limit in (timeouts.get("exec", 0), left) if limit]
+        exec_timeout = min(limits) if limits else 0
+        # InOut.run stops the POC a little earlier on its own, so its result is still saved with the timeout
+        steps.append({"key": "exec", "stage": "exec", "command": ["python", f"/vulbench/poc/{name}/run.py"],
+                      "env": {"VB_POC_TIMEOUT": str(max(1, int(exec_timeout) - 5))} if exec_timeout else {}})
+        for step in steps:
+            step["timeout"] = timeouts.get(step["stage"], 0)
+        job = {"steps": steps, "deadline": left, "result": "/vulbench/vb_poc_result.json"}
+
+        events = {"pending": b"", "stage": steps[0]["stage"], "command": None, "timeout": None, "result": None}
+        outputs = {}
+        os.makedirs(result_dir, exist_ok=True)
+        with open(lane_result["log_path"], 'a', encoding='utf-8') as log_file:
 
-            output = deployer.docker_handle.container_exec(container_id=container_patched.id, command=check_command)
-            logging.info(f"Output after patching: \n{output}")
-            bench_result["check_result"]["patched"] = output
+            def on_event(event: dict) -> None:
+                if event.get("event") == "start":
+                    events["stage"], events["command"] = event.get("stage"), event.get("command")
+                    command = event.get("command")
+                    log_file.write(f"$ {shlex.join(command) if isinstance(command, list) else command}\n")
+                    logging.info(f"Agent running {event.get('key')} in container {container_id}")
+                elif event.get("event") == "output":
+                    log_file.write(event.get("data", ""))
+                    # Only the end of the output of each step is kept in memory, the log file holds all of it
+                    output = outputs.get(event.get("key"), "") + event.get("data", "")
+                    outputs[event.get("key")] = output[-(1 << 20):]
+                elif event.get("event") == "end":
+                    lane_result["exit_code"][event.get("key")] = event.get("exit_code")
+                    stage_name = "patch" if event.get("stage") == "apply" else event.get("stage")
+                    timing[stage_name] = timing.get(stage_name, 0) + event.get("duration", 0)
+                elif event.get("event") == "timeout":
+                    events["timeout"] = event
+                elif event.get("event") == "result":
+                    events["result"] = event.get("content")
+                log_file.flush()
 
-        # run the lazy deploy script
+            def on_output(stream_name: str, chunk: bytes) -> None:
+                if stream_name == "stderr":
+                    # Errors of the agent itself
+                    log_file.write(chunk.decode('utf-8', errors='replace'))
+                    log_file.flush()
+                    return
+                lines = (events["pending"] + chunk).split(b"\n")
+                events["pending"] = lines.pop()
+                for line in lines:
+                    try:
+                        on_event(json.loads(line))
+                    except ValueError:
+                        log_file.write(line.decode('utf-8', errors='replace') + "\n")
+
+            logging.info(f"Running {len(steps)} steps of lane {lane} of {name} with the agent, "
+                         f"follow them in {lane_result['log_path']}...")
+            try:
+                # The agent enforces the deadlines of the steps, the grace covers its own start and reporting
+                agent_result = dh.container_exec_stream(
+                    container_id=container_id, command=["python", "/vulbench/poc/Agent.py", json.dumps(job)],
+                    timeout=left + dh.exec_grace if deadline else 0, cancel=cancel, max_buffer=1 << 16,
+                    on_output=on_output)
+            except ExecTimeout as e:
+                e.stage = events["stage"]
+                raise
+        if agent_result["cancelled"]:
+            raise RuntimeError(f"Lane {lane} of {name} was cancelled in stage {events['stage']}.")
+        if events["timeout"] is not None:
+            logging.error(f"Command '{events['command']}' in container {container_id} timed out "
+                          f"after {events['timeout'].get('seconds', 0):.0f} seconds")
+            raise ExecTimeout(events["command"], events["timeout"].get("seconds", 0), stage=events["stage"])
+        if agent_result["exit_code"] != 0:
+            logging.error(f"Agent of lane {lane} of {name} failed with exit code {agent_result['exit_code']}: \n"
+                          f"{agent_result['stderr']}")
+
+        for key in ("git_apply", "patch_p1"):
+            if key in lane_result["exit_code"]:
+                lane_result["patch_result"][key] = outputs.get(key, "")
+        if lane_result["exit_code"].get("git_apply", 0) != 0:
+            logging.error(f"Patch {patch_path} does not apply to the container, tried `patch` command: \n"
+                          f"{lane_result['patch_result']['patch_p1']}")
+        if "check" in lane_result["exit_code"]:
+            lane_result["check_result"] = outputs.get("check", "")
+        for key in ("deploy", "exec"):
+            lane_result["pip"] = [a + b for a, b in zip(lane_result["pip"], deployer.pip_cache_stats(outputs.get(key)))]
+
+        result_to = None
+        if events["result"] is not None:
+            result_to = os.path.join(result_dir, f"{name}_{lane}_{repo_name}_{bench_result['commit']}.json")
+            # Written next to its final path and moved, so concurrent runs never read a partial result
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=result_dir, prefix=".vb_", delete=False) as f:
+                f.write(events["result"])
+            os.replace(f.name, result_to)
+        return self.finish_lane(lane_result, lane, name, result_to, lane_start)
+
+    def setup_trial(self, deployer: Deploy, container_id: str, lazy_deploy: bool, timeout: float = 0) -> str | None:
+        """
+        Set up a container for patch trials: deploy the project, then commit the pristine tree in the container,
+        so that reset_trial can restore it between the trials.
+        :param deployer: The deployer holding the Docker handle.
+        :param container_id: ID of the trial container.
+        :param lazy_deploy: If True, run the lazy deploy script first.
+        :param timeout: Timeout of the lazy deploy script in seconds, 0 means no timeout.
+        :return: Fingerprint of the installed packages, or None if the tree could not be committed.
+        """
+        dh = deployer.docker_handle
         if lazy_deploy:
-            logging.info("Running lazy deploy script in both containers, this may take a while... ")
-            # deployer.docker_handle.container_exec(container_id=container_ori.id, command="bash /vulbench/vb_deploy.sh")
-            # deployer.docker_handle.container_exec(container_id=container_patched.id,
-            #                                       command="bash /vulbench/vb_deploy.sh")
-            # Use ThreadPoolExecutor to run the lazy deploy script in both containers concurrently
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                futures = [
-                    executor.submit(deployer.docker_handle.container_exec, container_ori.id,
-                                    "bash /vulbench/vb_deploy.sh"),
-                    executor.submit(deployer.docker_handle.container_exec, container_patched.id,
-                                    "bash /vulbench/vb_deploy.sh")
-                ]
-                concurrent.futures.wait(futures)
-            logging.info("Lazy deploy script executed successfully in both containers.")
-
-        logging.info("Running POC...")
-        # Run the POC in the original container
-        output = deployer.docker_handle.container_exec(container_id=container_ori.id,
-                                                       command=f"python /vulbench/poc/{name}/run.py")
-        logging.info(f"Output of POC execution: \n{output}")
-
-        # Run the POC again after patching
-        output = deployer.docker_handle.container_exec(container_id=container_patched.id,
-                                                       command=f"python /vulbench/poc/{name}/run.py")
-        logging.info(f"Output of POC execution after patching: \n{output}")
-
-        print(f"POC {name} executed successfully in both containers.")
-
-        # Get vb_poc_result.json from the both container
-        result_dir = os.path.join(deployer.space_path, f"result")
-        result_ori = deployer.docker_handle.get_files_from_container(container_id=container_ori.id,
-                                                                     src_path="/vulbench/vb_poc_result.json",
-                                                                     dest_path=result_dir)
-        if result_ori is not None:
-            result_ori = os.path.join(result_dir, f"vb_poc_result.json")
-            ori_to = os.path.join(result_dir, f"{name}_ori_{repo_name}_{current_commit}.json")
-            deployer.move_file(result_ori, ori_to)
-            logging.info(f"Original result saved to {ori_to}")
-            bench_result["result_path"]["ori"] = ori_to
-            self.show_results(ori_to, result_type="original")
-
-        result_patched = deployer.docker_handle.get_files_from_container(container_id=container_patched.id,
-                                                                         src_path="/vulbench/vb_poc_result.json",
-                                                                         dest_path=result_dir)
-        if result_patched is not None:
-            result_patched = os.path.join(result_dir, f"vb_poc_result.json")
-            patched_to = os.path.join(result_dir, f"{name}_patched_{repo_name}_{current_commit}.json")
-            deployer.move_file(result_patched, patched_to)
-            logging.info(f"Patched result saved to {patched_to}")
-            bench_result["result_path"]["patched"] = patched_to
-            self.show_results(patched_to, result_type="patched")
+            logging.info("Running lazy deploy script in the trial container, this may take a while... ")
+            dh.container_exec(container_id=container_id, command="bash /vulbench/vb_deploy.sh", timeout=timeout)
+        output = dh.container_exec(container_id=container_id, command=[
+            "sh", "-c", "cd /vulbench && git add -A && "
+                        "git -c user.name=VulBench -c user.email=vulbench@localhost "
+                        "commit -q --no-verify --allow-empty -m vb_pristine && "
+                        "git tag -f vb_pristine > /dev/null && echo vb_trial_ok"])
+        if output is None or "vb_trial_ok" not in output:
+            logging.error(f"Failed to commit the pristine tree of trial container {container_id}: \n{output}")
+            return None
+        # Reinstalled once, so that a version taken from the Git history is the one every trial installs
+        dh.container_exec(container_id=container_id,
+                          command="sh -c 'test ! -f /vulbench/vb_reinstall.sh || bash /vulbench/vb_reinstall.sh'")
+        return self.trial_fingerprint(dh, container_id)
 
-        return bench_result
+    @staticmethod
+    def trial_fingerprint(dh: DockerHandle, container_id: str) -> str | None:
+        """
+        Fingerprint of the packages installed in a container, local version labels
+        (e.g. `+g1234abc.d20240101` of a dirty tree) set aside.
+        :param dh: The Docker handle of the container.
+        :param container_id: ID of the container.
+        :return: The fingerprint, or None if the packages could not be listed.
+        """
+        output = dh.container_exec(container_id=container_id, command="pip freeze --all")
+        if output is None or "==" not in output:
+            return None
+        packages = sorted(re.sub(r"\+\S*$", "", line.strip()) for line in output.splitlines() if line.strip())
+        return hashlib.sha256("\n".join(packages).encode()).hexdigest()
 
-    def run_bench_by_name(self, name: str, patch: str = ''):
+    def reset_trial(self, dh: DockerHandle, container_id: str, fingerprint: str) -> bool:
         """
-        Run the benchmark for a specific POC by its name.
+        Restore the pristine tree committed by setup_trial in a trial container. Files ignored by Git,
+        such as build artifacts of the deployment, are kept.
+        :param dh: The Docker handle of the container.
+        :param container_id: ID of the trial container.
+        :param fingerprint: Fingerprint of the installed packages taken by setup_trial.
+        :return: False if the container is gone or corrupted, e.g. the tree can not be reset
+                 or the previous trial changed the installed packages.
+        """
+        output = dh.container_exec(container_id=container_id, command=[
+            "sh", "-c", "cd /vulbench && git reset -q --hard vb_pristine && git clean -fdq && echo vb_trial_ok"])
+        if output is None or "vb_trial_ok" not in output:
+            logging.warning(f"Failed to reset trial container {container_id}: \n{output}")
+            return False
+        if self.trial_fingerprint(dh, container_id) != fingerprint:
+            logging.warning(f"The installed packages of trial container {container_id} changed.")
+            return False
+        return True
+
+    @staticmethod
+    def fetch_result(deployer: Deploy, container_id: str, result_dir: str, file_name: str) -> str | None:
+        """
+        Get vb_poc_result.json from a container and save it under the result directory.
+        The archive is extracted into a private directory first, so concurrent runs never overwrite each other.
+        :param deployer: The deployer holding the Docker handle.
+        :param container_id: ID of the Docker container.
+        :param result_dir: The directory to save the result to.
+        :param file_name: The file name of the saved result.
+        :return: The path of the saved result, or None if there is no result.
+        """
+        os.makedirs(result_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".vb_", dir=result_dir)
+        try:
+            fetched = deployer.docker_handle.get_files_from_container(container_id=container_id,
+                                                                      src_path="/vulbench/vb_poc_result.json",
+                                                                      dest_path=tmp_dir)
+            if fetched is None:
+                return None
+            result_to = os.path.join(result_dir, file_name)
+            deployer.move_file(os.path.join(tmp_dir, "vb_poc_result.json"), result_to)
+            return result_to
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def prepare_bench_by_name(self, name: str, patch: str = '') -> dict | None:
+        """
+        Prepare the benchmark for a specific POC by its name, see prepare_bench.
         :param name: The name of the POC.
         :param patch: The path to the patch file.
-        :return:
+        :return: The prepared benchmark, or None if the POC can not be found.
         """
         info, necessary = self.get_info(name)
         if not necessary:
             logging.error(f"Can not find POC {name} in the info file.")
             return None
-        if patch != '' and not os.path.exists(patch):
-            logging.error(f"Patch file {patch} does not exist.")
+        logging.info(f"Preparing benchmark for POC: {name}")
+        prepared = self.prepare_bench(git_repo=necessary["git_repo"],
+                                      commit=necessary["commit"],
+                                      py_version=necessary["py_version"],
+                                      name=name,
+                                      check_command=necessary["check_command"],
+                                      deploy_command=necessary["deploy_command"],
+                                      run_kwargs=necessary["run_kwargs"],
+                                      timeout=necessary["timeout"],
+                                      patch=patch if patch is not None else "")
+        prepared["info"] = info
+        return prepared
+
+    def run_bench_by_name(self, name: str, patch: str = '', prepared: concurrent.futures.Future = None):
+        """
+        Run the benchmark for a specific POC by its name.
+        :param name: The name of the POC.
+        :param patch: The path to the patch file, or a dictionary of the model name and its patch file in matrix mode.
+        :param prepared: A future of prepare_bench_by_name running in the background, if the POC is prefetched.
+        :return:
+        """
+        for p in (patch.values() if isinstance(patch, dict) else [patch]):
+            if p != '' and not os.path.exists(p):
+                logging.error(f"Patch file {p} does not exist.")
+                return None
+        prepared_bench = None
+        necessary = {}
+        try:
+            if prepared is not None:
+                prepared_bench = prepared.result()
+                info = prepared_bench["info"] if prepared_bench is not None else {}
+            else:
+                info, necessary = self.get_info(name)
+                if not necessary:
+                    info = {}
+        except Exception as e:
+            logging.error(f"Error preparing benchmark for {name}: {e}")
+            return None
+        if not info:
+            logging.error(f"Can not find POC {name} in the info file.")
             return None
         print(f"Selected POC: {name}")
         print(self.format_info(info))
-        print(f"Using patch: {patch if patch else 'No patch provided'}")
+        if isinstance(patch, dict):
+            print("Using patches: \n" + "\n".join(f"\t{m}: {p}" for m, p in patch.items()))
+        else:
+            print(f"Using patch: {patch if patch else 'No patch provided'}")
         logging.info(f"Running benchmark for POC: {name}")
         try:
             print("Please wait, this may take a while...")
             start_time = time.time()
 
-            bench_result = self.run_bench(git_repo=necessary["git_repo"],
-                                          commit=necessary["commit"],
-                                          py_version=necessary["py_version"],
-                                          name=name,
-                                          check_command=necessary["check_command"],
-                                          deploy_command=necessary["deploy_command"],
-                                          run_kwargs=necessary["run_kwargs"],
-                                          patch=patch if patch is not None else "")
+            if prepared_bench is not None:
+                bench_result = self.execute_bench(prepared_bench)
+            else:
+                bench_result = self.run_bench(git_repo=necessary["git_repo"],
+                                              commit=necessary["commit"],
+                                              py_version=necessary["py_version"],
+                                              name=name,
+                                              check_command=necessary["check_command"],
+                                              deploy_command=necessary["deploy_command"],
+                                              run_kwargs=necessary["run_kwargs"],
+                                              timeout=necessary["timeout"],
+                                              patch=patch if patch is not None else "")
             end_time = time.time()
             duration = end_time - start_time
+            self.record_timing(bench_result, duration)
             print(f"\n[VulBench] All test for {name} done! You can check the results in the logs.")
             logging.info(f"Benchmark for {name} completed in {duration:.2f} seconds.")
             print(f"[VulBench] Completed benchmark for {name} in {duration:.2f} seconds.\n")
@@ -333,11 +1287,449 @@ class Manage:
             logging.error(f"Error running benchmark for {name}: {e}")
             return None
 
-    def run_all_bench(self, patch_dir: str = None, poc_list: list = None):
+    def record_timing(self, bench_result: dict | list, duration: float) -> None:
+        """
+        Record the stage durations of a finished benchmark in the timing database.
+        The total is the preparation plus the execution, whether the preparation was prefetched or not.
+        :param bench_result: The benchmark result, or a list of them in matrix mode.
+        :param duration: The wall time of the benchmark in seconds, the total if the two are not recorded.
+        """
+        if not bench_result:
+            return
+        results = bench_result if isinstance(bench_result, list) else [bench_result]
+        for br in results:
+            timing = br.get("timing")
+            if timing is None:
+                continue
+            prepare = (timing.get("prepare") or {}).get("total")
+            if prepare is not None and timing.get("execute") is not None:
+                timing["total"] = prepare + timing["execute"]
+            else:
+                timing["total"] = duration
+        try:
+            # In matrix mode all models share the same preparation, the longest patched lane is kept
+            self.stage_timings.record(
+                max(results, key=lambda br: ((br.get("timing") or {}).get("patched") or {}).get("total", 0)))
+        except Exception as e:
+            logging.error(f"Error recording stage timings of {results[0].get('name', '')}: {e}")
+
+    def get_issues(self) -> dict:
+        """
+        Get all security issues from the info file, without any prompt.
+        :return: Dictionary of the upper-cased POC name and a tuple of its info item and security issue.
+        """
+        info_file = os.path.join(self.local_poc_path, "info.json")
+        with open(info_file, 'r') as f:
+            info = json.load(f)
+        return {security_issue.get("public_id", "").strip().upper(): (item, security_issue)
+                for item in info for security_issue in item.get("security_issues", [])}
+
+    def get_commits(self, names: list) -> list:
+        """
+        Get the patch commit of several POCs from the info file.
+        :param names: The names of the POCs.
+        :return: List of (name, commit), in the order of names.
+        """
+        issues = self.get_issues()
+        return [(name, issues.get(name.strip().upper(), ({}, {}))[1].get("patch_commits", [{}])[0].get(
+            "commit_hash", "")) for name in names]
+
+    def order_by_locality(self, names: list) -> list:
+        """
+        Group POCs sharing a repository, a Python version and an installation method, so the clone, the checkout,
+        the image layers and the pip downloads of one POC are still warm for the next.
+        Repositories with the longest historical durations come first.
+        :param names: The names of the POCs, in the default order.
+        :return: The names of the POCs in the new order.
+        """
+        issues = self.get_issues()
+        deployer = Deploy()
+        keys = {}
+        for name in names:
+            item, issue = issues.get(name.strip().upper(), ({}, {}))
+            repo_url = item.get("repo_url", "").strip().rstrip('/').removesuffix('.git').lower()
+            repo_name = repo_url.split('/')[-1]
+            install_method = deployer.get_install_method(deployer.get_worktree_dir(repo_name)) if repo_name else ''
+            keys[name] = (repo_url, issue.get("python_version", ""), install_method)
+
+        estimates = self.stage_timings.estimates(self.get_commits(names))
+        repo_durations = {}
+        for name in names:
+            repo_durations[keys[name][0]] = repo_durations.get(keys[name][0], 0) + estimates.get(name, 0)
+        ordered = sorted(names, key=lambda n: (-repo_durations[keys[n][0]],) + keys[n])
+        logging.info(f"POCs grouped into {len(set(keys.values()))} groups by repository, Python version "
+                     f"and installation method.")
+        return ordered
+
+    @staticmethod
+    def report_cache(all_bench_result: list) -> dict:
+        """
+        Count the cache hits and misses of the clone, the checkout, the image build, the image cache
+        and the deployed snapshot over a run, as well as the pip cache hits and misses.
+        :param all_bench_result: The benchmark results of the run.
+        :return: Dictionary of the stage and its [hits, misses], the cached and total build steps,
+                 the [hits, misses] of the pip cache, the mean checkout-to-first-exec latency of the containers
+                 and the bytes of POC payload copied into them.
+        """
+        caches = {}
+        for br in all_bench_result:
+            # In matrix mode the models of a POC share the same preparation
+            if br.get("cache"):
+                caches[br.get("name", "")] = br["cache"]
+        report = {stage: [sum(1 for c in caches.values() if c.get(stage)),
+                          sum(1 for c in caches.values() if stage in c and not c.get(stage))]
+                  for stage in ("clone", "checkout", "image", "image_cache", "snapshot")}
+        for counter in ("layers", "pip"):
+            report[counter] = [sum(c.get(counter, [0, 0])[0] for c in caches.values()),
+                               sum(c.get(counter, [0, 0])[1] for c in caches.values())]
+        # Checkout-to-first-exec latency of the containers, lower when they were pre-started, see ContainerPool
+        first_execs = [lane_timing["first_exec"] for br in all_bench_result
+                       for lane_timing in ((br.get("timing") or {}).get("ori"), (br.get("timing") or {}).get("patched"))
+                       if lane_timing and "first_exec" in lane_timing]
+        report["first_exec"] = sum(first_execs) / len(first_execs) if first_execs else None
+        report["payload"] = sum(c.get("payload", 0) for c in caches.values())
+        logging.info(f"Cache report: {report}")
+        print("[VulBench] Cache hits/misses: " +
+              ", ".join(f"{stage} {report[stage][0]}/{report[stage][1]}"
+                        for stage in ("clone", "checkout", "image", "image_cache", "snapshot")) +
+              f", cached build steps {report['layers'][0]}/{report['layers'][1]}" +
+              f", pip cache hits/misses {report['pip'][0]}/{report['pip'][1]}" +
+              f", POC payload copied {report['payload']} bytes" +
+              (f", container checkout to first exec {report['first_exec']:.2f}s on average"
+               if report["first_exec"] is not None else ""))
+        return report
+
+    def estimate_remaining(self, names: list, jobs: int = 1) -> float | None:
+        """
+        Estimate the time left to run several POCs from their historical stage durations.
+        :param names: The names of the POCs left, in the running order.
+        :param jobs: Number of POCs running concurrently.
+        :return: The estimated time in seconds, or None if none of them ever ran.
+        """
+        if not names:
+            return 0.0
+        estimates = self.stage_timings.estimates(self.get_commits(names))
+        if not estimates:
+            return None
+        return self.stage_timings.makespan([estimates[name] for name in names], jobs)
+
+    def build_wheelhouse(self, poc_list: list = None) -> int:
+        """
+        Build the wheels of the projects and POC dependencies of all POCs into the local wheelhouse,
+        see Docker.Wheelhouse. The projects are checked out at the parent commit, as they are deployed.
+        :param poc_list: Names of the POCs, default is all POCs in the info file.
+        :return: Number of wheels added to the wheelhouse.
+        """
+        issues = self.get_issues()
+        names = [name.strip().upper() for name in poc_list] if poc_list else sorted(issues)
+        dh = self.docker_pool.endpoints[0].get_handle()
+        wheelhouse = Wheelhouse(docker_handle=dh)
+        deployer = Deploy(docker_handle=dh)
+        added = 0
+        for i, name in enumerate(names):
+            if name not in issues:
+                logging.error(f"POC {name} does not exist in the info file, skipping.")
+                continue
+            item, issue = issues[name]
+            git_url, repo_name = self.get_git_url(item.get("repo_url", ""))
+            commit = issue.get("patch_commits", [{}])[0].get("commit_hash", "")
+            print(f"[VulBench] Building wheels of {name} ({i + 1}/{len(names)})...")
+            try:
+                with self.get_repo_lock(repo_name):
+                    deployer.mirror(git_url, commit)
+                    mirror_path = deployer.get_mirror_path(git_url)
+                    pc = deployer.get_parent_commit(repo_path=mirror_path, current_commit=commit)
+                    path = deployer.add_worktree(mirror_path, pc, repo_name=repo_name)
+            except Exception as e:
+                logging.error(f"Failed to check out {name}, skipping: {e}")
+                continue
+            try:
+                install_commands = issue.get("deploy_command", None)
+                if not install_commands:
+                    with deployer.pkg_info_lock:
+                        install_commands = deployer.package_install_cmd(path)
+                _, dependency_commands = deployer.dependency_install_cmd(path)
+                run_path = os.path.join(self.local_poc_path, issue.get("public_id", name).strip(), "run.py")
+                requirements = [r for d in deployer.poc_dependencies(run_path) for r in deployer.pip_requirements(d)]
+                added += wheelhouse.build(issue.get("python_version", ""), path,
+                                          list(install_commands) + dependency_commands, requirements)
+            finally:
+                with self.get_repo_lock(repo_name):
+                    deployer.remove_worktree(mirror_path, path)
+        packages = wheelhouse.write_index()
+        logging.info(f"Wheelhouse built: {added} wheels added, {packages} packages in {wheelhouse.wheelhouse_dir}")
+        print(f"[VulBench] {added} wheels added to the wheelhouse, {packages} packages in {wheelhouse.wheelhouse_dir}")
+        return added
+
+    @staticmethod
+    def select_patch(name: str, patch_dir: str = '') -> str | None:
+        """
+        Select the patch file of a POC from the patch directory.
+        :param name: The name of the POC.
+        :param patch_dir: The directory containing patch files, if any.
+        :return: The path to the patch file, '' if there is none, or None if the POC should be skipped.
+        """
+        try:
+            patch = ''
+            if patch_dir is not None and patch_dir != '':
+                patch_path = os.path.join(patch_dir, f"{name}.patch")
+                if os.path.exists(patch_path):
+                    patch = patch_path
+
+            # If not allow empty patch, continue to next POC
+            allow_empty_patch = load_config().get("Patch", {}).get("allow_empty_patch", True)
+            if not allow_empty_patch:
+                with open(patch, 'r') as f:
+                    content = f.read().strip()
+                if content == '':
+                    logging.warning(f"Do not allow empty patch, skipping this patch: {patch}")
+                    print(f"[VulBench] Do not allow empty patch, skipping this patch: {patch}")
+                    return None
+            return patch
+        except Exception as e:
+            logging.error(f"Error selecting patch for {name}: {e}")
+            return None
+
+    @staticmethod
+    def get_model_name(patch_dir: str) -> str:
+        """
+        Get the model name of a patch directory in matrix mode, which is the name of the directory.
+        :param patch_dir: The directory containing patch files of a model.
+        :return: The model name.
+        """
+        return os.path.basename(os.path.normpath(patch_dir))
+
+    def select_patches(self, name: str, patch_dirs: list) -> dict | None:
+        """
+        Select the patch files of a POC from several patch directories, one directory per model.
+        :param name: The name of the POC.
+        :param patch_dirs: The directories containing patch files.
+        :return: Dictionary of the model name and the path to its patch file, or None if no model has a patch.
+        """
+        patches = {}
+        for patch_dir in patch_dirs:
+            model = self.get_model_name(patch_dir)
+            patch = self.select_patch(name, patch_dir)
+            if patch:
+                patches[model] = patch
+            else:
+                logging.info(f"No patch of {name} found for model {model}, skipping it in the matrix.")
+        return patches if patches else None
+
+    def select_task_patch(self, name: str, patch_dir: str | list = '') -> str | dict | None:
+        """
+        Select the patch of a POC, in matrix mode if several patch directories are given.
+        :param name: The name of the POC.
+        :param patch_dir: The directory containing patch files, or a list of directories in matrix mode.
+        :return: See select_patch and select_patches.
+        """
+        if isinstance(patch_dir, list):
+            return self.select_patches(name, patch_dir)
+        return self.select_patch(name, patch_dir)
+
+    @staticmethod
+    def pending_patch(name: str, patch: str | dict, completed: dict) -> tuple:
+        """
+        Split the patch of a POC into what still has to run and what is already recorded in the journal.
+        :param name: The name of the POC.
+        :param patch: The patch selected by select_task_patch.
+        :param completed: The benchmarks already finished, see RunJournal.completed.
+        :return: The patch still to run (None if nothing is left), and the list of recorded benchmark results.
+        """
+        if isinstance(patch, dict):
+            done = [completed[RunJournal.key(name, p)] for p in patch.values() if RunJournal.key(name, p) in completed]
+            remaining = {m: p for m, p in patch.items() if RunJournal.key(name, p) not in completed}
+            return (remaining if remaining else None), done
+        key = RunJournal.key(name, patch)
+        if key in completed:
+            return None, [completed[key]]
+        return patch, []
+
+    def plan_tasks(self, available_id: list, patch_dir: str | list = '', completed: dict = None) -> tuple:
+        """
+        Select the patches of the POCs to run and leave out what is already recorded in the journal.
+        :param available_id: The names of the POCs, in the running order.
+        :param patch_dir: The directory containing patch files, or a list of directories in matrix mode.
+        :param completed: The benchmarks already finished, see RunJournal.completed.
+        :return: The list of (name, patch still to run, None if nothing is left) of the POCs that have a patch,
+                 and the dictionary of the name and its results recorded in the journal.
+        """
+        tasks = []
+        results = {}
+        for name in available_id:
+            patch = self.select_task_patch(name, patch_dir)
+            if patch is None:
+                continue
+            patch, done = self.pending_patch(name, patch, completed or {})
+            tasks.append((name, patch))
+            results[name] = done
+            if patch is None:
+                logging.info(f"POC {name} is already recorded in the journal, skipping.")
+        return tasks, results
+
+    def run_bench_journaled(self, name: str, patch: str = '', journal: RunJournal = None,
+                            prepared: concurrent.futures.Future = None):
+        """
+        Run the benchmark for a specific POC by its name, and record the result in the journal once it finishes.
+        :param name: The name of the POC.
+        :param patch: The path to the patch file.
+        :param journal: The journal of the run, if any.
+        :param prepared: A future of prepare_bench_by_name running in the background, if the POC is prefetched.
+        :return: The benchmark result (a list of them in matrix mode), or None if the benchmark failed.
+        """
+        bench_result = self.run_bench_by_name(name, patch=patch, prepared=prepared)
+        if bench_result is not None and journal is not None:
+            for br in (bench_result if isinstance(bench_result, list) else [bench_result]):
+                try:
+                    journal.record(br, br.get("patch_path", "") if isinstance(patch, dict) else patch)
+                except Exception as e:
+                    logging.error(f"Error recording {name} in journal {journal.journal_path}: {e}")
+        return bench_result
+
+    def run_parallel_bench(self, available_id: list, patch_dir: str = '', jobs: int = 2,
+                           journal: RunJournal = None, prefetch: int = 0) -> list:
+        """
+        Run the benchmark for several POCs at once with a pool of workers.
+        Concurrent builds and containers are capped by `Bench.max_builds` and `Bench.max_containers` in the config.
+        With prefetch, the clone, checkout, patch and image build of the next POCs run in the background
+        while the containers of the current ones are executing.
+        :param available_id: The names of the POCs to run.
+        :param patch_dir: The directory containing patch files, if any.
+        :param jobs: Number of POCs to run concurrently.
+        :param journal: The journal of the run, POCs already recorded in it are skipped.
+        :param prefetch: Number of POCs to prepare ahead of the running ones, 0 means no prefetch.
+        :return: List of the benchmark results, in the order of available_id.
+        """
+        bench_config = load_config().get("Bench", {}) or {}
+        DockerHandle.build_slots.resize(bench_config.get("max_builds", 0))
+        DockerHandle.container_slots.resize(bench_config.get("max_containers", 0))
+        logging.info(f"Running benchmarks with {jobs} jobs, at most {DockerHandle.build_slots.total or 'unlimited'} "
+                     f"builds and {DockerHandle.container_slots.total or 'unlimited'} containers at once, "
+                     f"prefetching {prefetch} POCs.")
+
+        tasks, results = self.plan_tasks(available_id, patch_dir, journal.completed() if journal is not None else {})
+
+        # Prepared but not yet finished POCs, so the prefetch never runs more than `prefetch` POCs ahead
+        lookahead = Slots(jobs + prefetch)
+
+        def prefetch_task(name: str, patch: str):
+            lookahead.acquire()
+            return self.prepare_bench_by_name(name, patch)
+
+        def run_task(name: str, patch: str, prepared: concurrent.futures.Future = None):
+            try:
+                return self.run_bench_journaled(name, patch, journal, prepared)
+            finally:
+                if prepared is not None:
+                    lookahead.release()
+
+        pending = [name for name, patch in tasks if patch is not None]
+        total = len(pending)
+        finished = 0
+        start_time = time.time()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=prefetch) if prefetch > 0 else None
+        try:
+            futures = {}
+            for name, patch in tasks:
+                if patch is None:
+                    continue
+                prepared = prefetcher.submit(prefetch_task, name, patch) if prefetcher is not None else None
+                futures[executor.submit(run_task, name, patch, prepared)] = name
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                finished += 1
+                try:
+                    bench_result = future.result()
+                except Exception as e:
+                    logging.error(f"Error running benchmark for {name}: {e}")
+                    bench_result = None
+                if bench_result is not None:
+                    results[name].extend(bench_result if isinstance(bench_result, list) else [bench_result])
+                pending.remove(name)
+                pass_time = time.time() - start_time
+                remaining_time = self.estimate_remaining(pending, jobs)
+                if remaining_time is None:
+                    remaining_time = (total - finished) * pass_time / finished
+                print('-' * 50)
+                print(f"[{finished}/{total}] Finished benchmark for POC: {name}")
+                print(
+                    f"[VulBench] Time passed: {pass_time:.2f} seconds, estimated remaining time: {remaining_time:.2f} seconds")
+                print('-' * 50)
+        except KeyboardInterrupt:
+            logging.info("Benchmarking interrupted by user, waiting for the running jobs to finish.")
+            if prefetcher is not None:
+                prefetcher.shutdown(wait=False, cancel_futures=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            if prefetcher is not None:
+                prefetcher.shutdown(wait=True)
+            executor.shutdown(wait=True)
+
+        return [br for name, _ in tasks for br in results[name]]
+
+    @staticmethod
+    def analyze_matrix(all_bench_result: list, result_save_path: str) -> dict:
+        """
+        Analyze the results of a matrix run per model, and save the model x POC result matrix.
+        :param all_bench_result: The benchmark results of all models.
+        :param result_save_path: The path where all benchmark results are saved.
+        :return: The result matrix, {model: {poc: {"valid": bool, "working": bool, "patch_path": str}}}.
+        """
+        models = sorted(set(br.get("model", "") for br in all_bench_result))
+        pocs = sorted(set(br.get("name", "") for br in all_bench_result))[::-1]
+        matrix = {}
+        for model in models:
+            model_results = [br for br in all_bench_result if br.get("model", "") == model]
+            model_save_path = result_save_path.removesuffix(".json") + f"_{model}.json"
+            with open(model_save_path, 'w') as f:
+                json.dump(model_results, f, indent=4)
+            logging.info(f"Benchmark results of model {model} saved to {model_save_path}")
+            valid_patches, working_patches = BenchResult(model_save_path).analyze_result()
+            valid_names = [vp.get("name", "") for vp in valid_patches]
+            working_names = [wp.get("name", "") for wp in working_patches]
+            matrix[model] = {br.get("name", ""): {"valid": br.get("name", "") in valid_names,
+                                                  "working": br.get("name", "") in working_names,
+                                                  "patch_path": br.get("patch_path", "")}
+                             for br in model_results}
+
+        matrix_save_path = os.path.join(os.path.dirname(result_save_path),
+                                        os.path.basename(result_save_path).replace("VulBench_results_",
+                                                                                   "VulBench_matrix_"))
+        with open(matrix_save_path, 'w') as f:
+            json.dump({"models": models, "pocs": pocs, "matrix": matrix}, f, indent=4)
+        logging.info(f"Result matrix saved to {matrix_save_path}")
+
+        # W: working patch, V: valid but not working patch, x: invalid patch, -: not run
+        width = max([len(poc) for poc in pocs] + [len("Working")])
+        widths = [max(len(model), 3) for model in models]
+        print('-' * 20 + "VulBench Matrix" + '-' * 20)
+        print("POC".ljust(width) + "  " + "  ".join(model.ljust(w) for model, w in zip(models, widths)))
+        for poc in pocs:
+            cells = []
+            for model, w in zip(models, widths):
+                cell = matrix[model].get(poc)
+                mark = '-' if cell is None else 'W' if cell["working"] else 'V' if cell["valid"] else 'x'
+                cells.append(mark.ljust(w))
+            print(poc.ljust(width) + "  " + "  ".join(cells))
+        for label, key in (("Valid", "valid"), ("Working", "working")):
+            print(label.ljust(width) + "  " + "  ".join(
+                str(sum(1 for cell in matrix[model].values() if cell[key])).ljust(w) for model, w in zip(models, widths)))
+        print('-' * 20 + f"Result: {os.path.basename(matrix_save_path)}" + '-' * 20)
+        print("[VulBench] W: working, V: valid, x: invalid, -: not run.")
+        return matrix
+
+    def run_all_bench(self, patch_dir: str = None, poc_list: list = None, jobs: int = None, resume: str = '',
+                      prefetch: int = None):
         """
         Run the benchmark for all POCs.
         :param patch_dir: The directory containing patch files, if any.
+                          A list of directories (one per model) runs in matrix mode: each POC is deployed once,
+                          the original container runs once and only the patched lane is forked per model.
         :param poc_list: A list of POC names to run, if None, will run all available POCs.
+        :param jobs: Number of POCs to run concurrently, if None, will use `Bench.jobs` in the config.
+        :param prefetch: Number of POCs to prepare in the background, if None, will use `Bench.prefetch` in the config.
+        :param resume: ID of a previous run to resume, POCs already recorded in its journal are skipped.
         :return:
         """
         info_file = os.path.join(self.local_poc_path, "info.json")
@@ -345,9 +1737,29 @@ class Manage:
             logging.error("Info file does not exist.")
             return
 
-        if patch_dir != '' and not os.path.exists(patch_dir):
-            logging.error(f"Patch directory {patch_dir} does not exist.")
-            return
+        journal = RunJournal(run_id=resume)
+        if resume:
+            if not journal.exists():
+                logging.error(f"Journal of run {resume} does not exist: {journal.journal_path}")
+                return
+            header = journal.get_header()
+            if not patch_dir:
+                patch_dir = header.get("patch_dir", '') or ''
+            if poc_list is None:
+                poc_list = header.get("poc_list", None)
+
+        for pd in (patch_dir if isinstance(patch_dir, list) else [patch_dir]):
+            if pd != '' and not os.path.exists(pd):
+                logging.error(f"Patch directory {pd} does not exist.")
+                return
+
+        bench_config = load_config().get("Bench", {}) or {}
+        if jobs is None:
+            jobs = bench_config.get("jobs", 1)
+        jobs = max(1, int(jobs or 1))
+        if prefetch is None:
+            prefetch = bench_config.get("prefetch", 0)
+        prefetch = max(0, int(prefetch or 0))
 
         with open(info_file, 'r') as f:
             info = json.load(f)
@@ -358,52 +1770,66 @@ class Manage:
         else:
             available_id = [name for name in poc_list if name.strip()]
         available_id = sorted(list(set(available_id)))[::-1]
+        order = bench_config.get("order", "lpt")
+        if order == "lpt":
+            # Longest POCs first by their historical durations, so no long POC is left alone at the end of the run
+            available_id = self.stage_timings.order_lpt(self.get_commits(available_id))
+        elif order == "locality":
+            available_id = self.order_by_locality(available_id)
+        estimated_time = self.estimate_remaining(available_id, jobs)
+        if estimated_time is not None:
+            logging.info(f"Estimated time of the run from the stage timings: {estimated_time:.2f} seconds.")
+            print(f"[VulBench] Estimated time of the run: {estimated_time:.2f} seconds.")
         logging.info(f"Running benchmarks for {len(available_id)} available POCs.")
         logging.info(f"Available POCs: {', '.join(ai for ai in available_id)}")
         print(
             f"[VulBench] Running benchmarks for {len(available_id)} available POCs: {', '.join(ai for ai in available_id)}")
+        journal.start(patch_dir=patch_dir, poc_list=poc_list)
+        print(f"[VulBench] Run ID: {journal.run_id}, resume it with `--resume {journal.run_id}` if interrupted.")
         index = 1
-        total = len(available_id)
         all_bench_result = []
         start_time = time.time()
-        for name in available_id:
-            try:
-                patch = ''
-                if patch_dir != '':
-                    patch_path = os.path.join(patch_dir, f"{name}.patch")
-                    if os.path.exists(patch_path):
-                        patch = patch_path
-
-                # If not allow empty patch, continue to next POC
-                allow_empty_patch = load_config().get("Patch", {}).get("allow_empty_patch", True)
-                if not allow_empty_patch:
-                    with open(patch, 'r') as f:
-                        content = f.read().strip()
-                    if content == '':
-                        total -= 1
-                        logging.warning(f"Do not allow empty patch, skipping this patch: {patch}")
-                        print(f"[VulBench] Do not allow empty patch, skipping this patch: {patch}")
+        if jobs > 1 or prefetch > 0:
+            all_bench_result = self.run_parallel_bench(available_id, patch_dir=patch_dir, jobs=jobs, journal=journal,
+                                                       prefetch=prefetch)
+        else:
+            tasks, done = self.plan_tasks(available_id, patch_dir, journal.completed())
+            # Only the POCs still to run count in the estimate, not those without a patch or already in the journal
+            pending = [name for name, patch in tasks if patch is not None]
+            total = len(pending)
+            for name, patch in tasks:
+                try:
+                    all_bench_result.extend(done[name])
+                    if patch is None:
                         continue
 
-                print('-' * 50)
-                print(f"[{index}/{total}] Running benchmark for POC: {name}")
-                pass_time = time.time() - start_time
-                remaining_time = (total + 1 - index) * pass_time / index
-                print(
-                    f"[VulBench] Time passed: {pass_time:.2f} seconds, estimated remaining time: {remaining_time:.2f} seconds")
-                bench_result = self.run_bench_by_name(name, patch=patch)
-                if bench_result is not None:
-                    all_bench_result.append(bench_result)
-                print('-' * 50)
-                index += 1
-            except KeyboardInterrupt:
-                logging.info("Benchmarking interrupted by user.")
-                break
-            except Exception as e:
-                logging.error(f"Error running benchmark for {name}: {e}")
-                continue
+                    print('-' * 50)
+                    print(f"[{index}/{total}] Running benchmark for POC: {name}")
+                    pass_time = time.time() - start_time
+                    remaining_time = self.estimate_remaining(pending[pending.index(name):])
+                    if remaining_time is None:
+                        remaining_time = (total + 1 - index) * pass_time / index
+                    print(
+                        f"[VulBench] Time passed: {pass_time:.2f} seconds, estimated remaining time: {remaining_time:.2f} seconds")
+                    bench_result = self.run_bench_journaled(name, patch=patch, journal=journal)
+                    if isinstance(bench_result, list):
+                        all_bench_result.extend(bench_result)
+                    elif bench_result is not None:
+                        all_bench_result.append(bench_result)
+                    print('-' * 50)
+                    index += 1
+                except KeyboardInterrupt:
+                    logging.info("Benchmarking interrupted by user.")
+                    break
+                except Exception as e:
+                    logging.error(f"Error running benchmark for {name}: {e}")
+                    continue
 
         print('[VulBench] All benchmarks have been completed, and the results are being analyzed.')
+        try:
+            self.report_cache(all_bench_result)
+        except Exception as e:
+            logging.error(f"Error reporting the cache hits: {e}")
 
         # Save all benchmark results to a file
         try:
@@ -412,23 +1838,29 @@ class Manage:
                 json.dump(all_bench_result, f, indent=4)
             logging.info(f"All benchmark results saved to {result_save_path}")
             logging.info("Starting result analysis...")
-            br = BenchResult(result_save_path)
-            valid_patches, working_patches = br.analyze_result()
-            print('-'*20+"VulBench"+'-'*20)
-            print(f"Valid Patches [{len(valid_patches)}]:")
-            for vp in valid_patches:
-                print(f"{vp.get('name','')}\t{vp.get('patch_path','')}")
-            print(f"Working Patches [{len(working_patches)}]:")
-            for wp in working_patches:
-                print(f"{wp.get('name','')}\t{wp.get('patch_path','')}")
-            print('-'*20+f"Result: {os.path.basename(result_save_path)}"+'-'*20)
-            print('[VulBench] Result analysis completed. The results may not be accurate. Please check the logs for details.')
+            if isinstance(patch_dir, list):
+                self.analyze_matrix(all_bench_result, result_save_path)
+                print('[VulBench] Result analysis completed. The results may not be accurate. Please check the logs for details.')
+            else:
+                br = BenchResult(result_save_path)
+                valid_patches, working_patches = br.analyze_result()
+                print('-'*20+"VulBench"+'-'*20)
+                print(f"Valid Patches [{len(valid_patches)}]:")
+                for vp in valid_patches:
+                    print(f"{vp.get('name','')}\t{vp.get('patch_path','')}")
+                print(f"Working Patches [{len(working_patches)}]:")
+                for wp in working_patches:
+                    print(f"{wp.get('name','')}\t{wp.get('patch_path','')}")
+                print('-'*20+f"Result: {os.path.basename(result_save_path)}"+'-'*20)
+                print('[VulBench] Result analysis completed. The results may not be accurate. Please check the logs for details.')
         except Exception as e:
             logging.error(f"Error saving all benchmark results: {e}")
 
-        dh = DockerHandle()
-        images = dh.get_image_vulbench()
-        containers = dh.get_container_vulbench()
+        # Worktrees are removed as soon as their image is built, only interrupted runs leave some behind
+        Deploy(docker_handle=self.docker_pool.endpoints[0].get_handle()).prune_worktrees()
+
+        images = [image for dh in self.docker_pool.get_handles() for image in dh.get_image_vulbench()]
+        containers = [container for dh in self.docker_pool.get_handles() for container in dh.get_container_vulbench()]
         if len(containers) >= 3 * len(images):
             msg = (f"[VulBench] {len(images)} VulBench images and {len(containers)} containers found, " +
                    "please clean up the unused containers and images with `-c docker`.")
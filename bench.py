@@ -32,7 +32,51 @@ parser.add_argument(
     "--patch",
     type=str,
     metavar="path_to_patch",
-    help="Apply a patch to target application. Provide the path to the patch file or directory."
+    help="Apply a patch to target application. Provide the path to the patch file or directory. " +
+         "Several directories (comma separated or a glob like 'patches/*/') run in matrix mode, one model per directory."
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    metavar="N",
+    help="Run N PoCs concurrently when running several PoCs. Default is `Bench.jobs` in config.yaml."
+)
+parser.add_argument(
+    "--prefetch",
+    type=int,
+    metavar="K",
+    help="Clone, check out and build the next K PoCs in the background. Default is `Bench.prefetch` in config.yaml."
+)
+parser.add_argument(
+    "--rebuild",
+    action="store_true",
+    help="Rebuild the PoC images even if an image built from the same sources and commands exists."
+)
+parser.add_argument(
+    "--rebuild-base",
+    action="store_true",
+    help="Rebuild the shared base images (vulbench-base:<python_version>) used in this run."
+)
+parser.add_argument(
+    "--trials",
+    action="store_true",
+    help="In matrix mode, run the patches as trials in one patched container, reset between them, " +
+         "instead of one container per model."
+)
+parser.add_argument(
+    "-w",
+    "--wheelhouse",
+    type=str,
+    choices=["build", "serve"],
+    help="Build the local wheelhouse from the dependencies of all PoCs, or serve it as a package index " +
+         "until interrupted. Runs use it when `Wheelhouse.enabled` is set in config.yaml."
+)
+parser.add_argument(
+    "--resume",
+    type=str,
+    metavar="run_id",
+    help="Resume an interrupted run, PoCs already recorded in its journal are skipped."
 )
 
 if not any(vars(parser.parse_args()).values()):
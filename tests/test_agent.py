@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "poc"))
+
+from Agent import Agent
+
+
+class TestAgent(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_job(self, steps: list, deadline: float = 0) -> tuple:
+        for step in steps:
+            step.setdefault("cwd", self.tmp.name)
+        out = io.StringIO()
+        job = {"steps": steps, "deadline": deadline, "result": os.path.join(self.tmp.name, "result.json")}
+        done = Agent(job, out=out).run()
+        return done, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    @staticmethod
+    def of(events: list, event: str) -> list:
+        return [e for e in events if e["event"] == event]
+
+    def test_steps_and_result(self):
+        done, events = self.run_job([
+            {"key": "a", "stage": "check", "command": "echo $VB_TEST", "env": {"VB_TEST": "hello"}},
+            {"key": "b", "stage": "exec", "command": ["sh", "-c", "echo '{\"ok\": 1}' > result.json; exit 3"]},
+        ])
+        self.assertTrue(done)
+        self.assertEqual([(e["key"], e["exit_code"]) for e in self.of(events, "end")], [("a", 0), ("b", 3)])
+        self.assertEqual([e["data"] for e in self.of(events, "output")], ["hello\n"])
+        self.assertEqual(json.loads(self.of(events, "result")[0]["content"]), {"ok": 1})
+        self.assertEqual(events[-1]["event"], "done")
+
+    def test_if_failed(self):
+        steps = [{"key": "git_apply", "stage": "apply", "command": "exit 0"},
+                 {"key": "patch_p1", "stage": "apply", "command": "exit 0", "if_failed": "git_apply"}]
+        _, events = self.run_job([dict(step) for step in steps])
+        self.assertEqual([e["key"] for e in self.of(events, "start")], ["git_apply"])
+        # The fallback only runs after the step it backs up failed
+        steps[0]["command"] = "exit 1"
+        _, events = self.run_job(steps)
+        self.assertEqual([e["key"] for e in self.of(events, "start")], ["git_apply", "patch_p1"])
+
+    def test_step_timeout(self):
+        start = time.time()
+        done, events = self.run_job([{"key": "exec", "stage": "exec", "command": "sleep 30", "timeout": 0.5},
+                                     {"key": "after", "stage": "exec", "command": "exit 0"}])
+        self.assertFalse(done)
+        self.assertLess(time.time() - start, 10)
+        self.assertIsNone(self.of(events, "end")[0]["exit_code"])
+        self.assertEqual(self.of(events, "timeout")[0]["key"], "exec")
+        # A timeout stops the job, nothing runs after it and no result is collected
+        self.assertEqual([e["key"] for e in self.of(events, "start")], ["exec"])
+        self.assertEqual(self.of(events, "result"), [])
+
+    def test_deadline(self):
+        done, events = self.run_job([{"key": "a", "stage": "check", "command": "sleep 0.5"},
+                                     {"key": "b", "stage": "exec", "command": "sleep 30", "timeout": 60}], deadline=1)
+        self.assertFalse(done)
+        # The step gets what is left of the deadline, not its own timeout
+        timeout = self.of(events, "timeout")[0]
+        self.assertEqual(timeout["key"], "b")
+        self.assertLess(timeout["seconds"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
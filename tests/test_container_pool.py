@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import time
+import uuid
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Docker.ContainerPool import ContainerPool
+from utils import Slots
+
+
+class Image:
+    def __init__(self, image_id):
+        self.id = image_id
+
+
+class Container:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.name = f"vulbench_{self.id[:8]}"
+        self.status = 'running'
+
+
+class Handle:
+    """
+    Docker handle keeping its containers in memory.
+    """
+    base_url = "unix:///var/run/docker.sock"
+
+    def __init__(self):
+        self.containers = {}
+        self.lock = threading.Lock()
+
+    def run_by_image(self, image, patched=False, run_kwargs=None, suffix=''):
+        container = Container()
+        with self.lock:
+            self.containers[container.id] = container
+        return container
+
+    def get_container(self, container_id):
+        return self.containers[container_id]
+
+    def container_remove(self, container_id):
+        with self.lock:
+            self.containers.pop(container_id, None)
+
+
+class TestContainerPool(unittest.TestCase):
+    def setUp(self):
+        self.slots = Slots(2)
+        self.pool = ContainerPool(per_image=4, max_idle=8, slots=self.slots)
+        self.dh = Handle()
+
+    def wait_started(self):
+        with self.pool._cond:
+            while sum(self.pool._starting.values()) > 0:
+                self.pool._cond.wait()
+
+    def test_warm_within_slots(self):
+        self.pool.warm(self.dh, Image("a"), n=3)
+        self.wait_started()
+        self.assertEqual(len(self.dh.containers), 2)
+        self.assertEqual(self.slots.used, 2)
+        self.pool.drain()
+        self.assertEqual(self.slots.used, 0)
+        self.assertEqual(self.dh.containers, {})
+
+    def test_reserve_takes_over_warm_slots(self):
+        image = Image("a")
+        self.pool.warm(self.dh, image, n=2)
+        slots = self.pool.reserve(self.dh, image, n=2)
+        self.assertEqual((slots, self.slots.used), (2, 2))
+        for _ in range(2):
+            self.assertIsNotNone(self.pool.acquire(self.dh, image))
+        self.assertEqual((self.pool.hits, self.pool.misses, self.slots.used), (2, 0, 2))
+        self.slots.release(slots)
+        self.assertEqual(self.slots.used, 0)
+
+    def test_reclaim_idle_of_other_images(self):
+        self.pool.warm(self.dh, Image("a"), n=2)
+        self.wait_started()
+        start = time.time()
+        slots = self.pool.reserve(self.dh, Image("b"), n=2)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual((slots, self.slots.used), (2, 2))
+        self.assertEqual(self.dh.containers, {})
+        self.pool.drain()
+        self.slots.release(slots)
+        self.assertEqual(self.slots.used, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Docker.Deploy import Deploy
+from Docker.template import get_dockerfile
+
+
+class TestDependencyLayer(unittest.TestCase):
+    def dockerfile(self, files: dict) -> tuple:
+        with tempfile.TemporaryDirectory() as package_dir:
+            for name, content in files.items():
+                with open(os.path.join(package_dir, name), 'w', encoding='utf-8') as f:
+                    f.write(content)
+            # No Docker daemon is needed to get the commands
+            manifests, commands = Deploy(docker_handle=object()).dependency_install_cmd(package_dir)
+        dockerfile = get_dockerfile(py_version="3.10", file_path="project", other_commands=["pip install ."],
+                                    manifests=manifests, dependency_commands=commands)
+        return manifests, commands, dockerfile
+
+    def test_setup_py_only(self):
+        manifests, commands, dockerfile = self.dockerfile({
+            "setup.py": "from setuptools import setup\nsetup(name='p', install_requires=['requests>=2', 'six'])\n",
+        })
+        self.assertEqual(manifests, ["setup.py"])
+        self.assertEqual(commands, ["pip install 'requests>=2' six"])
+        self.assertIn("COPY project/setup.py /vulbench/setup.py", dockerfile)
+        self.assertIn("RUN pip install 'requests>=2' six", dockerfile)
+        # The dependency layer comes before the source
+        self.assertLess(dockerfile.index("RUN pip install 'requests>=2' six"), dockerfile.index("COPY project/ /vulbench/"))
+
+    def test_pep621_pyproject(self):
+        manifests, commands, dockerfile = self.dockerfile({
+            "pyproject.toml": "[project]\nname = 'p'\ndependencies = ['flask<3']\n",
+        })
+        self.assertEqual(manifests, ["pyproject.toml"])
+        self.assertIn("COPY project/pyproject.toml /vulbench/pyproject.toml", dockerfile)
+        self.assertIn("RUN pip install 'flask<3'", dockerfile)
+
+    def test_poc_dependencies(self):
+        # Installed after the project, so that its install does not change the versions the POC asks for
+        poc_commands = Deploy.poc_dependency_cmd(["lxml==4.9.2"])
+        dockerfile = get_dockerfile(py_version="3.10", file_path="project", other_commands=["pip install ."],
+                                    poc_dependency_commands=poc_commands)
+        self.assertIn(f"RUN {poc_commands[0]}", dockerfile)
+        self.assertLess(dockerfile.index("RUN pip install ."), dockerfile.index("RUN pip install lxml==4.9.2"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Docker.DockerHandle import DockerHandle
+
+
+class Image:
+    def __init__(self, *tags):
+        self.tags = list(tags)
+
+
+class TestDockerHandle(unittest.TestCase):
+    def test_base_images_kept(self):
+        dh = DockerHandle.__new__(DockerHandle)
+        poc = Image("vulbench_flask1234:latest")
+        base = Image(f"{DockerHandle.base_image_name}:3.10")
+        dh.get_images = lambda image_name='', all=False: [poc, base, Image("python:3.10")]
+        self.assertEqual(dh.get_image_vulbench(), [poc])
+        self.assertEqual(dh.get_image_vulbench(include_base=True), [poc, base])
+        self.assertEqual(dh.get_image_vulbench(image_name="vulbench_flask"), [poc])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import tempfile
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Docker.DownloadCache import DownloadCache
+
+
+class Response:
+    def __init__(self, status_code: int, content: bytes = b'', etag: str = ''):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"ETag": etag} if etag else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class Server:
+    """
+    Serves files by URL with an ETag of their content, and records the requests.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.down = False
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.requests.append((url, dict(headers or {})))
+        if self.down:
+            raise requests.ConnectionError("server is down")
+        if url not in self.files:
+            return Response(404)
+        content = self.files[url]
+        etag = f'"{len(content)}-{hash(content)}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return Response(304)
+        return Response(200, content, etag)
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DownloadCache(cache_dir=self.tmp.name)
+        self.server = Server()
+        self.cache.session = self.server
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def read(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_revalidation(self):
+        url = "https://example.com/a.patch"
+        self.server.files[url] = b"From a"
+        path = self.cache.fetch(url)
+        self.assertEqual(self.read(path), b"From a")
+        # Not modified: the cached file is used
+        self.assertEqual(self.cache.fetch(url), path)
+        self.assertIn("If-None-Match", self.server.requests[-1][1])
+        # Changed on the server: downloaded again
+        self.server.files[url] = b"From b"
+        self.assertEqual(self.read(self.cache.fetch(url)), b"From b")
+        # The server is down: the cached file is still used
+        self.server.down = True
+        self.assertEqual(self.read(self.cache.fetch(url)), b"From b")
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.fetch("https://example.com/missing"))
+        self.assertEqual(os.listdir(self.cache.objects_dir), [])
+
+    def test_same_content_stored_once(self):
+        for url in ("https://a.example.com/x", "https://b.example.com/x"):
+            self.server.files[url] = b"same"
+        self.assertEqual(self.cache.fetch("https://a.example.com/x"), self.cache.fetch("https://b.example.com/x"))
+        self.assertEqual(len(os.listdir(self.cache.objects_dir)), 1)
+
+    def test_lru_eviction(self):
+        self.cache.max_size = 10
+        for name in ("a", "b", "c"):
+            self.server.files[f"https://example.com/{name}"] = name.encode() * 4
+        path_a = self.cache.fetch("https://example.com/a")
+        path_b = self.cache.fetch("https://example.com/b")
+        # a is used again, so b is the least recently used when c comes in
+        self.cache.fetch("https://example.com/a")
+        path_c = self.cache.fetch("https://example.com/c")
+        self.assertTrue(os.path.exists(path_a) and os.path.exists(path_c))
+        self.assertFalse(os.path.exists(path_b))
+        self.assertEqual(sorted(self.cache.load_index()), ["https://example.com/a", "https://example.com/c"])
+
+
+if __name__ == '__main__':
+    unittest.main()
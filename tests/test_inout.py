@@ -0,0 +1,24 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "poc"))
+
+from InOut import InOut
+
+
+class TestInOut(unittest.TestCase):
+    def test_verify_dependency(self):
+        self.assertTrue(InOut.verify_dependency("pip>=1"))
+        self.assertTrue(InOut.verify_dependency("pip install 'pip>=1' --no-cache-dir"))
+        self.assertFalse(InOut.verify_dependency("pip<1"))
+        self.assertFalse(InOut.verify_dependency("vulbench-not-installed==1.0"))
+        # Commands can not be checked
+        self.assertTrue(InOut.verify_dependency("@apt-get install -y libxml2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Invoke import Invoke
+
+
+class TestPatchPath(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for model in ("gpt", "claude", "llama"):
+            os.makedirs(os.path.join(self.tmp.name, "patches", model))
+        self.patch_file = os.path.join(self.tmp.name, "CVE-2023-1.patch")
+        open(self.patch_file, 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.tmp.name, "patches", *parts)
+
+    def test_single(self):
+        self.assertEqual(Invoke.expand_patch_path(self.patch_file), self.patch_file)
+        self.assertEqual(Invoke.expand_patch_path(f" {self.path('gpt')} ,"), self.path("gpt"))
+
+    def test_comma_separated(self):
+        self.assertEqual(Invoke.expand_patch_path(f"{self.path('gpt')},{self.path('llama')},{self.path('gpt')}"),
+                         [self.path("gpt"), self.path("llama")])
+
+    def test_glob(self):
+        self.assertEqual(Invoke.expand_patch_path(self.path("*")),
+                         [self.path("claude"), self.path("gpt"), self.path("llama")])
+        self.assertEqual(Invoke.expand_patch_path(f"{self.path('l*')},{self.path('claude')}"),
+                         [self.path("llama"), self.path("claude")])
+
+    def test_invalid(self):
+        self.assertIsNone(Invoke.expand_patch_path(""))
+        self.assertIsNone(Invoke.expand_patch_path(self.path("missing")))
+        self.assertIsNone(Invoke.expand_patch_path(self.path("x*")))
+        # Several patches must be directories with distinct names, one per model
+        self.assertIsNone(Invoke.expand_patch_path(f"{self.path('gpt')},{self.patch_file}"))
+        os.makedirs(os.path.join(self.tmp.name, "other", "gpt"))
+        self.assertIsNone(Invoke.expand_patch_path(f"{self.path('gpt')},{os.path.join(self.tmp.name, 'other', 'gpt')}"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Docker.DockerHandle import DockerHandle
+
+
+class TestPipCache(unittest.TestCase):
+    def setUp(self):
+        # No Docker daemon is needed, the cache volume of every image is the same
+        self.dh = DockerHandle.__new__(DockerHandle)
+        self.dh.get_pip_cache = lambda image: "vulbench_pip_cache_test"
+
+    def test_mounted(self):
+        run_kwargs = self.dh._with_pip_cache(None, {"volumes": {"/data": {"bind": "/data", "mode": "ro"}},
+                                                    "environment": ["A=1"]})
+        self.assertEqual(run_kwargs["volumes"]["vulbench_pip_cache_test"]["bind"], DockerHandle.pip_cache_path)
+        self.assertIn("/data", run_kwargs["volumes"])
+        self.assertEqual(run_kwargs["environment"], ["A=1", f"PIP_CACHE_DIR={DockerHandle.pip_cache_path}"])
+
+    def test_poc_cache_dir_kept(self):
+        for environment in ({"PIP_CACHE_DIR": "/tmp/pip"}, ["PIP_CACHE_DIR=/tmp/pip"]):
+            run_kwargs = {"environment": environment}
+            self.assertEqual(self.dh._with_pip_cache(None, run_kwargs), run_kwargs)
+
+    def test_poc_mount_kept(self):
+        for volumes in ({"/host/pip": {"bind": DockerHandle.pip_cache_path, "mode": "rw"}},
+                        [f"/host/pip:{DockerHandle.pip_cache_path}"],
+                        {"vulbench_pip_cache_test": {"bind": "/elsewhere", "mode": "rw"}}):
+            run_kwargs = {"volumes": volumes}
+            self.assertEqual(self.dh._with_pip_cache(None, run_kwargs), run_kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import json
+import base64
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Data.ResultAnalysis import BenchResult
+
+
+class TestResultAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def poc_result(self, name: str, output: str) -> str:
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"poc_output": base64.b64encode(output.encode()).decode(),
+                       "match_result": {"output": output == "crash", "error": False, "ontime": True,
+                                        "is_dos": False}}, f)
+        return path
+
+    def analyze(self, items: list) -> tuple:
+        path = os.path.join(self.tmp.name, "VulBench_results.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(items, f)
+        return BenchResult(path).analyze_result()
+
+    @staticmethod
+    def item(name: str, **fields) -> dict:
+        item = {"name": name, "patch_result": {"git_apply": "", "patch_p1": None},
+                "check_result": {"ori": None, "patched": None}, "result_path": {"ori": None, "patched": None},
+                "exit_code": {"ori": None, "patched": None}, "timeout": None}
+        item.update(fields)
+        return item
+
+    def test_timed_out_item(self):
+        timed_out = self.item("hung", timeout={"patched": {"stage": "exec", "seconds": 60, "command": "run.py"}})
+        working = self.item("working", result_path={"ori": self.poc_result("w_ori.json", "crash"),
+                                                    "patched": self.poc_result("w_patched.json", "fine")})
+        valid_patches, working_patches = self.analyze([timed_out, working])
+        self.assertEqual([wp["name"] for wp in working_patches], ["working"])
+        self.assertEqual([vp["name"] for vp in valid_patches], ["hung", "working"])
+
+    def test_missing_result(self):
+        missing = self.item("missing", result_path={"ori": self.poc_result("m_ori.json", "crash"), "patched": None})
+        valid_patches, working_patches = self.analyze([missing])
+        self.assertEqual(working_patches, [])
+
+    def test_valid_from_exit_codes(self):
+        br = BenchResult.__new__(BenchResult)
+        # The exit codes decide, whatever the output says
+        self.assertTrue(br.check_patch_valid(self.item(
+            "a", patch_result={"git_apply": "warning: 1 line adds whitespace errors: error: none", "patch_p1": None},
+            exit_code={"ori": {}, "patched": {"git_apply": 0}})))
+        self.assertFalse(br.check_patch_valid(self.item(
+            "b", patch_result={"git_apply": "", "patch_p1": "patching file a.py"},
+            exit_code={"ori": {}, "patched": {"git_apply": 1, "patch_p1": 1}})))
+        self.assertTrue(br.check_patch_valid(self.item(
+            "c", patch_result={"git_apply": "error: patch failed", "patch_p1": "patching file a.py"},
+            exit_code={"ori": {}, "patched": {"git_apply": 1, "patch_p1": 0}})))
+
+    def test_valid_from_output(self):
+        # Results of older runs have no exit codes, the output is matched instead
+        br = BenchResult.__new__(BenchResult)
+        self.assertTrue(br.check_patch_valid(self.item("a")))
+        self.assertFalse(br.check_patch_valid(self.item(
+            "b", patch_result={"git_apply": "error: patch failed", "patch_p1": "Hunk #1 FAILED at 3."})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Data.RunJournal import RunJournal
+from Manage import Manage
+
+
+class TestRunJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key(self):
+        self.assertEqual(RunJournal.key(" cve-2023-1 ", ""), "CVE-2023-1|")
+        # Relative and absolute paths of the same patch are the same benchmark
+        self.assertEqual(RunJournal.key("CVE-2023-1", "patches/a.patch"),
+                         RunJournal.key("cve-2023-1", os.path.abspath("patches/a.patch")))
+
+    def test_resume(self):
+        journal = RunJournal(run_id="run1", journal_dir=self.tmp.name)
+        journal.start(patch_dir="patches", poc_list=["CVE-2023-1"])
+        journal.record({"name": "CVE-2023-1", "commit": "abc"}, "patches/a.patch")
+        # A crash in the middle of a line leaves it cut short
+        with open(journal.journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"type": "result", "key": "CVE-2023-2|", "bench')
+
+        resumed = RunJournal(run_id="run1", journal_dir=self.tmp.name)
+        resumed.start(patch_dir="other")
+        self.assertEqual(resumed.get_header()["patch_dir"], "patches")
+        completed = resumed.completed()
+        self.assertEqual(list(completed), [RunJournal.key("CVE-2023-1", "patches/a.patch")])
+        self.assertEqual(completed[RunJournal.key("CVE-2023-1", "patches/a.patch")]["commit"], "abc")
+
+    def test_pending_patch(self):
+        completed = {RunJournal.key("CVE-2023-1", "m1/a.patch"): {"model": "m1"}}
+        patch, done = Manage.pending_patch("CVE-2023-1", "m1/a.patch", completed)
+        self.assertEqual((patch, done), (None, [{"model": "m1"}]))
+        # In matrix mode only the models not in the journal are left
+        patch, done = Manage.pending_patch("CVE-2023-1", {"m1": "m1/a.patch", "m2": "m2/a.patch"}, completed)
+        self.assertEqual((patch, done), ({"m2": "m2/a.patch"}, [{"model": "m1"}]))
+        self.assertEqual(Manage.pending_patch("CVE-2023-3", "", completed), ("", []))
+
+
+if __name__ == '__main__':
+    unittest.main()
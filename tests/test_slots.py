@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import Slots
+
+
+class TestSlots(unittest.TestCase):
+    def test_unlimited(self):
+        slots = Slots(0)
+        self.assertEqual(slots.acquire(5), 5)
+        self.assertEqual(slots.acquire(100), 100)
+        slots.release(105)
+        self.assertEqual(slots.used, 0)
+
+    def test_capped_at_total(self):
+        slots = Slots(2)
+        # More than the total never deadlocks, it takes them all
+        with slots.hold(3) as taken:
+            self.assertEqual((taken, slots.used), (2, 2))
+        self.assertEqual(slots.used, 0)
+
+    def test_release_wakes_waiter(self):
+        slots = Slots(1)
+        slots.acquire()
+        acquired = threading.Event()
+
+        def waiter():
+            slots.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=waiter, daemon=True)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        slots.release()
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(slots.used, 1)
+
+    def test_resize(self):
+        slots = Slots(1)
+        slots.acquire()
+        acquired = threading.Event()
+        threading.Thread(target=lambda: (slots.acquire(), acquired.set()), daemon=True).start()
+        self.assertFalse(acquired.wait(0.2))
+        slots.resize(2)
+        self.assertTrue(acquired.wait(5))
+        # Shrinking does not take slots back, they are given back as they are released
+        slots.resize(1)
+        slots.release(2)
+        self.assertEqual(slots.used, 0)
+
+if __name__ == '__main__':
+    unittest.main()
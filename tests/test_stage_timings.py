@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Data.StageTimings import StageTimings
+from Manage import Manage
+
+
+class TestStageTimings(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.timings = StageTimings(os.path.join(self.tmp.name, "stage_timings.json"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def bench_result(name: str, prepare: float, execute: float) -> dict:
+        return {"name": name, "commit": "abc",
+                "timing": {"prepare": {"clone": 1.0, "patch": 0.5, "total": prepare}, "execute": execute,
+                           "ori": {"exec": 3.0, "patch": 0.0, "total": 4.0},
+                           "patched": {"exec": 5.0, "patch": 2.0, "total": 8.0}}}
+
+    def test_get_stages(self):
+        stages = StageTimings.get_stages(self.bench_result("a", 10.0, 9.0))
+        self.assertEqual(stages["prepare"], 10.0)
+        self.assertEqual(stages["execute"], 9.0)
+        self.assertEqual(stages["patch_download"], 0.5)
+        # The longer of the concurrent lanes counts
+        self.assertEqual((stages["exec"], stages["apply"]), (5.0, 2.0))
+
+    def test_estimate_median(self):
+        for total in (30.0, 10.0, 20.0):
+            self.timings.record({"name": "a", "commit": "abc", "timing": {"total": total}})
+        self.assertEqual(self.timings.estimate("A", "abc"), 20.0)
+        self.assertIsNone(self.timings.estimate("b", "abc"))
+        # Reloaded from the file
+        self.assertEqual(StageTimings(self.timings.timings_path).estimate("a", "abc"), 20.0)
+
+    def test_makespan(self):
+        self.assertEqual(StageTimings.makespan([5, 3, 2], jobs=1), 10)
+        self.assertEqual(StageTimings.makespan([5, 3, 2], jobs=2), 5)
+        self.assertEqual(StageTimings.makespan([2, 3, 5], jobs=2), 7)
+        self.assertEqual(StageTimings.makespan([], jobs=2), 0)
+
+    def test_order_lpt(self):
+        for name, total in (("a", 1.0), ("b", 9.0)):
+            self.timings.record({"name": name, "commit": "abc", "timing": {"total": total}})
+        # A POC that never ran gets the mean of the known ones
+        self.assertEqual(self.timings.order_lpt([("a", "abc"), ("c", "abc"), ("b", "abc")]), ["b", "c", "a"])
+        self.assertEqual(StageTimings(os.path.join(self.tmp.name, "none.json")).order_lpt([("a", "x"), ("b", "x")]),
+                         ["a", "b"])
+
+    def test_record_timing_total(self):
+        # The total is the same whether the preparation was prefetched or not
+        manage = Manage.__new__(Manage)
+        manage.stage_timings = self.timings
+        bench_result = self.bench_result("a", 10.0, 9.0)
+        manage.record_timing(bench_result, 9.0)
+        self.assertEqual(bench_result["timing"]["total"], 19.0)
+        self.assertEqual(self.timings.estimate("a", "abc"), 19.0)
+        self.assertEqual(self.timings.estimate("a", "abc", stage="execute"), 9.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
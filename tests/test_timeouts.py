@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+__author__ = 'WILL_V'
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Manage as manage_module
+from Manage import Manage
+
+
+class TestTimeouts(unittest.TestCase):
+    def get_timeouts(self, config_timeouts, poc_timeout=None) -> dict:
+        with mock.patch.object(manage_module, "load_config", return_value={"Timeout": config_timeouts}):
+            return Manage.get_timeouts(poc_timeout)
+
+    def test_defaults(self):
+        self.assertEqual(self.get_timeouts(None), {"apply": 0, "check": 0, "deploy": 0, "exec": 0, "poc": 0})
+        self.assertEqual(self.get_timeouts({"exec": 60, "deploy": "600"})["exec"], 60.0)
+        self.assertEqual(self.get_timeouts({"exec": 60, "deploy": "600"})["deploy"], 600.0)
+
+    def test_poc_overrides_config(self):
+        config_timeouts = {"exec": 60, "poc": 900}
+        # A number is the deadline of the whole POC
+        self.assertEqual(self.get_timeouts(config_timeouts, 300), {"apply": 0, "check": 0, "deploy": 0, "exec": 60.0,
+                                                                   "poc": 300.0})
+        # A dictionary overrides the stages it names, the others keep the config
+        timeouts = self.get_timeouts(config_timeouts, {"exec": 120, "check": 5})
+        self.assertEqual((timeouts["exec"], timeouts["check"], timeouts["poc"]), (120.0, 5.0, 900.0))
+
+    def test_invalid(self):
+        timeouts = self.get_timeouts({"exec": "soon", "apply": -5, "unknown": 10}, {"check": None})
+        self.assertEqual(timeouts, {"apply": 0.0, "check": 0.0, "deploy": 0, "exec": 0, "poc": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
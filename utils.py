@@ -5,6 +5,8 @@ import logging
 import yaml
 import os
 import time
+import threading
+import contextlib
 
 vb_dir = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.join(vb_dir, 'config.yaml')
@@ -100,6 +102,77 @@ def get_workspace():
     return space_path
 
 
+class Slots:
+    """
+    Counting semaphore that can take several slots at once, used to cap concurrent builds and containers.
+    """
+
+    def __init__(self, total=0):
+        """
+        :param total: Number of available slots, 0 means unlimited.
+        """
+        self.total = total
+        self.used = 0
+        # Called with the number of missing slots while an acquire waits, to free slots held by idle resources
+        self.reclaim = None
+        self._cond = threading.Condition()
+
+    def resize(self, total):
+        """
+        Change the number of available slots.
+        :param total: Number of available slots, 0 means unlimited.
+        """
+        with self._cond:
+            self.total = max(0, int(total or 0))
+            self._cond.notify_all()
+
+    def acquire(self, n=1):
+        """
+        Block until n slots are free and take them all together.
+        :param n: Number of slots to take, capped at the total so it can never deadlock.
+        :return: Number of slots actually taken, to be passed back to release().
+        """
+        with self._cond:
+            if self.total > 0:
+                n = min(n, self.total)
+                while self.used + n > self.total:
+                    if self.reclaim is not None:
+                        self.reclaim(self.used + n - self.total)
+                    # Reclaimed slots are given back in the background, so the wait is polled
+                    self._cond.wait(1 if self.reclaim is not None else None)
+            self.used += n
+            return n
+
+    def try_acquire(self, n=1):
+        """
+        Take n slots if they are free right now, without waiting.
+        :param n: Number of slots to take.
+        :return: True if they were taken, to be passed back to release().
+        """
+        with self._cond:
+            if self.total > 0 and self.used + n > self.total:
+                return False
+            self.used += n
+            return True
+
+    def release(self, n=1):
+        """
+        Give back slots taken by acquire().
+        :param n: Number of slots to give back.
+        """
+        with self._cond:
+            self.used = max(0, self.used - n)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def hold(self, n=1):
+        taken = self.acquire(n)
+        try:
+            yield taken
+        finally:
+            self.release(taken)
+
+
 config = load_config()
 if config is None:
     raise ValueError("Config file is not found or invalid.")